@@ -0,0 +1,123 @@
+"""
+micro benchmark: steps/second of VirtualMachine
+the program is the loop program of `python3 -m rpvm.vm`
+
+usage:
+    python3 benchmarks/bench_vm.py [repeat]
+    python3 benchmarks/bench_vm.py --baseline 09e840e~1 [repeat]
+
+`--baseline REV` runs the same programs on rpvm of the git revision, such as
+the if/elif dispatch before 09e840e, modes it does not have are skipped.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.environ.get('RPVM_BENCH_ROOT', REPOSITORY))
+
+from rpvm import vm as rpvm_vm
+from rpvm.vm import VirtualMachine
+from RestrictedPython import safe_builtins
+
+
+SOURCE = """
+a = 1
+b = 2
+c = 3
+d = 0
+
+e = a * b * c * d
+f = a + b + c + d
+for i in range(10):
+    if i == 5:
+        break
+    if i == 3:
+        d -= 1
+        continue
+    d += 1
+
+k = [d]
+g = e // f + d
+k.append(g)
+"""
+
+# deep expression stack, 2000 operands before BUILD_LIST
+SOURCE_DEEP = "b = 1\na = [" + ", ".join("b + {}".format(i) for i in range(2000)) + "]\n"
+
+
+def bench_exec(code, repeat) -> (int, float):
+    """drive the VM one instruction at a time by `exec()`"""
+    steps = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        vm = VirtualMachine(code, safe_builtins.copy(), dict(), dict())
+        while not vm.finish:
+            vm.exec()
+            steps += 1
+    return steps, time.perf_counter() - start
+
+
+def bench_run(code, repeat, **kwargs) -> (int, float):
+    """drive the VM by `run()`"""
+    steps = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        vm = VirtualMachine(code, safe_builtins.copy(), dict(), dict(), **kwargs)
+        steps += vm.run(10 ** 9)[0]
+    return steps, time.perf_counter() - start
+
+
+def main(repeat=2000):
+    programs = (
+        ('loop', compile(SOURCE, '<bench>', 'exec'), repeat),
+        ('deep', compile(SOURCE_DEEP, '<bench>', 'exec'), max(1, repeat // 100)),
+    )
+    modes = [('exec', bench_exec)]
+    if hasattr(VirtualMachine, 'run'):
+        modes.append(('run', bench_run))
+        modes.append(('run+opt', lambda code, n: bench_run(code, n, optimize=True)))
+    if hasattr(rpvm_vm, 'BLOCKS'):
+        blocks = rpvm_vm.BLOCKS
+        modes.append(('blocks', lambda code, n: bench_run(code, n, engine=blocks)))
+        modes.append(('blocks+opt', lambda code, n: bench_run(code, n, optimize=True, engine=blocks)))
+    for program, code, n in programs:
+        for name, fnc in modes:
+            best = None
+            try:
+                for _ in range(5):
+                    steps, elapsed = fnc(code, n)
+                    if best is None or elapsed < best:
+                        best = elapsed
+            except Exception as e:
+                # an older revision may not implement every opcode
+                print("{:5} {:10} {!r}".format(program, name, e))
+                continue
+            print("{:5} {:10} {:8} steps {:8.3f}s {:12,.0f} steps/s".format(
+                program, name, steps, best, steps / best))
+
+
+def baseline(revision, repeat) -> int:
+    """run this benchmark on rpvm of the git revision in a new process"""
+    archive = subprocess.check_output(['git', 'archive', revision, 'rpvm'], cwd=REPOSITORY)
+    with tempfile.TemporaryDirectory() as root:
+        with tempfile.TemporaryFile() as fp:
+            fp.write(archive)
+            fp.seek(0)
+            tarfile.open(fileobj=fp).extractall(root)
+        env = dict(os.environ, RPVM_BENCH_ROOT=root)
+        return subprocess.call([sys.executable, os.path.abspath(__file__), str(repeat)], env=env)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='steps/second of VirtualMachine')
+    parser.add_argument('repeat', nargs='?', type=int, default=2000)
+    parser.add_argument('--baseline', metavar='REV', help='git revision of rpvm to measure instead')
+    options = parser.parse_args()
+    if options.baseline:
+        sys.exit(baseline(options.baseline, options.repeat))
+    main(options.repeat)
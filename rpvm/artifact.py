@@ -0,0 +1,169 @@
+"""
+artifact format
+
+    header: magic, version, python magic number, max stack, code size
+    body: marshalled code object, marshalled (ops, opargs, args, offsets) of the Program
+
+an artifact is a file named by sha256 of the contract source, so identical
+contracts share one file. a file is written to a temporary name and renamed,
+processes sharing a directory never read a partial artifact.
+max stack is NO_MAX_STACK when the code was not verified.
+"""
+from rpvm.decode import Program, preload, decode as decode_code
+from rpvm.verify import verify as verify_code
+from types import CodeType
+from hashlib import sha256
+from importlib.util import MAGIC_NUMBER
+from threading import Lock
+import marshal
+import struct
+import mmap
+import os
+
+
+MAGIC = b'RPVA'
+ARTIFACT_VERSION = 2
+HEADER = struct.Struct('>4sB4sII')  # magic, version, python magic, max stack, code size
+NO_MAX_STACK = 0xffffffff
+
+
+class ArtifactError(ValueError):
+    pass
+
+
+def source_key(source) -> str:
+    """address of the contract source"""
+    if isinstance(source, str):
+        source = source.encode()
+    return sha256(source).hexdigest()
+
+
+def encode(program: Program) -> bytes:
+    code = marshal.dumps(program.code)
+    stream = marshal.dumps((program.ops, program.opargs, program.args, program.offsets))
+    max_stack = NO_MAX_STACK if program.max_stack is None else program.max_stack
+    return HEADER.pack(MAGIC, ARTIFACT_VERSION, MAGIC_NUMBER, max_stack, len(code)) + code + stream
+
+
+def decode(data) -> Program:
+    """Program of an artifact, data is bytes or a mapped file"""
+    if len(data) < HEADER.size:
+        raise ArtifactError('too short artifact')
+    magic, version, python_magic, max_stack, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ArtifactError('not an artifact')
+    if version != ARTIFACT_VERSION:
+        raise ArtifactError('unsupported artifact version {}'.format(version))
+    if python_magic != MAGIC_NUMBER:
+        raise ArtifactError('artifact of another python version')
+    with memoryview(data) as view:
+        try:
+            code = marshal.loads(view[HEADER.size:HEADER.size + size])
+            ops, opargs, args, offsets = marshal.loads(view[HEADER.size + size:])
+        except (EOFError, ValueError, TypeError) as e:
+            raise ArtifactError('broken artifact: {}'.format(e))
+    if not isinstance(code, CodeType) or not len(ops) == len(opargs) == len(args) or \
+            (offsets is not None and len(offsets) != len(ops)):
+        raise ArtifactError('broken artifact')
+    program = Program(code, ops, opargs, args, offsets=offsets)
+    if max_stack != NO_MAX_STACK:
+        program.max_stack = max_stack
+    return program
+
+
+class ArtifactStore(object):
+    """
+    directory of precompiled contracts shared by processes
+    load() of a known source is a hash lookup and a mapped file, no compile
+    nor decode. loaded Programs are given to rpvm.decode, so VMs and verify
+    use them without decoding again.
+    """
+
+    def __init__(self, path, compiler=compile, verify=True, supported=None) -> None:
+        """
+        :param path: directory of artifacts, created if not exists
+        :param compiler: `compiler(source, filename, 'exec')` such as compile_restricted,
+            use one directory per compiler
+        :param verify: verify code before stored, malformed code is never stored
+        :param supported: opcodes allowed by verify, SUPPORTED_OPS of rpvm.vm if None
+        """
+        if supported is None:
+            from rpvm.vm import SUPPORTED_OPS as supported
+        self.path = path
+        self.compiler = compiler
+        self.verify = verify
+        self.supported = supported
+        self.hits = 0  # found in memory or on disk
+        self.compiled = 0
+        self._loaded = dict()  # key -> Program
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def __contains__(self, source):
+        key = source_key(source)
+        return key in self._loaded or os.path.exists(self._file(key))
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key[2:] + '.rpva')
+
+    def load(self, source, filename='<contract>') -> CodeType:
+        """code object of the source, compiled and stored only at the first time"""
+        return self.program(source, filename).code
+
+    def program(self, source, filename='<contract>') -> Program:
+        key = source_key(source)
+        program = self._loaded.get(key)
+        if program is None:
+            program = self._read(key)
+            if program is None:
+                program = self._build(key, source, filename)
+            else:
+                self.hits += 1
+                preload(program)
+            with self._lock:
+                program = self._loaded.setdefault(key, program)
+        else:
+            self.hits += 1
+        return program
+
+    def _read(self, key: str):
+        try:
+            with open(self._file(key), 'rb') as fp:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return decode(data)
+        except FileNotFoundError:
+            return None
+        except (ArtifactError, ValueError, OSError):
+            return None  # another python version or broken, built again
+
+    def _build(self, key: str, source, filename) -> Program:
+        code = self.compiler(source, filename, 'exec')
+        if self.verify:
+            program = verify_code(code, self.supported)
+        else:
+            program = decode_code(code)
+        self.compiled += 1
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            fp.write(encode(program))
+        os.replace(tmp, path)
+        return program
+
+    def remove(self, source) -> None:
+        key = source_key(source)
+        with self._lock:
+            self._loaded.pop(key, None)
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+
+__all__ = [
+    "ARTIFACT_VERSION",
+    "ArtifactError",
+    "ArtifactStore",
+    "source_key",
+]
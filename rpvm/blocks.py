@@ -0,0 +1,94 @@
+from rpvm.opcodes import *
+from rpvm.decode import Program, DECODE_CACHE_SIZE
+from rpvm.gas import DYNAMIC_OPS
+from rpvm.optimizer import jump_targets
+from functools import lru_cache
+
+
+# instructions which may move pc or finish the VM, a block ends with them
+TERMINATORS = frozenset(hasjrel + hasjabs + [
+    BREAK_LOOP, RETURN_VALUE, RAISE_VARARGS, END_FINALLY, YIELD_VALUE, YIELD_FROM,
+    NAME_CONST_COMPARE_JUMP])
+
+# instructions priced by the stack, the VM executes them one by one
+UNBLOCKED = frozenset(DYNAMIC_OPS + (CONST_TUPLE,))
+
+
+class Block(object):
+    """
+    straight instructions of [start, end) compiled into one function
+    `fnc(vm)` sets vm.pc before each handler, it returns True when finished
+    or the running frame is switched.
+    """
+    __slots__ = ('start', 'end', 'fnc')
+
+    def __init__(self, start, end, fnc):
+        self.start = start
+        self.end = end
+        self.fnc = fnc
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return "<Block {}-{}>".format(self.start, self.end)
+
+
+def split_blocks(program: Program) -> list:
+    """[(start, end),..] of basic blocks, an UNBLOCKED instruction makes no block"""
+    ops = program.ops
+    widths = program.widths
+    leaders = jump_targets(program)
+    spans = list()
+    start = index = 0
+    while index < len(ops):
+        op = ops[index]
+        if op in UNBLOCKED:
+            if start < index:
+                spans.append((start, index))
+            start = index = index + widths[index]
+            continue
+        index += widths[index]
+        if op in TERMINATORS or index in leaders:
+            spans.append((start, index))
+            start = index
+    if start < len(ops):
+        spans.append((start, len(ops)))
+    return spans
+
+
+def compile_block(program: Program, start, end) -> Block:
+    """generate a function calling the handlers of instructions in order"""
+    namespace = dict()
+    lines = ["def block(vm):", "    dispatch = vm._dispatch"]
+    index = start
+    while index < end:
+        head = index
+        index += program.widths[head]
+        namespace['a{}'.format(head)] = program.args[head]
+        lines.append("    vm.pc = {}".format(index))
+        lines.append("    {}dispatch[{}](vm, a{})".format(
+            'return ' if end <= index else '', program.ops[head], head))
+    exec(compile("\n".join(lines), "<block {}-{}>".format(start, end), 'exec'), namespace)
+    return Block(start, end, namespace['block'])
+
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def blocks(program: Program) -> tuple:
+    """
+    basic blocks of the program indexed by start pc, None where no block starts
+    a block of one instruction is left to the interpreter.
+    """
+    table = [None] * len(program)
+    for start, end in split_blocks(program):
+        if 1 < end - start and program.widths[start] < end - start:
+            table[start] = compile_block(program, start, end)
+    return tuple(table)
+
+
+__all__ = [
+    "Block",
+    "split_blocks",
+    "compile_block",
+    "blocks",
+]
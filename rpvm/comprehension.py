@@ -0,0 +1,258 @@
+"""
+fast path of simple comprehensions
+
+a comprehension loop whose body only loads the loop variables and constants,
+computes with operators, filters by conditions and appends the result is
+compiled into one function called per element. `FastLoop.run()` executes
+many elements in one call of the run loop, and charges each element the
+steps and gas of the original instructions on the path it took.
+
+    FOR_ITER end
+    STORE_FAST x  (or UNPACK_SEQUENCE n, STORE_FAST x n times)
+    ... LOAD_FAST, LOAD_CONST, operators, POP_JUMP_IF_FALSE/TRUE to FOR_ITER
+    LIST_APPEND 2  (or SET_ADD 2, MAP_ADD 2)
+    JUMP_ABSOLUTE FOR_ITER
+end:
+
+an element raising an exception or not fitting the budget is left to the
+interpreter just after its FOR_ITER, so errors, OUT_OF_STEPS and OUT_OF_GAS
+happen at the same instruction as without the fast path.
+"""
+from rpvm.opcodes import *
+from rpvm.decode import Program, DECODE_CACHE_SIZE
+from rpvm.gas import DYNAMIC_OPS
+from rpvm.limits import CHECKED_OPS, SEQUENCE_TYPES
+from functools import lru_cache
+
+
+BINARY_SYMBOLS = {
+    BINARY_POWER: '**', BINARY_MULTIPLY: '*', BINARY_MATRIX_MULTIPLY: '@',
+    BINARY_FLOOR_DIVIDE: '//', BINARY_TRUE_DIVIDE: '/', BINARY_MODULO: '%',
+    BINARY_ADD: '+', BINARY_SUBTRACT: '-', BINARY_LSHIFT: '<<', BINARY_RSHIFT: '>>',
+    BINARY_AND: '&', BINARY_XOR: '^', BINARY_OR: '|',
+}
+UNARY_SYMBOLS = {UNARY_POSITIVE: '+', UNARY_NEGATIVE: '-', UNARY_NOT: 'not ', UNARY_INVERT: '~'}
+COMPARE_SYMBOLS = ('<', '<=', '==', '!=', '>', '>=', 'in', 'not in', 'is', 'is not')
+
+# appending opcode -> number of operands
+APPEND_OPS = {LIST_APPEND: 1, SET_ADD: 1, MAP_ADD: 2}
+
+
+class FastLoop(object):
+    """
+    comprehension loop of [start, end) compiled by `fast_loops()`
+    paths: original opcodes executed by an element, 0 is the appended one,
+        others are filtered out by a condition
+    """
+    __slots__ = ('start', 'end', 'append', 'slots', 'unpack', 'paths', 'fnc')
+
+    def __init__(self, start, end, append, slots, unpack, paths, fnc):
+        self.start = start
+        self.end = end
+        self.append = append
+        self.slots = slots
+        self.unpack = unpack
+        self.paths = paths
+        self.fnc = fnc
+
+    def __repr__(self):
+        return "<FastLoop {}-{}>".format(self.start, self.end)
+
+    def run(self, vm, max_steps, max_gas, op_costs) -> (int, int):
+        """
+        execute elements from the FOR_ITER on the pc within the budget
+        :return: (steps, gas, error) used, (0, 0, None) when even FOR_ITER does not fit,
+            error is an exception raised by the iterator which the VM raises
+        """
+        costs = [(len(ops), sum(op_costs[op] for op in ops if 0 <= op_costs[op])) for ops in self.paths]
+        for_iter = op_costs[FOR_ITER]
+        fnc = self.fnc
+        meter = vm._meter
+        check = vm._check_size
+        stack = vm.stack
+        iterator = stack[-1]
+        container = stack[-2]
+        append = self.append
+        steps = gas = 0
+        last = _none
+        error = None
+        while steps < max_steps and gas + for_iter <= max_gas:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stack.pop()
+                vm.pc = self.end
+                steps += 1
+                gas += for_iter
+                break
+            except Exception as e:
+                vm.pc = self.start + 1
+                steps += 1
+                gas += for_iter
+                error = e
+                break
+            try:
+                path, value, cost = fnc(item, meter, check)
+                size, static = costs[path]
+                cost += static
+                # not fit, the interpreter stops at the exact instruction
+                fit = steps + size <= max_steps and gas + cost <= max_gas
+                if fit and path == 0:
+                    if append == LIST_APPEND:
+                        container.append(value)
+                    elif append == SET_ADD:
+                        container.add(value)
+                    else:
+                        container[value[0]] = value[1]
+            except Exception:
+                fit = False
+            if not fit:
+                # the element is already taken by FOR_ITER, the interpreter does the rest
+                if last is not _none:
+                    self._store(vm.fastlocals, last)
+                stack.append(item)
+                vm.pc = self.start + 1
+                return steps + 1, gas + for_iter, None
+            steps += size
+            gas += cost
+            last = item
+        if last is not _none:
+            # loop variables keep the last element as the interpreter stores them
+            self._store(vm.fastlocals, last)
+        return steps, gas, error
+
+    def _store(self, fastlocals, item):
+        if not self.unpack:
+            fastlocals[self.slots[0]] = item
+        else:
+            for slot, value in zip(self.slots, item):
+                fastlocals[slot] = value
+
+
+_none = object()
+
+
+def _jumps_into(program: Program, start, end) -> bool:
+    """some instruction jumps into (start, end - 1) of the original instructions"""
+    for op, arg in zip(program.base_ops, program.base_args):
+        if (op in hasjrel or op in hasjabs) and start < arg < end - 1:
+            return True
+    return False
+
+
+def compile_loop(program: Program, start):
+    """FastLoop of the FOR_ITER at start, None if the loop is not simple"""
+    ops = program.base_ops
+    args = program.base_args
+    opargs = program.opargs
+    end = args[start]
+    if end - 2 <= start or len(ops) <= end:
+        return None
+    append = ops[end - 2]
+    if append not in APPEND_OPS or opargs[end - 2] != 2 or \
+            ops[end - 1] != JUMP_ABSOLUTE or args[end - 1] != start:
+        return None
+    # loop variables
+    index = start + 1
+    unpack = ops[index] == UNPACK_SEQUENCE
+    if ops[index] == STORE_FAST:
+        slots = (args[index],)
+        index += 1
+    elif unpack and 0 < args[index] and \
+            all(op == STORE_FAST for op in ops[index + 1:index + 1 + args[index]]):
+        slots = tuple(args[index + 1:index + 1 + args[index]])
+        index += 1 + len(slots)
+        if len(set(slots)) != len(slots):
+            return None
+    else:
+        return None
+    if end - 2 < index or _jumps_into(program, start, end):
+        return None
+    names = ['v{}'.format(slot) for slot in slots]
+    lines = ["def body(item, meter, check):",
+             "    {}{} = item".format(', '.join(names), ',' if unpack else ''),
+             "    g = 0"]
+    namespace = {'sequences': SEQUENCE_TYPES}
+    paths = [list(ops[start:end])]
+    stack = list()
+    for i in range(index, end - 2):
+        op = ops[i]
+        arg = args[i]
+        if op == LOAD_FAST:
+            if arg not in slots:
+                return None
+            stack.append('v{}'.format(arg))
+            continue
+        if op == LOAD_CONST:
+            namespace['c{}'.format(i)] = arg
+            stack.append('c{}'.format(i))
+            continue
+        if op == DUP_TOP and stack:
+            stack.append(stack[-1])
+            continue
+        if op == ROT_TWO and 2 <= len(stack):
+            stack[-2:] = [stack[-1], stack[-2]]
+            continue
+        if op == ROT_THREE and 3 <= len(stack):
+            stack[-3:] = [stack[-1], stack[-3], stack[-2]]
+            continue
+        if op in (POP_JUMP_IF_FALSE, POP_JUMP_IF_TRUE) and len(stack) == 1:
+            if arg == start:
+                path = list(ops[start:i + 1])
+            elif arg == end - 1:
+                path = list(ops[start:i + 1]) + [JUMP_ABSOLUTE]
+            else:
+                return None
+            paths.append(path)
+            lines.append("    if {}{}:".format('not ' if op == POP_JUMP_IF_FALSE else '', stack.pop()))
+            lines.append("        return {}, None, g".format(len(paths) - 1))
+            continue
+        temp = 't{}'.format(i)
+        if op in UNARY_SYMBOLS and stack:
+            expr = '{}{}'.format(UNARY_SYMBOLS[op], stack.pop())
+        elif (op in BINARY_SYMBOLS or op == BINARY_SUBSCR) and 2 <= len(stack):
+            right = stack.pop()
+            left = stack.pop()
+            if op in DYNAMIC_OPS:
+                lines.append("    g += meter({}, None, ({}, {}))".format(op, left, right))
+            elif op in CHECKED_OPS:
+                lines.append("    if isinstance({}, sequences):".format(left))
+                lines.append("        check({}, None, ({}, {}))".format(op, left, right))
+            if op == BINARY_SUBSCR:
+                expr = '{}[{}]'.format(left, right)
+            else:
+                expr = '{} {} {}'.format(left, BINARY_SYMBOLS[op], right)
+        elif op == COMPARE_OP and arg < len(COMPARE_SYMBOLS) and 2 <= len(stack):
+            right = stack.pop()
+            left = stack.pop()
+            expr = '{} {} {}'.format(left, COMPARE_SYMBOLS[arg], right)
+        else:
+            return None
+        lines.append("    {} = {}".format(temp, expr))
+        stack.append(temp)
+    if len(stack) != APPEND_OPS[append]:
+        return None
+    # MAP_ADD of Python3.6, TOS is the key
+    value = stack[0] if append != MAP_ADD else '({}, {})'.format(stack[1], stack[0])
+    lines.append("    return 0, {}, g".format(value))
+    exec(compile("\n".join(lines), "<comprehension {}-{}>".format(start, end), 'exec'), namespace)
+    return FastLoop(start, end, append, slots, unpack, tuple(paths), namespace['body'])
+
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def fast_loops(program: Program):
+    """FastLoop indexed by the pc of its FOR_ITER, None if the program has no one"""
+    table = [None] * len(program)
+    found = False
+    for index, op in enumerate(program.base_ops):
+        if op == FOR_ITER:
+            table[index] = compile_loop(program, index)
+            found = found or table[index] is not None
+    return tuple(table) if found else None
+
+
+__all__ = [
+    "FastLoop",
+    "compile_loop",
+    "fast_loops",
+]
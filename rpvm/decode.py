@@ -0,0 +1,113 @@
+from rpvm.opcodes import *
+from rpvm.frontend import NATIVE, translate
+from types import CodeType
+from functools import lru_cache
+
+
+DECODE_CACHE_SIZE = 1024  # number of code objects
+_preloaded = dict()  # code -> Program decoded in advance, see preload()
+
+
+class Program(object):
+    """
+    decoded instruction stream of one code object
+    an instruction of Python3.6 bytecode is indexed by `offset // 2`, so the
+    program counter is an index of `ops` and jump targets are indexes too.
+    bytecode of other hosts is translated to same instructions by rpvm.frontend.
+
+    ops: opcode of each instruction
+    opargs: raw oparg (EXTENDED_ARG folded)
+    args: resolved operand, a name, a constant or a jump target index,
+        fast local opcodes keep the slot index
+    widths: number of original instructions executed by the instruction,
+        more than 1 only for superinstructions of rpvm.optimizer
+    base_ops, base_args: original instructions before optimized
+    max_stack: max stack depth found by rpvm.verify or stored in an artifact,
+        None if not verified
+    offsets: host bytecode offset of each instruction, None if `index * 2`
+    """
+    __slots__ = ('code', 'ops', 'opargs', 'args', 'widths', 'base_ops', 'base_args',
+                 'max_stack', 'offsets', '__weakref__')
+
+    def __init__(self, code: CodeType, ops: bytes, opargs: tuple, args: tuple,
+                 widths: tuple = None, base_ops: bytes = None, base_args: tuple = None,
+                 offsets: tuple = None) -> None:
+        self.code = code
+        self.ops = ops
+        self.opargs = opargs
+        self.args = args
+        self.widths = widths or (1,) * len(ops)
+        self.base_ops = base_ops or ops
+        self.base_args = base_args or args
+        self.max_stack = None
+        self.offsets = offsets
+
+    def offset(self, index: int) -> int:
+        """host bytecode offset of the instruction"""
+        return index * 2 if self.offsets is None else self.offsets[index]
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __repr__(self):
+        return "<Program {} size={}>".format(self.code.co_name, len(self.ops))
+
+
+def _decode(code: CodeType) -> Program:
+    program = _preloaded.pop(code, None)
+    if program is not None:
+        return program
+    if not NATIVE:
+        ops, opargs, args, offsets = translate(code)
+        return Program(code, ops, opargs, args, offsets=offsets)
+    co_code = code.co_code
+    if len(co_code) % 2:
+        raise ValueError('bytecode size is not even')
+    ops = co_code[0::2]
+    opargs = list()
+    args = list()
+    ext = 0
+    for index, op in enumerate(ops):
+        oparg = ext | co_code[index * 2 + 1]
+        ext = (oparg << 8) if op == EXTENDED_ARG else 0
+        if op in hasconst:
+            if len(code.co_consts) <= oparg:
+                raise ValueError('const index {} out of range at {}'.format(oparg, index))
+            arg = code.co_consts[oparg]
+        elif op in hasname:
+            if len(code.co_names) <= oparg:
+                raise ValueError('name index {} out of range at {}'.format(oparg, index))
+            arg = code.co_names[oparg]
+        elif op in hasjrel:
+            arg = index + 1 + oparg // 2
+        elif op in hasjabs:
+            arg = oparg // 2
+        else:
+            arg = oparg
+        opargs.append(oparg)
+        args.append(arg)
+    return Program(code, bytes(ops), tuple(opargs), tuple(args))
+
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def decode(code: CodeType) -> Program:
+    """
+    decode bytecode to Program, decoded once per code object
+    equal code objects share one Program, so thousands VMs of a same contract
+    do not decode again.
+    """
+    return _decode(code)
+
+
+def preload(program: Program) -> None:
+    """give a Program loaded from rpvm.artifact, decode() returns it instead of decoding"""
+    if program.code not in _preloaded:
+        _preloaded[program.code] = program
+
+
+__all__ = [
+    "DECODE_CACHE_SIZE",
+    "Program",
+    "decode",
+    "preload",
+]
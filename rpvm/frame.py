@@ -0,0 +1,163 @@
+from types import CodeType
+from inspect import CO_VARARGS, CO_VARKEYWORDS, CO_GENERATOR, CO_COROUTINE, \
+    CO_ITERABLE_COROUTINE, CO_ASYNC_GENERATOR
+import marshal
+
+
+# code of these flags needs a suspended frame, the VM does not make them
+UNSUPPORTED_FLAGS = CO_GENERATOR | CO_COROUTINE | CO_ITERABLE_COROUTINE | CO_ASYNC_GENERATOR
+
+
+class Cell(object):
+    """
+    variable shared by a function and its inner functions
+    `contents` is not set while the variable is unbound.
+    """
+    __slots__ = ('contents',)
+
+    def __repr__(self):
+        return "<Cell {}>".format('empty' if not hasattr(self, 'contents') else type(self.contents).__name__)
+
+
+class Function(object):
+    """
+    function made by MAKE_FUNCTION in a VM
+    a call of it inside the VM pushes a frame and runs the code step by step
+    with the globals of the calling VM. other callers such as builtins cannot
+    call it, it raises TypeError.
+    """
+    __slots__ = ('code', 'name', 'qualname', 'defaults', 'kwdefaults',
+                 'closure', 'annotations', '__weakref__')
+
+    def __init__(self, code: CodeType, qualname: str, defaults: tuple = None,
+                 kwdefaults: dict = None, closure: tuple = None, annotations: dict = None) -> None:
+        self.code = code
+        self.name = code.co_name
+        self.qualname = qualname
+        self.defaults = defaults or ()
+        self.kwdefaults = kwdefaults
+        self.closure = closure or ()
+        self.annotations = annotations
+
+    def __call__(self, *args, **kwargs):
+        raise TypeError('function `{}` of the VM is called outside the VM'.format(self.qualname))
+
+    def __reduce__(self):
+        # to pass a function between processes, a snapshot stores the code by its path instead
+        return _rebuild, (marshal.dumps(self.code), self.qualname, self.defaults,
+                          self.kwdefaults, self.closure, self.annotations)
+
+    def __repr__(self):
+        return "<Function {}>".format(self.qualname)
+
+
+def _rebuild(data, qualname, defaults, kwdefaults, closure, annotations) -> Function:
+    return Function(marshal.loads(data), qualname, defaults, kwdefaults, closure, annotations)
+
+
+class Frame(object):
+    """
+    state of a caller saved while its callee runs
+    VM keeps the running frame in its own attributes, a call swaps them with
+    a Frame taken from the free list. spare lists of a free frame become the
+    stack and fast locals of the callee, so a call does not allocate them.
+    """
+    __slots__ = ('code', 'program', 'caches', 'handlers', 'pc', 'stack', 'handling', 'fastlocals', 'cells')
+
+    def __init__(self) -> None:
+        self.code = None
+        self.program = None
+        self.caches = None
+        self.handlers = None
+        self.pc = 0
+        self.stack = list()
+        self.handling = list()
+        self.fastlocals = list()
+        self.cells = ()
+
+    def __repr__(self):
+        return "<Frame {} pc={}>".format(self.code and self.code.co_name, self.pc)
+
+
+def bind(function: Function, args, kwargs, fastlocals: list, unbound) -> None:
+    """
+    fill empty fastlocals with arguments as Python3.6 ceval does
+    raise TypeError if arguments do not match, fastlocals is left dirty then.
+
+    :param unbound: marker of an empty slot
+    """
+    code = function.code
+    name = function.name
+    argcount = code.co_argcount
+    total = argcount + code.co_kwonlyargcount
+    fastlocals.extend([unbound] * code.co_nlocals)
+    given = min(len(args), argcount)
+    fastlocals[:given] = args[:given]
+    index = total
+    if code.co_flags & CO_VARARGS:
+        fastlocals[index] = tuple(args[argcount:])
+        index += 1
+    elif argcount < len(args):
+        raise TypeError('{}() takes {} positional arguments but {} were given'
+                        .format(name, argcount, len(args)))
+    extra = None
+    if code.co_flags & CO_VARKEYWORDS:
+        extra = fastlocals[index] = dict()
+    if kwargs:
+        # positional only arguments of Python3.8 are not keywords
+        names = code.co_varnames[getattr(code, 'co_posonlyargcount', 0):total]
+        for key, value in kwargs.items():
+            if not isinstance(key, str):
+                raise TypeError('{}() keywords must be strings'.format(name))
+            if key in names:
+                slot = code.co_varnames.index(key)
+                if fastlocals[slot] is not unbound:
+                    raise TypeError('{}() got multiple values for argument `{}`'.format(name, key))
+                fastlocals[slot] = value
+            elif extra is not None:
+                extra[key] = value
+            else:
+                raise TypeError('{}() got an unexpected keyword argument `{}`'.format(name, key))
+    if given < total:
+        defaults = function.defaults
+        first = argcount - len(defaults)
+        kwdefaults = function.kwdefaults or {}
+        missing = list()
+        for slot in range(given, total):
+            if fastlocals[slot] is not unbound:
+                continue
+            if slot < argcount and first <= slot:
+                fastlocals[slot] = defaults[slot - first]
+            elif argcount <= slot and code.co_varnames[slot] in kwdefaults:
+                fastlocals[slot] = kwdefaults[code.co_varnames[slot]]
+            else:
+                missing.append(code.co_varnames[slot])
+        if missing:
+            raise TypeError('{}() missing {} required argument: {}'
+                            .format(name, len(missing), ', '.join(missing)))
+
+
+def make_cells(function: Function, fastlocals: list) -> tuple:
+    """cells of co_cellvars then the closure, an argument cell starts with its value"""
+    code = function.code
+    if not code.co_cellvars:
+        return function.closure
+    args = code.co_argcount + code.co_kwonlyargcount + \
+        bool(code.co_flags & CO_VARARGS) + bool(code.co_flags & CO_VARKEYWORDS)
+    cells = list()
+    for name in code.co_cellvars:
+        cell = Cell()
+        if name in code.co_varnames[:args]:
+            cell.contents = fastlocals[code.co_varnames.index(name)]
+        cells.append(cell)
+    return tuple(cells) + function.closure
+
+
+__all__ = [
+    "UNSUPPORTED_FLAGS",
+    "Cell",
+    "Function",
+    "Frame",
+    "bind",
+    "make_cells",
+]
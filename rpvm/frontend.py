@@ -0,0 +1,576 @@
+"""
+front-end of host bytecode
+
+rpvm executes an IR, the opcodes of Python3.6 in rpvm.opcodes and a few IR
+opcodes. translate() reads bytecode of the running CPython, 3.6 to 3.12, by
+`dis` and writes the IR, so a contract runs same instructions on any host.
+
+* host bookkeeping such as RESUME, CACHE, PRECALL and PUSH_NULL is dropped
+* renamed or split opcodes go back to the 3.6 one, such as BINARY_OP to
+  BINARY_ADD, IS_OP to COMPARE_OP and LOAD_METHOD to LOAD_ATTR
+* new short forms are expanded into the 3.6 sequence, such as
+  POP_JUMP_IF_NONE to LOAD_CONST None, COMPARE_OP and POP_JUMP_IF_FALSE
+* a list, tuple, set or dict display with * or ** and starred arguments of a
+  call, built by LIST_EXTEND, SET_UPDATE, DICT_UPDATE or DICT_MERGE since
+  3.9, go back to BUILD_*_UNPACK of 3.6 when made without jumps
+* EXTENDED_ARG is made again for IR operands, jump targets are IR indexes
+
+control flow the host compiler lays out differently, such as SETUP_LOOP
+removed in 3.8, a while condition copied to the loop end in 3.10 or the
+exception tables of 3.11, is laid out again as 3.6 by rpvm.structure, so
+loops, conditions, try, except, finally and with take same steps on every
+host. a host opcode without IR, a comprehension inlined into its function
+by 3.12 or a layout rpvm.structure can not read raises FrontendError.
+"""
+from rpvm.opcodes import *
+from rpvm import opcodes
+from types import CodeType
+import dis
+import sys
+
+
+HOST_VERSION = sys.version_info[:2]
+NATIVE = HOST_VERSION == (3, 6)  # host bytecode is the IR itself
+SYNTHETIC = -1  # oparg of an operand made by the front-end, not in the code object
+
+# host opcodes having a same meaning IR opcode of a same name
+SAME_NAMES = frozenset(
+    name for name, value in vars(opcodes).items()
+    if name.isupper() and isinstance(value, int) and name != 'HAVE_ARGUMENT' and value < 200)
+
+# host opcodes not executed by the IR, cells are made by the VM as 3.6 ceval
+DROPPED_NAMES = frozenset((
+    'NOP', 'CACHE', 'RESUME', 'PRECALL', 'PUSH_NULL', 'EXTENDED_ARG',
+    'MAKE_CELL', 'COPY_FREE_VARS', 'END_FOR'))
+
+# BINARY_OP oparg of 3.11 -> IR opcode
+BINARY_OPS = (
+    BINARY_ADD, BINARY_AND, BINARY_FLOOR_DIVIDE, BINARY_LSHIFT, BINARY_MATRIX_MULTIPLY,
+    BINARY_MULTIPLY, BINARY_MODULO, BINARY_OR, BINARY_POWER, BINARY_RSHIFT,
+    BINARY_SUBTRACT, BINARY_TRUE_DIVIDE, BINARY_XOR,
+    INPLACE_ADD, INPLACE_AND, INPLACE_FLOOR_DIVIDE, INPLACE_LSHIFT, INPLACE_MATRIX_MULTIPLY,
+    INPLACE_MULTIPLY, INPLACE_MODULO, INPLACE_OR, INPLACE_POWER, INPLACE_RSHIFT,
+    INPLACE_SUBTRACT, INPLACE_TRUE_DIVIDE, INPLACE_XOR)
+
+RENAMED = {
+    'LOAD_METHOD': LOAD_ATTR,
+    'CALL_METHOD': CALL_FUNCTION,
+    'JUMP_BACKWARD': JUMP_ABSOLUTE,
+    'JUMP_BACKWARD_NO_INTERRUPT': JUMP_ABSOLUTE,
+    'LOAD_FAST_CHECK': LOAD_FAST,
+    'POP_JUMP_FORWARD_IF_FALSE': POP_JUMP_IF_FALSE,
+    'POP_JUMP_BACKWARD_IF_FALSE': POP_JUMP_IF_FALSE,
+    'POP_JUMP_FORWARD_IF_TRUE': POP_JUMP_IF_TRUE,
+    'POP_JUMP_BACKWARD_IF_TRUE': POP_JUMP_IF_TRUE,
+    'LIST_EXTEND': LIST_EXTEND,
+    'SET_UPDATE': SET_UPDATE,
+    'DICT_UPDATE': DICT_UPDATE,
+    'DICT_MERGE': DICT_MERGE,
+    'LIST_TO_TUPLE': LIST_TO_TUPLE,
+}
+
+# jump -> `is` or `is not` compared with None before POP_JUMP_IF_FALSE
+NONE_JUMPS = {
+    'POP_JUMP_FORWARD_IF_NONE': 9, 'POP_JUMP_BACKWARD_IF_NONE': 9, 'POP_JUMP_IF_NONE': 9,
+    'POP_JUMP_FORWARD_IF_NOT_NONE': 8, 'POP_JUMP_BACKWARD_IF_NOT_NONE': 8, 'POP_JUMP_IF_NOT_NONE': 8,
+}
+
+# CALL_INTRINSIC_1 oparg of 3.12 -> IR opcode
+INTRINSICS = {5: UNARY_POSITIVE, 6: LIST_TO_TUPLE}
+
+JUMP_OPS = frozenset(hasjrel + hasjabs)
+
+# container built by a BUILD op -> ops adding an item, ops adding items of an iterable
+EXTENDED_BUILDS = {
+    BUILD_LIST: ((LIST_APPEND,), (LIST_EXTEND,)),
+    BUILD_SET: ((SET_ADD,), (SET_UPDATE,)),
+    BUILD_MAP: ((), (DICT_UPDATE, DICT_MERGE)),
+}
+
+# ops reaching items below the top, number of items
+REACHING_OPS = {ROT_TWO: 2, ROT_THREE: 3, DUP_TOP_TWO: 2}
+
+# same names as 3.6 until 3.7, the meaning of blocks changed in 3.8, these
+# and the new ones stay host ops named by a str until rpvm.structure lays
+# the statement out again, ROT_FOUR of 3.8 only moves a return value out of
+# an except clause
+BLOCK_NAMES = frozenset((
+    'SETUP_EXCEPT', 'SETUP_FINALLY', 'SETUP_WITH', 'POP_EXCEPT', 'END_FINALLY',
+    'WITH_CLEANUP_START', 'WITH_CLEANUP_FINISH', 'BEGIN_FINALLY', 'CALL_FINALLY',
+    'POP_FINALLY', 'RERAISE', 'JUMP_IF_NOT_EXC_MATCH', 'WITH_EXCEPT_START',
+    'PUSH_EXC_INFO', 'CHECK_EXC_MATCH', 'BEFORE_WITH', 'ROT_FOUR'))
+
+
+class FrontendError(ValueError):
+    pass
+
+
+class _Instruction(object):
+    __slots__ = ('op', 'oparg', 'arg', 'offset', 'target', 'line', 'first', 'handler')
+
+    def __init__(self, op, oparg, arg, offset, target=None, line=None, first=False, handler=None) -> None:
+        self.op = op
+        self.oparg = oparg  # None of a jump until laid out
+        self.arg = arg
+        self.offset = offset  # host bytecode offset
+        self.target = target  # host offset a jump goes to
+        self.line = line  # source line
+        self.first = first  # first instruction of the line
+        self.handler = handler  # host offset of the exception handler since 3.11
+
+
+def _exception_table(code: CodeType) -> list:
+    """[(start, end, handler),..] host offsets of co_exceptiontable since 3.11"""
+    table = getattr(code, 'co_exceptiontable', b'')
+    entries = list()
+    position = 0
+
+    def varint():
+        nonlocal position
+        byte = table[position]
+        position += 1
+        value = byte & 63
+        while byte & 64:
+            byte = table[position]
+            position += 1
+            value = (value << 6) | (byte & 63)
+        return value
+
+    while position < len(table):
+        start = varint() * 2
+        end = start + varint() * 2
+        handler = varint() * 2
+        varint()  # depth and lasti
+        entries.append((start, end, handler))
+    return entries
+
+
+def _prefixes(oparg) -> int:
+    """number of EXTENDED_ARG needed by the oparg"""
+    count = 0
+    while 0xff < oparg:
+        oparg >>= 8
+        count += 1
+    return count
+
+
+class _Translator(object):
+
+    def __init__(self, code: CodeType) -> None:
+        self.code = code
+        self.out = list()  # [_Instruction,..]
+        self.starts = dict()  # host offset -> first index of out emitted at or after it
+        self.names = {name: index for index, name in enumerate(code.co_names)}
+        self.derefs = code.co_cellvars + code.co_freevars
+        self.kwnames = None  # (oparg, names) of KW_NAMES until CALL
+        self.previous = None  # name of the last host instruction not dropped
+        self.line = None  # line of the host instruction
+        self.first = False  # next instruction emitted starts the line
+        self.handler = None  # handler of the host instruction since 3.11
+        self.assertions = 0  # AssertionError loaded without NULL until called since 3.11
+        self.targets = set()  # host offsets jumped to
+
+    def emit(self, op, oparg, arg, offset, target=None) -> None:
+        self.out.append(_Instruction(op, oparg, arg, offset, target, self.line, self.first, self.handler))
+        self.first = False
+
+    def const(self, value, offset) -> None:
+        """LOAD_CONST of a value, SYNTHETIC oparg if not in co_consts"""
+        oparg = SYNTHETIC
+        for index, const in enumerate(self.code.co_consts):
+            if const is value:
+                oparg = index
+                break
+        self.emit(LOAD_CONST, oparg, value, offset)
+
+    def run(self) -> None:
+        host = list(dis.get_instructions(self.code))
+        self.targets = targets = set(
+            instr.argval for instr in host if instr.opcode in dis.hasjrel or instr.opcode in dis.hasjabs)
+        lines = dict(dis.findlinestarts(self.code))
+        table = _exception_table(self.code)
+        index = 0
+        while index < len(host):
+            instr = host[index]
+            self.starts.setdefault(instr.offset, len(self.out))
+            if lines.get(instr.offset) is not None:
+                self.line = lines[instr.offset]
+                self.first = True
+            self.handler = None
+            for start, end, handler in table:
+                if start <= instr.offset < end:
+                    self.handler = handler
+                    break
+            following = host[index + 1] if index + 1 < len(host) else None
+            third = host[index + 2] if index + 2 < len(host) else None
+            if third is not None and following.offset not in targets and third.offset not in targets and \
+                    self.triple(instr, following, third):
+                self.starts.setdefault(following.offset, len(self.out))
+                self.starts.setdefault(third.offset, len(self.out))
+                self.previous = None
+                index += 3
+                continue
+            if following is not None and following.offset not in targets and \
+                    self.pair(instr, following, instr.offset in targets):
+                self.starts.setdefault(following.offset, len(self.out))
+                self.previous = None
+                index += 2
+                continue
+            self.one(instr)
+            index += 1
+
+    def triple(self, first, second, third) -> bool:
+        """three host instructions written as one IR instruction"""
+        if first.opname == 'COPY' and first.arg == 1 and third.opname == 'POP_TOP' and \
+                second.opname in ('POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE'):
+            # a value of `and` or `or` since 3.12
+            op = JUMP_IF_FALSE_OR_POP if second.opname == 'POP_JUMP_IF_FALSE' else JUMP_IF_TRUE_OR_POP
+            self.emit(op, None, None, first.offset, second.argval)
+            return True
+        return False
+
+    def pair(self, first, second, first_is_target) -> bool:
+        """two host instructions written as one IR instruction"""
+        if first.opname == second.opname == 'COPY' and first.arg == second.arg == 2:
+            self.emit(DUP_TOP_TWO, 0, 0, first.offset)
+        elif first.opname == second.opname == 'SWAP' and (first.arg, second.arg) == (3, 2):
+            self.emit(ROT_THREE, 0, 0, first.offset)
+        elif (first.opname, first.arg, second.opname, second.arg) == ('SWAP', 2, 'COPY', 2):
+            # a comparison of a chain since 3.11
+            self.emit(DUP_TOP, 0, 0, first.offset)
+            self.emit(ROT_THREE, 0, 0, first.offset)
+        elif (first.opname, first.arg, second.opname, second.arg) == ('CALL', 0, 'RAISE_VARARGS', 1) and \
+                self.assertions:
+            # AssertionError called with its message as the method of a CALL since 3.11
+            self.assertions -= 1
+            self.emit(CALL_FUNCTION, 1, 1, first.offset)
+            self.emit(RAISE_VARARGS, 1, 1, second.offset)
+        elif (first.opname, first.arg, second.opname) == ('CALL_INTRINSIC_1', 2, 'POP_TOP'):
+            self.emit(IMPORT_STAR, 0, 0, first.offset)
+        elif first.opname == 'LOAD_CONST' and (
+                (second.opname == 'LIST_EXTEND' and isinstance(first.argval, tuple)) or
+                (second.opname == 'SET_UPDATE' and isinstance(first.argval, frozenset))) and \
+                second.arg == 1 and not first_is_target and self.out and \
+                self.out[-1].op == (BUILD_LIST if second.opname == 'LIST_EXTEND' else BUILD_SET):
+            # constant list or set, LOAD_CONST of each item and BUILD_LIST same as 3.6
+            build = self.out.pop()
+            for value in first.argval:
+                self.const(value, first.offset)
+            self.emit(build.op, build.oparg + len(first.argval), build.oparg + len(first.argval), build.offset)
+        else:
+            return False
+        return True
+
+    def one(self, instr) -> None:
+        name = instr.opname
+        offset = instr.offset
+        if name == 'NOP' and self.first and not NATIVE:
+            # a line of no code such as break, rpvm.structure reads and drops it
+            self.emit(NOP, 0, 0, offset)
+            return
+        if name in DROPPED_NAMES:
+            return
+        previous, self.previous = self.previous, name
+        if name == 'RAISE_VARARGS' and previous == 'LOAD_ASSERTION_ERROR' and self.assertions:
+            # assert without a message raises the class
+            self.assertions -= 1
+        if name == 'KW_NAMES':
+            self.kwnames = (instr.arg, self.code.co_consts[instr.arg])
+            return
+        if name == 'CALL':
+            if self.kwnames is None:
+                # a comprehension is called with its iterator and without NULL since 3.11
+                argc = instr.arg + 1 if previous == 'GET_ITER' else instr.arg
+                self.emit(CALL_FUNCTION, argc, argc, offset)
+            else:
+                oparg, names = self.kwnames
+                self.kwnames = None
+                self.emit(LOAD_CONST, oparg, names, offset)
+                self.emit(CALL_FUNCTION_KW, instr.arg, instr.arg, offset)
+            return
+        if name == 'BINARY_OP':
+            if len(BINARY_OPS) <= instr.arg:
+                raise FrontendError('unknown binary op {} at {}'.format(instr.arg, offset))
+            op = BINARY_OPS[instr.arg]
+            self.emit(op, 0, 0, offset)
+            return
+        if name in ('IS_OP', 'CONTAINS_OP'):
+            oparg = (8 if name == 'IS_OP' else 6) + instr.arg
+            self.emit(COMPARE_OP, oparg, oparg, offset)
+            return
+        if name == 'COMPARE_OP':
+            oparg = dis.cmp_op.index(instr.argval)
+            self.emit(COMPARE_OP, oparg, oparg, offset)
+            return
+        if name in NONE_JUMPS:
+            self.const(None, offset)
+            self.emit(COMPARE_OP, NONE_JUMPS[name], NONE_JUMPS[name], offset)
+            self.emit(POP_JUMP_IF_FALSE, None, None, offset, instr.argval)
+            return
+        if name == 'COPY':
+            if instr.arg == 1:
+                self.emit(DUP_TOP, 0, 0, offset)
+            else:
+                self.emit(COPY, instr.arg, instr.arg, offset)
+            return
+        if name == 'SWAP':
+            if instr.arg == 2:
+                self.emit(ROT_TWO, 0, 0, offset)
+            else:
+                self.emit(SWAP, instr.arg, instr.arg, offset)
+            return
+        if name == 'ROT_N' and instr.arg in (2, 3):
+            self.emit(ROT_TWO if instr.arg == 2 else ROT_THREE, 0, 0, offset)
+            return
+        if name == 'MAP_ADD' and (3, 8) <= HOST_VERSION:
+            # value is TOS since 3.8, key is TOS in 3.6, loads of a name or a constant go back to the 3.6 order
+            loads = self.out[-2:]
+            if len(loads) == 2 and all(
+                    load.op in (LOAD_FAST, LOAD_CONST) and load.offset not in self.targets for load in loads):
+                self.out[-2:] = loads[::-1]
+            else:
+                self.emit(ROT_TWO, 0, 0, offset)
+            self.emit(MAP_ADD, instr.arg, instr.arg, offset)
+            return
+        if name == 'RETURN_CONST':
+            self.emit(LOAD_CONST, instr.arg, instr.argval, offset)
+            self.emit(RETURN_VALUE, 0, 0, offset)
+            return
+        if name in ('BINARY_SLICE', 'STORE_SLICE'):
+            self.emit(BUILD_SLICE, 2, 2, offset)
+            self.emit(BINARY_SUBSCR if name == 'BINARY_SLICE' else STORE_SUBSCR, 0, 0, offset)
+            return
+        if name == 'CALL_INTRINSIC_1' and instr.arg in INTRINSICS:
+            self.emit(INTRINSICS[instr.arg], 0, 0, offset)
+            return
+        if name == 'LOAD_FAST_AND_CLEAR':
+            raise FrontendError('comprehension inlined by the host at {} has no IR'.format(offset))
+        if name == 'LOAD_ASSERTION_ERROR':
+            if (3, 11) <= HOST_VERSION:
+                self.assertions += 1
+            self.emit(LOAD_GLOBAL, self.names.get('AssertionError', SYNTHETIC), 'AssertionError', offset)
+            return
+        if name == 'MAKE_FUNCTION' and (3, 11) <= HOST_VERSION:
+            # qualified name is not on the stack since 3.11
+            last = self.out[-1] if self.out else None
+            if last is None or last.op != LOAD_CONST or not isinstance(last.arg, CodeType):
+                raise FrontendError('MAKE_FUNCTION without a code constant at {}'.format(offset))
+            self.const(last.arg.co_qualname, offset)
+            self.emit(MAKE_FUNCTION, instr.arg, instr.arg, offset)
+            return
+        if name in BLOCK_NAMES and (3, 8) <= HOST_VERSION:
+            jumps = instr.opcode in dis.hasjrel or instr.opcode in dis.hasjabs
+            self.emit(name, instr.arg, instr.arg, offset, instr.argval if jumps else None)
+            return
+        if name in RENAMED:
+            op = RENAMED[name]
+        elif name in SAME_NAMES:
+            op = getattr(opcodes, name)
+        else:
+            raise FrontendError('host op {} at {} has no IR'.format(name, offset))
+        if op in JUMP_OPS:
+            self.emit(op, None, None, offset, instr.argval)
+        elif op in hasconst:
+            self.emit(op, instr.arg, instr.argval, offset)
+        elif op in hasname:
+            self.emit(op, self.names[instr.argval], instr.argval, offset)
+        elif op in hasfree:
+            oparg = self.derefs.index(instr.argval)
+            self.emit(op, oparg, oparg, offset)
+        else:
+            oparg = instr.arg or 0
+            self.emit(op, oparg, oparg, offset)
+
+    def fold(self) -> None:
+        """
+        containers built by BUILD_LIST, BUILD_SET or BUILD_MAP and extended
+        go back to BUILD_*_UNPACK as 3.6, only in code without jumps
+        """
+        from rpvm.verify import stack_effect, VerifyError
+        out = self.out
+        targets = set(self.starts[instr.target] for instr in out if instr.target in self.starts)
+        edits = dict()  # index of out -> instructions written instead
+        opens = list()  # [[build index, depth of the container, [(index, op),..]],..]
+        depth = 0
+        for index, instr in enumerate(out):
+            op, oparg = instr.op, instr.oparg
+            if index in targets or op in JUMP_OPS:
+                opens.clear()
+            try:
+                after = depth + stack_effect(op, oparg)
+            except VerifyError:
+                return
+            reach = REACHING_OPS.get(op, oparg if op in (COPY, SWAP) else 0)
+            # containers taken by this instruction
+            while opens and (after < opens[-1][1] or depth - reach < opens[-1][1]):
+                build, _, records = opens.pop()
+                if reach == 0:
+                    self._fold(build, records, index, targets, edits)
+            if opens and opens[-1][1] == after:
+                adds, extends = EXTENDED_BUILDS[out[opens[-1][0]].op]
+                if oparg == 1 and after == depth - 1 and (op in adds or op in extends):
+                    opens[-1][2].append((index, op))
+                else:
+                    build, _, records = opens.pop()
+                    if reach == 0:
+                        self._fold(build, records, index, targets, edits)
+            if op in EXTENDED_BUILDS:
+                opens.append([index, after, []])
+            depth = after
+        if not edits:
+            return
+        positions = list()  # index of out -> index of new out
+        folded = list()
+        for index, instr in enumerate(out):
+            positions.append(len(folded))
+            folded.extend(edits.get(index, (instr,)))
+        positions.append(len(folded))
+        self.starts = {offset: positions[index] for offset, index in self.starts.items()}
+        self.out = folded
+
+    def _fold(self, build, records, consumer, targets, edits) -> None:
+        """edits of one container, records are its (index, op) of adding items"""
+        out = self.out
+        op, size = out[build].op, out[build].oparg
+        adds, extends = EXTENDED_BUILDS[op]
+        if not any(record in extends for _, record in records):
+            if size == 0 and records:
+                # a long display built item by item, one BUILD_LIST or BUILD_SET as 3.6
+                for index, _ in records:
+                    edits[index] = ()
+                edits[build] = ()
+                last = records[-1][0]
+                edits[last] = (_Instruction(op, len(records), len(records), out[last].offset),)
+            return
+        call = consumer + 1 < len(out) and consumer + 1 not in targets and \
+            out[consumer + 1].op == CALL_FUNCTION_EX
+        if op == BUILD_MAP:
+            group = BUILD_MAP
+            unpack = BUILD_MAP_UNPACK_WITH_CALL if out[consumer].op == CALL_FUNCTION_EX else BUILD_MAP_UNPACK
+        elif op == BUILD_SET:
+            group, unpack = BUILD_SET, BUILD_SET_UNPACK
+        elif out[consumer].op == LIST_TO_TUPLE:
+            group, unpack = BUILD_TUPLE, BUILD_TUPLE_UNPACK_WITH_CALL if call else BUILD_TUPLE_UNPACK
+            edits[consumer] = ()
+        else:
+            group, unpack = BUILD_TUPLE, BUILD_LIST_UNPACK
+        operands = 0
+        if size == 0:
+            edits[build] = ()
+        else:
+            operands += 1
+            items = list(range(build - size, build))
+            if any(index in targets for index in items[1:] + [build]):
+                items = None
+            self._group(group, build, size, items, edits)
+        run = list()  # items added one by one, index of the instruction if it is only LOAD_CONST
+        previous = build
+        for position, (index, record) in enumerate(records):
+            edits[index] = ()
+            if record in adds:
+                run.append(index - 1 if index - 2 == previous else None)
+                following = records[position + 1][1] if position + 1 < len(records) else None
+                if following not in adds:
+                    operands += 1
+                    self._group(group, index, len(run), None if None in run else run, edits)
+                    run = list()
+            else:
+                operands += 1
+            previous = index
+        if unpack == BUILD_MAP_UNPACK_WITH_CALL and operands == 1 and size == 0:
+            return  # CALL_FUNCTION_EX takes the mapping itself as 3.6
+        last = records[-1][0]
+        edits[last] = tuple(edits[last]) + (_Instruction(unpack, operands, operands, out[last].offset),)
+
+    def _group(self, op, index, size, items, edits) -> None:
+        """
+        items before out[index] built by op, a tuple of constants is a constant as 3.6
+        items: indexes of the instructions pushing each item alone, None if unknown
+        """
+        out = self.out
+        if op == BUILD_TUPLE and items is not None and all(out[item].op == LOAD_CONST for item in items):
+            value = tuple(out[item].arg for item in items)
+            for item in items:
+                edits[item] = ()
+            edits[items[0]] = (_Instruction(LOAD_CONST, SYNTHETIC, value, out[items[0]].offset),)
+            if index not in items:
+                edits[index] = ()
+        else:
+            edits[index] = tuple(edits.get(index, ())) + (_Instruction(op, size, size, out[index].offset),)
+
+    def layout(self) -> (bytes, tuple, tuple, tuple):
+        """resolve jumps and add EXTENDED_ARG until the layout is stable"""
+        out = self.out
+        if self.kwnames is not None:
+            raise FrontendError('KW_NAMES without CALL')
+        for instr in out:
+            if instr.target is not None and instr.target not in self.starts:
+                raise FrontendError('jump target {} out of range'.format(instr.target))
+        extended = [0 if instr.target is not None else _prefixes(instr.oparg) for instr in out]
+        while True:
+            positions = list()  # index of out -> IR index of its first EXTENDED_ARG
+            position = 0
+            for count in extended:
+                positions.append(position)
+                position += count + 1
+            positions.append(position)
+            changed = False
+            for index, instr in enumerate(out):
+                if instr.target is None:
+                    continue
+                target = positions[self.starts[instr.target]]
+                if instr.op in hasjabs:
+                    instr.oparg = target * 2
+                else:
+                    instr.oparg = (target - positions[index + 1]) * 2
+                    if instr.oparg < 0:
+                        raise FrontendError('backward relative jump at {}'.format(instr.offset))
+                instr.arg = target
+                count = _prefixes(instr.oparg)
+                if extended[index] < count:
+                    extended[index] = count
+                    changed = True
+            if not changed:
+                break
+        ops = bytearray()
+        opargs = list()
+        args = list()
+        offsets = list()
+        for instr, count in zip(out, extended):
+            for shift in range(count, 0, -1):
+                ops.append(EXTENDED_ARG)
+                opargs.append(instr.oparg >> (8 * shift))
+                args.append(instr.oparg >> (8 * shift))
+                offsets.append(instr.offset)
+            ops.append(instr.op)
+            opargs.append(instr.oparg)
+            args.append(instr.arg)
+            offsets.append(instr.offset)
+        return bytes(ops), tuple(opargs), tuple(args), tuple(offsets)
+
+
+def translate(code: CodeType) -> (bytes, tuple, tuple, tuple):
+    """
+    IR of the host bytecode
+    :return: (ops, opargs, args, host offset of each instruction)
+    """
+    translator = _Translator(code)
+    try:
+        translator.run()
+        if not NATIVE:
+            from rpvm.structure import rebuild
+            translator.out = rebuild(translator.out, translator.starts, code)
+            translator.starts = {index: index for index in range(len(translator.out) + 1)}
+        translator.fold()
+    except (IndexError, KeyError) as e:
+        raise FrontendError('broken host bytecode: {!r}'.format(e))
+    return translator.layout()
+
+
+__all__ = [
+    "HOST_VERSION",
+    "NATIVE",
+    "SYNTHETIC",
+    "FrontendError",
+    "translate",
+]
@@ -0,0 +1,105 @@
+from rpvm.opcodes import *
+from rpvm.limits import SIZED_OPS
+from weakref import WeakKeyDictionary
+
+
+DEFAULT_COST = 1  # static cost of an opcode
+WORD_COST = 1  # per 64bit word of a big int result
+ITEM_COST = 1  # per item of a built container or a repeated sequence
+CALL_COST = 10  # calling a function not listed in `call_costs`
+WORD_BITS = 64
+
+# opcodes whose cost depends on operands
+DYNAMIC_OPS = SIZED_OPS + (CALL_FUNCTION, CALL_FUNCTION_KW, CALL_FUNCTION_EX)
+
+DYNAMIC = -1  # cost computed by meter()
+UNFUSED = -2  # superinstruction must run as the original instructions
+
+
+class GasSchedule(object):
+    """
+    gas cost of each opcode
+    `costs` is indexed by opcode, VM charges it before executing the opcode.
+    a negative entry marks a dynamic opcode, its cost is computed by
+    `meter()` from the estimated result size (rpvm.limits.estimate) and the
+    callee, so normal opcodes pay only a list lookup.
+    """
+
+    def __init__(self, base=None, default=DEFAULT_COST, word_cost=WORD_COST,
+                 item_cost=ITEM_COST, call_costs=None, call_cost=CALL_COST) -> None:
+        """
+        :param base: {opcode: cost} overwrite default cost
+        :param default: cost of opcode not in base
+        :param word_cost: surcharge per 64bit word of a big int result
+        :param item_cost: surcharge per item of a container or a repeated sequence
+        :param call_costs: {function: cost} surcharge of calling the function
+        :param call_cost: surcharge of calling other functions
+        """
+        self.base = [default] * 256
+        if base:
+            for op, cost in base.items():
+                self.base[op] = cost
+        self.word_cost = word_cost
+        self.item_cost = item_cost
+        self.call_costs = dict(call_costs or ())
+        self.call_cost = call_cost
+        self.costs = list(self.base)
+        for op in DYNAMIC_OPS:
+            self.costs[op] = DYNAMIC
+        self._program_costs = WeakKeyDictionary()
+
+    def meter(self, op, stack, arg, bits, items) -> int:
+        """
+        cost of a dynamic opcode, base + surcharge
+        :param bits: estimated bit length of int result
+        :param items: estimated items of result
+        """
+        cost = self.base[op] + bits // WORD_BITS * self.word_cost + items * self.item_cost
+        if op == CALL_FUNCTION:
+            cost += self._callee(stack[-1 - arg]) + arg * self.item_cost
+        elif op == CALL_FUNCTION_KW:
+            cost += self._callee(stack[-2 - arg]) + arg * self.item_cost
+        elif op == CALL_FUNCTION_EX:
+            cost += self._callee(stack[-2 - (arg & 0x01)])
+        return cost
+
+    def program_costs(self, program, max_items) -> list:
+        """
+        cost of each instruction of the program
+        a superinstruction costs the sum of original instructions, the only
+        dynamic one it can contain is BUILD_TUPLE of CONST_TUPLE, which is static
+        by its size. UNFUSED marks a folded tuple over `max_items`.
+        """
+        memo = self._program_costs.setdefault(program, dict())
+        if max_items in memo:
+            return memo[max_items]
+        costs = list()
+        for index, (op, width) in enumerate(zip(program.ops, program.widths)):
+            if width == 1:
+                costs.append(self.costs[op])
+            elif op == CONST_TUPLE:
+                size = width - 1
+                cost = self.base[LOAD_CONST] * size + self.base[BUILD_TUPLE] + size * self.item_cost
+                costs.append(UNFUSED if max_items < size else cost)
+            else:
+                costs.append(sum(self.base[o] for o in program.base_ops[index:index + width]))
+        memo[max_items] = costs
+        return costs
+
+    def _callee(self, fnc) -> int:
+        try:
+            return self.call_costs.get(fnc, self.call_cost)
+        except TypeError:
+            return self.call_cost  # unhashable
+
+
+DEFAULT_SCHEDULE = GasSchedule()
+
+
+__all__ = [
+    "GasSchedule",
+    "DEFAULT_SCHEDULE",
+    "DYNAMIC_OPS",
+    "DYNAMIC",
+    "UNFUSED",
+]
@@ -0,0 +1,97 @@
+"""
+handler table of try, except, finally and with
+
+blocks of Python3.6 bytecode are nested statically, so the blocks enclosing
+each instruction are found once when the code is loaded. the VM does not
+push or pop them while running, SETUP_EXCEPT, SETUP_FINALLY, SETUP_LOOP and
+POP_BLOCK do nothing. an exception, a return, a break or a continue looks up
+the blocks of the last instruction and jumps to the handler.
+
+* except handler: the stack is cut to the block level, then traceback (None),
+  exception and its type are pushed as 3.6 ceval
+* finally handler and __exit__ of with: an Unwind is pushed instead of the
+  6 items of ceval, END_FINALLY resumes it. a finally reached normally has
+  None on the stack as 3.6.
+
+an exception being handled is kept by the VM with the blocks of its handler,
+it is dropped by POP_EXCEPT or when unwinding leaves the handler. a bare
+raise finds it in the callers too, as an except clause may call a function.
+
+the IR has these blocks on every host, rpvm.structure lays out try, except,
+finally and with of 3.8 and later hosts again as 3.6, so the table is built
+from the IR the same way.
+"""
+from rpvm.opcodes import *
+from rpvm.decode import Program, DECODE_CACHE_SIZE
+from rpvm.verify import block_flow
+from functools import lru_cache
+
+
+# reason of unwinding, Unwind.why
+WHY_EXCEPTION = 'exception'
+WHY_RETURN = 'return'
+WHY_BREAK = 'break'
+WHY_CONTINUE = 'continue'
+WHY_SILENCED = 'silenced'  # __exit__ suppressed the exception
+
+# opcodes starting a block, the block ends at its POP_BLOCK
+SETUP_OPS = (SETUP_LOOP, SETUP_EXCEPT, SETUP_FINALLY, SETUP_WITH)
+
+
+class Unwind(object):
+    """
+    why a finally block or __exit__ of with is running
+    value: the exception, the return value or the continue target
+    """
+    __slots__ = ('why', 'value')
+
+    def __init__(self, why, value=None) -> None:
+        self.why = why
+        self.value = value
+
+    def __repr__(self):
+        return "<Unwind {}>".format(self.why)
+
+
+SILENCED = Unwind(WHY_SILENCED)
+
+
+def find_handler(blocks: tuple, why) -> int:
+    """index of the innermost block handling why in blocks, -1 if none"""
+    for index in range(len(blocks) - 1, -1, -1):
+        kind = blocks[index][0]
+        if kind == SETUP_LOOP:
+            if why == WHY_BREAK or why == WHY_CONTINUE:
+                return index
+        elif kind == SETUP_EXCEPT:
+            if why == WHY_EXCEPTION:
+                return index
+        else:
+            # finally and with run on any reason
+            return index
+    return -1
+
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def handler_table(program: Program) -> tuple:
+    """
+    blocks enclosing each instruction, indexed by pc
+    blocks are a tuple of (setup opcode, handler index, stack level) from the
+    outermost, empty where no block or not reached from the entry.
+    """
+    _, table = block_flow(program, strict=False)
+    return tuple(() if blocks is None else blocks for blocks in table)
+
+
+__all__ = [
+    "WHY_EXCEPTION",
+    "WHY_RETURN",
+    "WHY_BREAK",
+    "WHY_CONTINUE",
+    "WHY_SILENCED",
+    "SETUP_OPS",
+    "Unwind",
+    "SILENCED",
+    "find_handler",
+    "handler_table",
+]
@@ -0,0 +1,197 @@
+_missing = object()  # key was not in the dict
+_whole = object()  # saved a copy of whole list
+_contents = object()  # saved contents of a container read from a namespace
+CONTAINER_TYPES = (list, dict, set, bytearray)  # modified in place by methods
+COPIED_TYPES = CONTAINER_TYPES + (tuple,)  # copied when read, a tuple may hold containers
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal(object):
+    """
+    undo log of writes to namespaces and containers
+    rollback and commit cost O(changes), savepoints nest for inner calls.
+    a container read from a namespace may be modified by its methods or by
+    an alias, its contents are copied at the first read after a savepoint.
+    """
+    __slots__ = ('entries', 'savepoints', 'saved')
+
+    def __init__(self) -> None:
+        self.entries = list()  # [(target, key, old value),..]
+        self.savepoints = list()  # index of entries
+        self.saved = dict()  # {id: index of entries} containers whose contents are saved
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, target, key) -> None:
+        """remember target[key] just before it is written or deleted"""
+        if isinstance(target, dict):
+            self.entries.append((target, key, dict.get(target, key, _missing)))
+        elif isinstance(target, (list, bytearray)):
+            if isinstance(key, int) and -len(target) <= key < len(target):
+                self.entries.append((target, key, target[key]))
+            else:
+                # slice or out of range, save whole to restore length too
+                self.entries.append((target, _whole, target[:]))
+        else:
+            raise JournalError('cannot journal a write to {}'.format(type(target).__name__))
+
+    def record_delete(self, target, key) -> None:
+        """remember target before del target[key]"""
+        if isinstance(target, (list, bytearray)):
+            self.entries.append((target, _whole, target[:]))
+        else:
+            self.record(target, key)
+
+    def record_contents(self, value) -> None:
+        """copy contents of the container and nested ones, once after the last savepoint"""
+        start = self.savepoints[-1] if self.savepoints else 0
+        todo = [value]
+        while todo:
+            obj = todo.pop()
+            if isinstance(obj, tuple):
+                todo.extend(obj)
+                continue
+            if not isinstance(obj, CONTAINER_TYPES) or isinstance(obj, JournaledDict):
+                continue
+            if start <= self.saved.get(id(obj), -1):
+                continue
+            self.saved[id(obj)] = len(self.entries)
+            if isinstance(obj, dict):
+                copied = dict(obj)
+                todo.extend(copied.values())
+            elif isinstance(obj, set):
+                copied = set(obj)
+            else:
+                copied = obj[:]
+                if isinstance(obj, list):
+                    todo.extend(copied)
+            self.entries.append((obj, _contents, copied))
+
+    def savepoint(self) -> int:
+        """mark current position, return the savepoint"""
+        self.savepoints.append(len(self.entries))
+        return len(self.savepoints)
+
+    def release(self, savepoint: int) -> None:
+        """forget the savepoint and inner ones, keep their changes"""
+        self._check(savepoint)
+        del self.savepoints[savepoint - 1:]
+
+    def rollback(self, savepoint: int = None) -> None:
+        """undo changes after the savepoint, or all changes if None"""
+        if savepoint is None:
+            index = 0
+            del self.savepoints[:]
+        else:
+            self._check(savepoint)
+            index = self.savepoints[savepoint - 1]
+            del self.savepoints[savepoint - 1:]
+        entries = self.entries
+        while index < len(entries):
+            target, key, old = entries.pop()
+            if key is _contents:
+                self.saved.pop(id(target), None)
+                if isinstance(target, dict):
+                    dict.clear(target)
+                    dict.update(target, old)
+                elif isinstance(target, set):
+                    target.clear()
+                    target.update(old)
+                else:
+                    target[:] = old
+            elif key is _whole:
+                target[:] = old
+            elif isinstance(target, dict):
+                if old is _missing:
+                    dict.pop(target, key, None)
+                else:
+                    dict.__setitem__(target, key, old)
+            else:
+                target[key] = old
+
+    def commit(self) -> None:
+        """accept all changes"""
+        self.entries = list()
+        self.savepoints = list()
+        self.saved = dict()
+
+    def _check(self, savepoint):
+        if not 0 < savepoint <= len(self.savepoints):
+            raise JournalError('unknown savepoint {}'.format(savepoint))
+
+
+class JournaledDict(dict):
+    """
+    dict recording writes and deletes to its journal
+    give it as `l`/`g` of VirtualMachine, the VM also journals STORE_SUBSCR and
+    DELETE_SUBSCR to the same journal. a container read from it is copied
+    before it can be modified by method calls such as `list.append()`.
+    """
+    __slots__ = ('journal',)
+
+    def __init__(self, data=(), journal: Journal = None) -> None:
+        dict.__init__(self, data)
+        self.journal = Journal() if journal is None else journal
+
+    def __reduce__(self):
+        # a snapshot has no journal, restored one starts a new journal
+        return self.__class__, (dict(self),)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, COPIED_TYPES):
+            self.journal.record_contents(value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        self.journal.record(self, key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if key in self:
+            self.journal.record(self, key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        if key in self:
+            self.journal.record(self, key)
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self.journal.entries.append((self, key, value))
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.journal.record(self, key)
+            dict.__setitem__(self, key, default)
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            self.journal.record(self, key)
+        dict.clear(self)
+
+    def copy(self):
+        return dict(self)
+
+
+__all__ = [
+    "CONTAINER_TYPES",
+    "COPIED_TYPES",
+    "JournalError",
+    "Journal",
+    "JournaledDict",
+]
@@ -0,0 +1,166 @@
+from rpvm.opcodes import *
+import re
+
+
+MAX_INT_BITS = 1 << 16  # bit length of an int result
+MAX_ITEMS = 1 << 20  # items of a built container or a repeated sequence
+MAX_DEPTH = 200  # nested calls of functions made in the VM
+SEQUENCE_TYPES = (str, bytes, bytearray, list, tuple)
+SIZED_TYPES = SEQUENCE_TYPES + (dict, set, frozenset)
+
+# IR opcodes adding TOS to the container below, result is sum of both
+EXTEND_OPS = (LIST_EXTEND, SET_UPDATE, DICT_UPDATE, DICT_MERGE)
+
+# opcodes unpacking oparg operands into one container, result is sum of them
+UNPACK_OPS = (
+    BUILD_TUPLE_UNPACK, BUILD_LIST_UNPACK, BUILD_MAP_UNPACK, BUILD_SET_UNPACK,
+    BUILD_TUPLE_UNPACK_WITH_CALL, BUILD_MAP_UNPACK_WITH_CALL)
+
+# sequence concatenation, static gas but the result size is checked by the VM
+CONCAT_OPS = (BINARY_ADD, INPLACE_ADD)
+
+# printf-style formatting, static gas but width and precision of str/bytes are checked by the VM
+FORMAT_OPS = (BINARY_MODULO, INPLACE_MODULO)
+CHECKED_OPS = CONCAT_OPS + FORMAT_OPS
+FORMAT_TYPES = (str, bytes, bytearray)
+
+# opcodes whose result size is estimated before executing
+SIZED_OPS = (
+    BINARY_POWER, INPLACE_POWER, BINARY_LSHIFT, INPLACE_LSHIFT,
+    BINARY_MULTIPLY, INPLACE_MULTIPLY,
+    BUILD_TUPLE, BUILD_LIST, BUILD_SET, BUILD_MAP, BUILD_CONST_KEY_MAP) + UNPACK_OPS + EXTEND_OPS
+
+
+def _power(a, b) -> (int, int):
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and not -1 <= a <= 1:
+        return (a.bit_length() - 1) * b + 1, 0
+    return 0, 0
+
+
+def _lshift(a, b) -> (int, int):
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and a != 0:
+        return a.bit_length() + b, 0
+    return 0, 0
+
+
+def _multiply(a, b) -> (int, int):
+    if isinstance(a, int):
+        if isinstance(b, int):
+            return a.bit_length() + b.bit_length(), 0
+        a, b = b, a
+    if isinstance(a, SEQUENCE_TYPES) and isinstance(b, int):
+        return 0, max(0, len(a) * b)
+    return 0, 0
+
+
+def _add(a, b) -> (int, int):
+    if isinstance(a, SEQUENCE_TYPES) and isinstance(b, SEQUENCE_TYPES):
+        return 0, len(a) + len(b)
+    return 0, 0
+
+
+# %[(key)][flags][width][.precision][length]type
+_FORMAT_SPEC = re.compile(r'%(?:\([^)]*\))?[-#0 +]*(\*|\d*)(?:\.(\*|\d*))?[hlL]?(.?)', re.S)
+
+
+def _modulo(a, b) -> (int, int):
+    if not isinstance(a, FORMAT_TYPES):
+        return 0, 0
+    if not isinstance(a, str):
+        a = a.decode('latin-1')
+    values = iter(b if isinstance(b, tuple) else (b,))
+    items = len(a)
+    for spec in _FORMAT_SPEC.finditer(a):
+        for size in spec.group(1, 2):
+            if size == '*':
+                size = next(values, 0)
+                items += abs(size) if isinstance(size, int) else 0
+            elif size:
+                items += int(size[:18])  # a longer width is over any limit
+        if spec.group(3) != '%':
+            next(values, None)
+    return 0, items
+
+
+def _call(fnc, args, kwds) -> (int, int):
+    # builtin pow() is same as BINARY_POWER without the modulo
+    if fnc is not pow or not isinstance(args, (tuple, list)) or not isinstance(kwds, dict):
+        return 0, 0
+    operands = dict(zip(('base', 'exp', 'mod'), args))
+    operands.update(kwds)
+    if operands.get('mod') is not None:
+        return 0, 0
+    return _power(operands.get('base'), operands.get('exp'))
+
+
+def _items(objects) -> int:
+    return sum(len(obj) for obj in objects if isinstance(obj, SIZED_TYPES))
+
+
+_binary = {
+    BINARY_POWER: _power, INPLACE_POWER: _power,
+    BINARY_LSHIFT: _lshift, INPLACE_LSHIFT: _lshift,
+    BINARY_MULTIPLY: _multiply, INPLACE_MULTIPLY: _multiply,
+    BINARY_ADD: _add, INPLACE_ADD: _add,
+    BINARY_MODULO: _modulo, INPLACE_MODULO: _modulo,
+}
+
+
+def estimate(op, stack, arg) -> (int, int):
+    """
+    estimate result size of the opcode from operands on the stack (TOS is the last)
+    without executing it, ints are measured by bit length and sequences by items.
+
+    :return: (bits, items)
+    """
+    fnc = _binary.get(op)
+    if fnc is not None:
+        return fnc(stack[-2], stack[-1])
+    elif op == CALL_FUNCTION:
+        return _call(stack[-1 - arg], stack[len(stack) - arg:], dict())
+    elif op == CALL_FUNCTION_KW:
+        names = stack[-1]
+        args = stack[len(stack) - 1 - arg:-1]
+        size = len(args) - len(names)
+        return _call(stack[-2 - arg], args[:size], dict(zip(names, args[size:])))
+    elif op == CALL_FUNCTION_EX:
+        kwds = stack[-1] if arg & 0x01 else dict()
+        return _call(stack[-2 - (arg & 0x01)], stack[-1 - (arg & 0x01)], kwds)
+    elif op == BUILD_MAP:
+        return 0, arg * 2
+    elif op in EXTEND_OPS:
+        return 0, _items((stack[-1 - arg], stack[-1]))
+    elif op in UNPACK_OPS:
+        return 0, _items(stack[len(stack) - arg:])
+    elif op in SIZED_OPS:
+        return 0, arg
+    else:
+        return 0, 0
+
+
+class Limits(object):
+    """
+    size limit checked before executing an opcode
+    VM rejects an opcode whose estimated result is over the limit,
+    and a call pushing frames more than `max_depth`.
+    """
+
+    def __init__(self, max_int_bits=MAX_INT_BITS, max_items=MAX_ITEMS, max_depth=MAX_DEPTH) -> None:
+        self.max_int_bits = max_int_bits
+        self.max_items = max_items
+        self.max_depth = max_depth
+
+
+DEFAULT_LIMITS = Limits()
+
+
+__all__ = [
+    "Limits",
+    "DEFAULT_LIMITS",
+    "SIZED_OPS",
+    "CONCAT_OPS",
+    "FORMAT_OPS",
+    "CHECKED_OPS",
+    "SEQUENCE_TYPES",
+    "estimate",
+]
@@ -0,0 +1,207 @@
+from rpvm.storage import dumps
+from hashlib import sha256
+
+
+EMPTY_ROOT = bytes(32)  # hash of a tree without keys
+MUTABLE_TYPES = (list, dict, set, bytearray, tuple)  # values modified without stored again, a tuple may hold them
+
+
+def _hash(data: bytes) -> bytes:
+    return sha256(data).digest()
+
+
+def _bit(path: bytes, depth: int) -> int:
+    return (path[depth >> 3] >> (7 - (depth & 7))) & 1
+
+
+class _Leaf(object):
+    __slots__ = ('path', 'hash')
+
+    def __init__(self, path, value_hash):
+        self.path = path
+        self.hash = _hash(b'\x00' + path + value_hash)
+
+
+class _Branch(object):
+    __slots__ = ('children', 'hash')
+
+    def __init__(self, children):
+        self.children = children  # [left, right], None is empty
+        self.hash = None  # computed by root()
+
+
+class MerkleTree(object):
+    """
+    binary trie over sha256 of keys, a subtree of one key is its leaf itself
+    so shape and root depend only on the entries. node hashes are kept and
+    only the paths to changed keys are hashed again, O(changes * log n).
+    """
+
+    def __init__(self) -> None:
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_hash(key, _hash(value))
+
+    def set_hash(self, key: str, value_hash: bytes) -> None:
+        """set a key by sha256 of its value"""
+        path = _hash(key.encode())
+        leaf = _Leaf(path, value_hash)
+        if self._root is None:
+            self._root = leaf
+            self._size += 1
+            return
+        parent, index, node, depth = None, 0, self._root, 0
+        while isinstance(node, _Branch):
+            node.hash = None
+            parent, index = node, _bit(path, depth)
+            node, depth = node.children[index], depth + 1
+        if node is None:
+            self._size += 1
+        elif node.path != path:
+            # split until the two paths differ
+            self._size += 1
+            top = branch = _Branch([None, None])
+            while _bit(path, depth) == _bit(node.path, depth):
+                child = _Branch([None, None])
+                branch.children[_bit(path, depth)] = child
+                branch, depth = child, depth + 1
+            branch.children[_bit(path, depth)] = leaf
+            branch.children[_bit(node.path, depth)] = node
+            leaf = top
+        if parent is None:
+            self._root = leaf
+        else:
+            parent.children[index] = leaf
+
+    def delete(self, key: str) -> None:
+        path = _hash(key.encode())
+        parents = list()  # [(branch, index),..]
+        node, depth = self._root, 0
+        while isinstance(node, _Branch):
+            index = _bit(path, depth)
+            parents.append((node, index))
+            node, depth = node.children[index], depth + 1
+        if node is None or node.path != path:
+            return  # not found
+        self._size -= 1
+        for branch, _ in parents:
+            branch.hash = None
+        # a branch left with one leaf is replaced by the leaf
+        replace = None
+        while parents:
+            branch, index = parents.pop()
+            other = branch.children[1 - index]
+            if replace is None and isinstance(other, _Leaf):
+                replace = other
+            elif isinstance(replace, _Leaf) and other is None:
+                pass
+            else:
+                branch.children[index] = replace
+                return
+        self._root = replace
+
+    def root(self) -> bytes:
+        return EMPTY_ROOT if self._root is None else self._node_hash(self._root)
+
+    def _node_hash(self, node) -> bytes:
+        if node is None:
+            return EMPTY_ROOT
+        if node.hash is None:
+            left, right = node.children
+            node.hash = _hash(b'\x01' + self._node_hash(left) + self._node_hash(right))
+        return node.hash
+
+
+class MerkleDict(dict):
+    """
+    namespace keeping a Merkle root of its entries
+    keys stored or deleted, such as by STORE_NAME or STORE_GLOBAL, are hashed
+    again by root(). a mutable value can be changed without storing it, by an
+    alias or by a cached LOAD_GLOBAL, so keys holding one are encoded again on
+    every root() and their leaf is replaced only if the hash differs.
+    values are serialized by rpvm.storage.dumps(), sets and dicts are sorted.
+    """
+    __slots__ = ('tree', '_dirty', '_mutable')
+
+    def __init__(self, data=()) -> None:
+        dict.__init__(self)
+        self.tree = MerkleTree()
+        self._dirty = set()
+        self._mutable = dict()  # {key: hash of the value} holding a mutable value
+        self.update(data)
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._dirty.add(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._dirty.add(key)
+
+    def pop(self, key, *args):
+        if key in self:
+            self._dirty.add(key)
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._dirty.add(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self._dirty.update(self)
+        dict.clear(self)
+
+    def root(self) -> bytes:
+        """state root, hash only changed keys and keys holding a mutable value"""
+        tree = self.tree
+        mutable = self._mutable
+        for key in self._dirty.union(mutable):
+            if not dict.__contains__(self, key):
+                tree.delete(key)
+                mutable.pop(key, None)
+                continue
+            value = dict.__getitem__(self, key)
+            value_hash = _hash(dumps(value))
+            if not isinstance(value, MUTABLE_TYPES):
+                mutable.pop(key, None)
+            elif mutable.get(key) == value_hash:
+                continue
+            else:
+                mutable[key] = value_hash
+            tree.set_hash(key, value_hash)
+        self._dirty.clear()
+        return tree.root()
+
+
+def state_root(namespace: dict) -> bytes:
+    """Merkle root of a whole dict, same as MerkleDict.root()"""
+    tree = MerkleTree()
+    for key, value in namespace.items():
+        tree.set(key, dumps(value))
+    return tree.root()
+
+
+__all__ = [
+    "EMPTY_ROOT",
+    "MerkleTree",
+    "MerkleDict",
+    "state_root",
+]
@@ -0,0 +1,27 @@
+from types import MappingProxyType
+
+
+# shared builtins of a VM given plain dict buildins
+EMPTY_BUILTINS = MappingProxyType(dict())
+
+
+def share_builtins(b: dict) -> MappingProxyType:
+    """
+    freeze buildins once per process and share it by all VMs
+    a VM given the frozen mapping does not copy it, additions of a contract
+    go to the VM's own `buildins` dict which is looked up first.
+    """
+    if isinstance(b, MappingProxyType):
+        return b
+    return MappingProxyType(dict(b))
+
+
+def is_shared(b) -> bool:
+    return isinstance(b, MappingProxyType)
+
+
+__all__ = [
+    "EMPTY_BUILTINS",
+    "share_builtins",
+    "is_shared",
+]
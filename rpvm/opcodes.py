@@ -157,3 +157,31 @@ LOAD_BUILD_CLASS = 71
 HAVE_ARGUMENT = 90              # Opcodes from here have an argument:
 EXTENDED_ARG = 144
 FORMAT_VALUE = 155
+
+# superinstructions of rpvm.optimizer, not CPython opcodes
+NAME_CONST_BINARY_STORE = 200  # LOAD_NAME, LOAD_CONST, BINARY_*/INPLACE_*, STORE_NAME
+NAME_CONST_COMPARE_JUMP = 201  # LOAD_NAME, LOAD_CONST, COMPARE_OP, POP_JUMP_IF_*
+CONST_TUPLE = 202              # LOAD_CONST * n, BUILD_TUPLE n
+
+# IR opcodes of host bytecode newer than Python3.6, made by rpvm.frontend
+LIST_EXTEND = 210    # list of i-th item below TOS extended by TOS
+SET_UPDATE = 211     # set of i-th item below TOS updated by TOS
+DICT_UPDATE = 212    # dict of i-th item below TOS updated by TOS
+DICT_MERGE = 213     # same as DICT_UPDATE, but a duplicate key is an error
+LIST_TO_TUPLE = 214
+COPY = 215           # push n-th item, 1 is TOS
+SWAP = 216           # swap TOS and n-th item
+
+# operand kinds, resolved once when decoding
+hasconst = [LOAD_CONST]
+hasname = [
+    STORE_NAME, DELETE_NAME, STORE_ATTR, DELETE_ATTR, STORE_GLOBAL, DELETE_GLOBAL,
+    LOAD_NAME, LOAD_ATTR, LOAD_GLOBAL, IMPORT_NAME, IMPORT_FROM]
+haslocal = [LOAD_FAST, STORE_FAST, DELETE_FAST]
+hasfree = [LOAD_CLOSURE, LOAD_DEREF, STORE_DEREF, DELETE_DEREF, LOAD_CLASSDEREF]
+hasjrel = [
+    FOR_ITER, JUMP_FORWARD, SETUP_LOOP, SETUP_EXCEPT, SETUP_FINALLY,
+    SETUP_WITH, SETUP_ASYNC_WITH]
+hasjabs = [
+    POP_JUMP_IF_TRUE, POP_JUMP_IF_FALSE, JUMP_IF_TRUE_OR_POP,
+    JUMP_IF_FALSE_OR_POP, JUMP_ABSOLUTE, CONTINUE_LOOP]
@@ -0,0 +1,114 @@
+from rpvm.opcodes import *
+from rpvm.decode import Program, DECODE_CACHE_SIZE
+from rpvm.gas import DYNAMIC_OPS
+from functools import lru_cache
+import operator
+
+
+# binary opcodes fused into NAME_CONST_BINARY_STORE, dynamic cost opcodes are excluded
+BINARY_FUNCTIONS = {
+    BINARY_ADD: operator.add,
+    BINARY_SUBTRACT: operator.sub,
+    BINARY_FLOOR_DIVIDE: operator.floordiv,
+    BINARY_TRUE_DIVIDE: operator.truediv,
+    BINARY_MODULO: operator.mod,
+    BINARY_SUBSCR: operator.getitem,
+    BINARY_RSHIFT: operator.rshift,
+    BINARY_AND: operator.and_,
+    BINARY_XOR: operator.xor,
+    BINARY_OR: operator.or_,
+    INPLACE_ADD: operator.iadd,
+    INPLACE_SUBTRACT: operator.isub,
+    INPLACE_FLOOR_DIVIDE: operator.ifloordiv,
+    INPLACE_TRUE_DIVIDE: operator.itruediv,
+    INPLACE_MODULO: operator.imod,
+    INPLACE_RSHIFT: operator.irshift,
+    INPLACE_AND: operator.iand,
+    INPLACE_XOR: operator.ixor,
+    INPLACE_OR: operator.ior,
+}
+assert not set(BINARY_FUNCTIONS) & set(DYNAMIC_OPS)
+
+# COMPARE_OP oparg -> function
+COMPARE_FUNCTIONS = (
+    operator.lt, operator.le, operator.eq, operator.ne, operator.gt, operator.ge,
+    lambda a, b: a in b, lambda a, b: a not in b, operator.is_, operator.is_not)
+
+MAX_CONST_TUPLE = 255  # items of a folded constant tuple
+
+
+def jump_targets(program: Program) -> set:
+    """indexes some instruction jumps to"""
+    targets = set()
+    for op, arg in zip(program.ops, program.args):
+        if op in hasjrel or op in hasjabs:
+            targets.add(arg)
+    return targets
+
+
+def _match(ops, args, index, targets):
+    """superinstruction starting at index, return (op, arg, width) or None"""
+    op = ops[index]
+    if op == LOAD_NAME and index + 3 < len(ops) and ops[index + 1] == LOAD_CONST:
+        if targets.intersection(range(index + 1, index + 4)):
+            return None
+        third, fourth = ops[index + 2], ops[index + 3]
+        if third in BINARY_FUNCTIONS and fourth == STORE_NAME:
+            arg = (args[index], args[index + 1], third, BINARY_FUNCTIONS[third], args[index + 3])
+            return NAME_CONST_BINARY_STORE, arg, 4
+        if third == COMPARE_OP and args[index + 2] < len(COMPARE_FUNCTIONS) and \
+                fourth in (POP_JUMP_IF_FALSE, POP_JUMP_IF_TRUE):
+            arg = (args[index], args[index + 1], COMPARE_FUNCTIONS[args[index + 2]],
+                   fourth == POP_JUMP_IF_TRUE, args[index + 3])
+            return NAME_CONST_COMPARE_JUMP, arg, 4
+    elif op == LOAD_CONST:
+        end = index
+        while end < len(ops) and ops[end] == LOAD_CONST and end - index < MAX_CONST_TUPLE:
+            end += 1
+        size = end - index
+        if end < len(ops) and ops[end] == BUILD_TUPLE and 0 < args[end] <= size:
+            # the last n constants are packed
+            start = end - args[end]
+            if start == index and not targets.intersection(range(index + 1, end + 1)):
+                return CONST_TUPLE, tuple(args[index:end]), size + 1
+    return None
+
+
+def _optimize(program: Program) -> Program:
+    base_ops = program.ops
+    base_args = program.args
+    targets = jump_targets(program)
+    ops = bytearray(base_ops)
+    args = list(base_args)
+    widths = [1] * len(ops)
+    index = 0
+    while index < len(ops):
+        found = _match(base_ops, base_args, index, targets)
+        if found is None:
+            index += 1
+            continue
+        op, arg, width = found
+        # keep original instructions after the head, they run when a fused one cannot
+        ops[index] = op
+        args[index] = arg
+        widths[index] = width
+        index += width
+    return Program(program.code, bytes(ops), program.opargs, tuple(args),
+                   tuple(widths), base_ops, base_args, program.offsets)
+
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def optimize(program: Program) -> Program:
+    """
+    rewrite fixed opcode sequences into superinstructions and fold constant tuples
+    a superinstruction is charged the steps and gas of all instructions it replaces,
+    and VM executes the original instructions when the budget ends inside it,
+    so results are same as an unoptimized VM.
+    """
+    return _optimize(program)
+
+
+__all__ = [
+    "optimize",
+    "jump_targets",
+]
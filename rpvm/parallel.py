@@ -0,0 +1,183 @@
+from rpvm.vm import VirtualMachine, FINISHED
+from rpvm.namespace import share_builtins
+from types import CodeType
+from hashlib import sha256
+import multiprocessing
+import marshal
+import pickle
+
+
+DEFAULT_MAX_STEPS = 100000
+
+# worker process globals, set by _init_worker()
+_worker_builtins = None
+_worker_codes = dict()  # digest -> code object
+
+
+class Task(object):
+    """
+    one contract execution
+    module code runs with locals and globals of one namespace, made of
+    declared keys of the state and inputs. only declared keys are written
+    back to the state, other names are temporaries of the contract. without
+    keys the whole state is given and only names changed are written back.
+    """
+    __slots__ = ('code', 'inputs', 'keys', 'max_steps', 'gas_limit')
+
+    def __init__(self, code: CodeType, inputs: dict = None, keys=None,
+                 max_steps=DEFAULT_MAX_STEPS, gas_limit=None) -> None:
+        """
+        :param code: code object
+        :param inputs: names given to the contract
+        :param keys: global keys read or written, None conflicts with all tasks
+        :param max_steps: step budget
+        :param gas_limit: gas limit, None is unlimited
+        """
+        self.code = code
+        self.inputs = inputs or dict()
+        self.keys = None if keys is None else frozenset(keys)
+        self.max_steps = max_steps
+        self.gas_limit = gas_limit
+
+
+class TaskResult(object):
+    __slots__ = ('index', 'steps', 'status', 'error', 'gas_used', 'return_value', 'written', 'deleted')
+
+    def __init__(self, index, steps, status, error, gas_used, return_value, written, deleted):
+        self.index = index  # submission order
+        self.steps = steps
+        self.status = status
+        self.error = error  # repr of the exception, exception objects may not be pickled
+        self.gas_used = gas_used
+        self.return_value = return_value
+        self.written = written  # keys stored or modified by the execution
+        self.deleted = deleted  # keys deleted by the execution
+
+    def __repr__(self):
+        return "<TaskResult {} {} steps={}>".format(self.index, self.status, self.steps)
+
+
+def _init_worker(b):
+    global _worker_builtins
+    _worker_builtins = share_builtins(b)
+    _worker_codes.clear()
+
+
+def _run_task(args):
+    """TaskResult, or the index if the code is not cached and data is None"""
+    index, digest, data, namespace, keys, max_steps, gas_limit = args
+    code = _worker_codes.get(digest)
+    if code is None:
+        if data is None:
+            return index
+        code = _worker_codes[digest] = marshal.loads(data)
+    # without keys, compare after the execution, a value may be modified in place
+    before = None if keys is not None else {key: pickle.dumps(value) for key, value in namespace.items()}
+    vm = VirtualMachine(code, _worker_builtins, namespace, namespace, gas_limit=gas_limit)
+    steps, status = vm.run(max_steps)
+    if before is None:
+        written = {key: namespace[key] for key in keys if key in namespace}
+    else:
+        written = {key: value for key, value in namespace.items()
+                   if key not in before or pickle.dumps(value) != before[key]}
+        keys = before
+    deleted = [key for key in keys if key not in namespace]
+    error = None if vm.error is None else repr(vm.error)
+    return TaskResult(index, steps, status, error, vm.gas_used, vm.return_value, written, deleted)
+
+
+def waves(tasks: list) -> list:
+    """split tasks in order into groups of disjoint keys, [[index,..],..]"""
+    groups = list()
+    group = list()
+    used = set()
+    for index, task in enumerate(tasks):
+        if group and (task.keys is None or used is None or not used.isdisjoint(task.keys)):
+            groups.append(group)
+            group = list()
+            used = set()
+        group.append(index)
+        used = None if task.keys is None else used | task.keys
+    if group:
+        groups.append(group)
+    return groups
+
+
+class ParallelExecutor(object):
+    """
+    run contracts on a process pool
+    tasks with disjoint keys run concurrently, a task conflicting with
+    earlier ones waits for them and sees their writes.
+    """
+
+    def __init__(self, state: dict, b: dict, processes=None) -> None:
+        """
+        :param state: global keys of contracts, updated by results
+        :param b: buildins, sent once to each worker
+        :param processes: number of workers, None is number of CPU
+        """
+        self.state = state
+        self.processes = processes or multiprocessing.cpu_count()
+        self._codes = dict()  # code -> (digest, marshalled)
+        self._sent = dict()  # digest -> tasks sent with the code, a worker missing it gets it on a retry
+        self._pool = multiprocessing.Pool(self.processes, _init_worker, (b,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+
+    def _marshal(self, code: CodeType) -> tuple:
+        if code not in self._codes:
+            data = marshal.dumps(code)
+            self._codes[code] = (sha256(data).digest(), data)
+        return self._codes[code]
+
+    def run(self, tasks: list):
+        """yield TaskResult in submission order, writes of finished tasks go to state"""
+        tasks = list(tasks)
+        for group in waves(tasks):
+            args = list()
+            for index in group:
+                task = tasks[index]
+                digest, data = self._marshal(task.code)
+                # a task is taken by any idle worker, the code goes with first tasks of a number of workers
+                sent = self._sent.get(digest, 0)
+                if self.processes <= sent:
+                    data = None
+                self._sent[digest] = sent + 1
+                if task.keys is None:
+                    namespace = dict(self.state)
+                else:
+                    namespace = {key: self.state[key] for key in task.keys if key in self.state}
+                namespace.update(task.inputs)
+                args.append((index, digest, data, namespace, task.keys, task.max_steps, task.gas_limit))
+            results = list()
+            for i, result in enumerate(self._pool.imap(_run_task, args)):
+                if not isinstance(result, TaskResult):
+                    # the worker has not got the code yet, retry with it while others run
+                    index, digest, _, namespace, keys, max_steps, gas_limit = args[i]
+                    data = self._marshal(tasks[index].code)[1]
+                    result = self._pool.apply_async(
+                        _run_task, ((index, digest, data, namespace, keys, max_steps, gas_limit),))
+                results.append(result)
+            for result in results:
+                if not isinstance(result, TaskResult):
+                    result = result.get()
+                if result.status == FINISHED:
+                    for key in result.deleted:
+                        self.state.pop(key, None)
+                    self.state.update(result.written)
+                yield result
+
+__all__ = [
+    "Task",
+    "TaskResult",
+    "ParallelExecutor",
+    "waves",
+]
@@ -0,0 +1,75 @@
+from rpvm.vm import VirtualMachine
+from types import CodeType
+from threading import Lock
+from contextlib import contextmanager
+
+
+DEFAULT_POOL_SIZE = 64  # max idle VMs kept
+
+
+class VMPool(object):
+    """
+    thread-safe pool of VirtualMachine
+    released VMs are reset and handed out again, so their stack, block stack
+    and fast locals lists are reused. all VMs have settings given to the pool.
+    """
+
+    def __init__(self, max_size=DEFAULT_POOL_SIZE, **kwargs) -> None:
+        """
+        :param max_size: max idle VMs kept, more released VMs are dropped
+        :param kwargs: settings of VirtualMachine, gas_limit, schedule, engine and so on
+        """
+        self.max_size = max_size
+        self.kwargs = kwargs
+        self.created = 0
+        self.reused = 0
+        self._idle = list()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._idle)
+
+    def acquire(self, code: CodeType, b: dict, l: dict, g: dict, gas_limit=None) -> VirtualMachine:
+        """
+        get a VM ready to execute code
+        :param gas_limit: override gas_limit of the pool settings
+        """
+        with self._lock:
+            vm = self._idle.pop() if self._idle else None
+            if vm is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if vm is None:
+            vm = VirtualMachine(code, b, l, g, **self.kwargs)
+        else:
+            vm.reset(code, l, g, b)
+        vm.gas_limit = self.kwargs.get('gas_limit') if gas_limit is None else gas_limit
+        return vm
+
+    def release(self, vm: VirtualMachine) -> None:
+        """return a VM, do not use it after released"""
+        vm.close()
+        vm.return_value = vm.error = None
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(vm)
+
+    @contextmanager
+    def borrow(self, code: CodeType, b: dict, l: dict, g: dict, gas_limit=None):
+        """`with pool.borrow(code, b, l, g) as vm:` releases the VM at the end"""
+        vm = self.acquire(code, b, l, g, gas_limit)
+        try:
+            yield vm
+        finally:
+            self.release(vm)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._idle.clear()
+
+
+__all__ = [
+    "DEFAULT_POOL_SIZE",
+    "VMPool",
+]
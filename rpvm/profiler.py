@@ -0,0 +1,158 @@
+import rpvm.opcodes
+from array import array
+from types import CodeType
+from time import perf_counter
+from dis import findlinestarts
+
+
+def _build_opnames() -> list:
+    """opcode byte -> name, superinstructions included"""
+    names = ['<{}>'.format(code) for code in range(256)]
+    for name, code in vars(rpvm.opcodes).items():
+        if name.isupper() and name != 'HAVE_ARGUMENT' and isinstance(code, int):
+            names[code] = name
+    return names
+
+
+opnames = _build_opnames()
+
+
+def line_table(code: CodeType) -> list:
+    """host instruction index, `offset // 2`, -> source line, decoded from co_lnotab"""
+    lines = [code.co_firstlineno] * (len(code.co_code) // 2)
+    starts = sorted(findlinestarts(code))
+    for i, (offset, line) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(code.co_code)
+        for index in range(offset // 2, end // 2):
+            lines[index] = line
+    return lines
+
+
+class _CodeStats(object):
+    __slots__ = ('code', 'ops', 'offsets', 'counts', 'times', 'heads')
+
+    def __init__(self, program) -> None:
+        self.code = program.code
+        self.ops = program.ops
+        self.offsets = [program.offset(index) for index in range(len(program))]
+        self.counts = array('Q', bytes(8 * len(program)))
+        self.times = array('d', bytes(8 * len(program)))
+        # pc after a superinstruction -> its index, fused ones never overlap
+        self.heads = {index + width: index for index, width in enumerate(program.widths) if 1 < width}
+
+
+class Profiler(object):
+    """
+    counts and optionally time of each opcode and instruction
+    attach() swaps the dispatch table of a VM for an instrumented one, so
+    a VM without a profiler runs as usual. a superinstruction is counted
+    as itself at the index of its first instruction.
+    """
+
+    def __init__(self, timing=False) -> None:
+        """
+        :param timing: measure time of handlers by perf_counter, slower
+        """
+        self.timing = timing
+        self.op_counts = array('Q', bytes(8 * 256))
+        self.op_times = array('d', bytes(8 * 256))
+        self._stats = dict()  # code -> _CodeStats
+        self._current = None  # (program, _CodeStats) executed last
+        self._attached = dict()  # vm -> original dispatch table
+
+    def attach(self, vm) -> 'Profiler':
+        if vm not in self._attached:
+            self._attached[vm] = vm._dispatch
+            vm._dispatch = self._instrument(vm._dispatch)
+        return self
+
+    def detach(self, vm=None) -> None:
+        """restore dispatch table of the VM, or all attached VMs if None"""
+        for target in (list(self._attached) if vm is None else [vm]):
+            target._dispatch = self._attached.pop(target)
+
+    def clear(self) -> None:
+        for index in range(256):
+            self.op_counts[index] = 0
+            self.op_times[index] = 0.0
+        self._stats.clear()
+        self._current = None
+
+    def _code_stats(self, program) -> _CodeStats:
+        stats = self._stats.get(program.code)
+        if stats is None or len(stats.counts) != len(program):
+            stats = self._stats[program.code] = _CodeStats(program)
+        self._current = (program, stats)
+        return stats
+
+    def _instrument(self, table: list) -> list:
+        return [self._wrap(code, handler) for code, handler in enumerate(table)]
+
+    def _wrap(self, code, handler):
+        op_counts = self.op_counts
+        op_times = self.op_times
+        fused = code in (rpvm.opcodes.NAME_CONST_BINARY_STORE, rpvm.opcodes.NAME_CONST_COMPARE_JUMP,
+                         rpvm.opcodes.CONST_TUPLE)
+
+        def lookup(vm):
+            # vm.pc is already next of the instruction
+            current = self._current
+            if current is None or current[0] is not vm.program:
+                stats = self._code_stats(vm.program)
+            else:
+                stats = current[1]
+            return stats, (stats.heads[vm.pc] if fused else vm.pc - 1)
+
+        if self.timing:
+            def instrumented(vm, data):
+                stats, index = lookup(vm)
+                start = perf_counter()
+                try:
+                    return handler(vm, data)
+                finally:
+                    elapsed = perf_counter() - start
+                    op_counts[code] += 1
+                    op_times[code] += elapsed
+                    stats.counts[index] += 1
+                    stats.times[index] += elapsed
+        else:
+            def instrumented(vm, data):
+                stats, index = lookup(vm)
+                op_counts[code] += 1
+                stats.counts[index] += 1
+                return handler(vm, data)
+        return instrumented
+
+    def opcode_stats(self) -> list:
+        """[(opname, count, seconds),..] most executed first"""
+        stats = [(opnames[code], count, self.op_times[code])
+                 for code, count in enumerate(self.op_counts) if count]
+        return sorted(stats, key=lambda item: (-item[1], item[0]))
+
+    def hot_offsets(self, limit=10) -> list:
+        """[(code, bytecode offset, line, opname, count, seconds),..] most executed first"""
+        hot = list()
+        for stats in self._stats.values():
+            code = stats.code
+            lines = line_table(code)
+            for index, count in enumerate(stats.counts):
+                if count:
+                    offset = stats.offsets[index]
+                    hot.append((code, offset, lines[offset // 2], opnames[stats.ops[index]],
+                                count, stats.times[index]))
+        hot.sort(key=lambda item: (-item[5], -item[4]) if self.timing else -item[4])
+        return hot[:limit]
+
+    def report(self, limit=10) -> str:
+        lines = ["{:>6} {:>6} {:24} {:>10} {:>10}".format("line", "offset", "opcode", "count", "usec")]
+        for code, offset, line, name, count, seconds in self.hot_offsets(limit):
+            lines.append("{:>6} {:>6} {:24} {:>10} {:>10.1f}".format(
+                line, offset, name, count, seconds * 1e6))
+        return "\n".join(lines)
+
+
+__all__ = [
+    "opnames",
+    "line_table",
+    "Profiler",
+]
@@ -0,0 +1,194 @@
+from rpvm.vm import VirtualMachine, OUT_OF_STEPS, OUT_OF_TIME, OUT_OF_GAS
+from collections import deque
+import asyncio
+
+
+DEFAULT_QUANTUM = 1000  # steps of a time slice of priority 1
+
+
+class Tenant(object):
+    """owner of VMs, steps and gas of all its VMs are limited by quotas"""
+    __slots__ = ('name', 'max_steps', 'max_gas', 'steps', 'gas_used')
+
+    def __init__(self, name, max_steps=None, max_gas=None) -> None:
+        self.name = name
+        self.max_steps = max_steps  # None is unlimited
+        self.max_gas = max_gas
+        self.steps = 0
+        self.gas_used = 0
+
+    def exhausted(self) -> bool:
+        return (self.max_steps is not None and self.max_steps <= self.steps) or \
+               (self.max_gas is not None and self.max_gas <= self.gas_used)
+
+    def __repr__(self):
+        return "<Tenant {} steps={} gas={}>".format(self.name, self.steps, self.gas_used)
+
+
+class Job(object):
+    """a VM in the scheduler"""
+    __slots__ = ('vm', 'tenant', 'priority', 'callback', 'steps', 'quanta', 'status')
+
+    def __init__(self, vm: VirtualMachine, tenant: Tenant, priority: int, callback) -> None:
+        self.vm = vm
+        self.tenant = tenant
+        self.priority = priority
+        self.callback = callback
+        self.steps = 0
+        self.quanta = 0
+        self.status = None  # status of the last quantum
+
+    @property
+    def done(self) -> bool:
+        return self.status is not None and self.status not in _RESUMABLE
+
+    def __repr__(self):
+        return "<Job {} {} steps={}>".format(self.tenant.name, self.status, self.steps)
+
+
+class Scheduler(object):
+    """
+    cooperative round robin of many VMs
+    a job runs `quantum * priority` steps, or `quantum_gas * priority` gas, per turn
+    and goes to the end of the queue. finished or failed jobs are retired and their
+    callback is called. jobs of a tenant over its quota wait until set_quota() or refill().
+    """
+
+    def __init__(self, quantum=DEFAULT_QUANTUM, quantum_gas=None) -> None:
+        """
+        :param quantum: steps of a time slice of priority 1
+        :param quantum_gas: gas of a time slice of priority 1, None is not limited by gas
+        """
+        self.quantum = quantum
+        self.quantum_gas = quantum_gas
+        self.tenants = dict()  # name -> Tenant
+        self.retired = 0
+        self._queue = deque()  # runnable jobs
+        self._waiting = dict()  # tenant name -> [job,..] over the quota
+
+    def __len__(self):
+        return len(self._queue) + sum(len(jobs) for jobs in self._waiting.values())
+
+    def tenant(self, name) -> Tenant:
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            tenant = self.tenants[name] = Tenant(name)
+        return tenant
+
+    def add(self, vm: VirtualMachine, tenant=None, priority=1, callback=None) -> Job:
+        """
+        :param vm: VM ready to run
+        :param tenant: name of the owner
+        :param priority: weight of time slice, 1 or more
+        :param callback: called with the job when retired
+        """
+        if priority < 1:
+            raise ValueError('priority must be 1 or more')
+        job = Job(vm, self.tenant(tenant), int(priority), callback)
+        self._queue.append(job)
+        return job
+
+    def set_quota(self, tenant, max_steps=None, max_gas=None) -> None:
+        tenant = self.tenant(tenant)
+        tenant.max_steps = max_steps
+        tenant.max_gas = max_gas
+        self._wake(tenant)
+
+    def refill(self, tenant) -> None:
+        """reset usage of the tenant"""
+        tenant = self.tenant(tenant)
+        tenant.steps = tenant.gas_used = 0
+        self._wake(tenant)
+
+    def _wake(self, tenant: Tenant) -> None:
+        if not tenant.exhausted():
+            self._queue.extend(self._waiting.pop(tenant.name, ()))
+
+    def run_once(self):
+        """run one time slice of the next job, return the job or None if idle"""
+        while self._queue:
+            job = self._queue.popleft()
+            if job.tenant.exhausted():
+                self._waiting.setdefault(job.tenant.name, list()).append(job)
+                continue
+            self._run_slice(job)
+            if job.status == _OVER_QUOTA:
+                self._waiting.setdefault(job.tenant.name, list()).append(job)
+            elif job.done:
+                self.retired += 1
+                if job.callback is not None:
+                    job.callback(job)
+            else:
+                self._queue.append(job)
+            return job
+        return None
+
+    def _run_slice(self, job: Job) -> None:
+        vm = job.vm
+        tenant = job.tenant
+        max_steps = self.quantum * job.priority
+        if tenant.max_steps is not None:
+            max_steps = min(max_steps, tenant.max_steps - tenant.steps)
+        max_gas = None if self.quantum_gas is None else self.quantum_gas * job.priority
+        by_quota = False
+        if tenant.max_gas is not None:
+            remain = tenant.max_gas - tenant.gas_used
+            by_quota = max_gas is None or remain < max_gas
+            max_gas = remain if by_quota else max_gas
+        gas_limit = vm.gas_limit
+        gas_used = vm.gas_used
+        if max_gas is not None and (gas_limit is None or gas_used + max_gas < gas_limit):
+            # slice limit, out of gas is cleared below when the VM still has gas
+            vm.gas_limit = gas_used + max_gas
+            try:
+                steps, status = vm.run(max_steps)
+            finally:
+                vm.gas_limit = gas_limit
+            if status == OUT_OF_GAS:
+                vm.error = None
+                status = _SLICE_OUT
+                if steps == 0 and by_quota:
+                    # next instruction costs more than the rest of the quota
+                    status = _OVER_QUOTA
+                elif steps == 0:
+                    # next instruction costs more than a slice
+                    steps, status = vm.run(1)
+        else:
+            steps, status = vm.run(max_steps)
+        job.steps += steps
+        job.quanta += 1
+        job.status = status
+        tenant.steps += steps
+        tenant.gas_used += vm.gas_used - gas_used
+
+    def run(self, max_quanta=None) -> int:
+        """run until no runnable job or max_quanta slices, return number of slices"""
+        count = 0
+        while max_quanta is None or count < max_quanta:
+            if self.run_once() is None:
+                break
+            count += 1
+        return count
+
+    async def run_until_idle(self, max_quanta=None) -> int:
+        """same as run(), yield to the event loop between slices"""
+        count = 0
+        while max_quanta is None or count < max_quanta:
+            if self.run_once() is None:
+                break
+            count += 1
+            await asyncio.sleep(0)
+        return count
+
+
+_SLICE_OUT = 'out of slice'  # used up gas of the time slice
+_OVER_QUOTA = 'over quota'  # waits for more quota of the tenant
+_RESUMABLE = frozenset((_SLICE_OUT, _OVER_QUOTA, OUT_OF_STEPS, OUT_OF_TIME))
+
+
+__all__ = [
+    "DEFAULT_QUANTUM",
+    "Tenant",
+    "Job",
+    "Scheduler",
+]
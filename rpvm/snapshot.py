@@ -0,0 +1,287 @@
+"""
+snapshot format
+
+    header: magic, version, kind, code fingerprint, snapshot id, base id
+    body: zlib compressed pickle of the state dict
+
+a FULL snapshot has all the state, a DELTA one has the state except
+namespaces and changed or removed keys of namespaces since the base snapshot.
+snapshot id is a digest of the body, base id is the id of the base snapshot.
+a FULL one merged from a DELTA keeps id of the DELTA, so next delta applies to it.
+code objects, such as of functions being called, of functions made in the
+VM or one loaded for MAKE_FUNCTION, are stored with their path in constants
+of the contract code, a snapshot never carries code to execute.
+the body is loaded by a restricted unpickler, it finds only globals of
+SAFE_BUILTINS, builtin exceptions, SAFE_GLOBALS and buildins of the VM, so a
+broken or forged snapshot cannot call other host functions.
+"""
+from rpvm.frame import Function
+from types import CodeType, ModuleType, MethodType, BuiltinMethodType
+from hashlib import sha256
+import importlib
+import builtins
+import copyreg
+import marshal
+import pickle
+import struct
+import zlib
+import io
+
+
+MAGIC = b'RPVM'
+SNAPSHOT_VERSION = 4
+FULL = 0
+DELTA = 1
+PICKLE_PROTOCOL = 4
+HEADER = struct.Struct('>4sBB8s8s8s')  # magic, version, kind, fingerprint, id, base id
+NAMESPACES = ('locals', 'globals', 'buildins')  # buildins is None without shared builtins
+
+# builtins a snapshot may call to rebuild values, types and iterators of them
+SAFE_BUILTINS = frozenset((
+    'bool', 'int', 'float', 'complex', 'str', 'bytes', 'bytearray', 'tuple', 'list',
+    'dict', 'set', 'frozenset', 'slice', 'range', 'iter', 'reversed', 'enumerate',
+    'zip', 'map', 'filter', 'Ellipsis', 'NotImplemented'))
+
+# other classes a snapshot may rebuild
+SAFE_GLOBALS = frozenset((
+    ('rpvm.frame', 'Function'), ('rpvm.frame', 'Cell'), ('rpvm.handlers', 'Unwind'),
+    ('rpvm.journal', 'JournaledDict'), ('rpvm.merkle', 'MerkleDict'),
+    ('rpvm.vm', 'VirtualMachineError'), ('rpvm.vm', 'OutOfGasError'),
+    ('rpvm.vm', 'ResourceLimitError'), ('rpvm.verify', 'VerifyError'),
+    ('rpvm.frontend', 'FrontendError'), ('rpvm.snapshot', 'bound_method')))
+
+# private method the VM pushes, such as __exit__ by SETUP_WITH
+BOUND_PRIVATE = frozenset(('__exit__',))
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def fingerprint(code: CodeType) -> bytes:
+    """identify code object a snapshot was taken from"""
+    # version 2 has no back references, they depend on refcounts of the objects
+    return sha256(marshal.dumps(code, 2)).digest()[:8]
+
+
+def code_path(code: CodeType, target: CodeType):
+    """indexes of co_consts from code to an equal nested code, None if not found"""
+    if code == target:
+        return ()
+    for index, const in enumerate(code.co_consts):
+        if isinstance(const, CodeType):
+            path = code_path(const, target)
+            if path is not None:
+                return (index,) + path
+    return None
+
+
+def code_at(code: CodeType, path) -> CodeType:
+    """nested code object by code_path()"""
+    try:
+        for index in path:
+            code = code.co_consts[index]
+    except (IndexError, TypeError):
+        raise SnapshotError('code path {} not found'.format(path))
+    if not isinstance(code, CodeType):
+        raise SnapshotError('code path {} is not a code object'.format(path))
+    return code
+
+
+def _reduce_function(fnc: Function):
+    # code is stored by its path, not by Function.__reduce__()
+    return Function, (fnc.code, fnc.qualname, fnc.defaults, fnc.kwdefaults, fnc.closure, fnc.annotations)
+
+
+def bound_method(obj, name):
+    """method of an instance, such as `items.append` on a stack"""
+    if isinstance(obj, type) or name.startswith('_') and name not in BOUND_PRIVATE:
+        raise SnapshotError('method {} is not allowed in a snapshot'.format(name))
+    return getattr(obj, name)
+
+
+def _reduce_method(method):
+    # pickle finds a method by getattr(), which reaches any attribute
+    owner = method.__self__
+    if owner is None or isinstance(owner, ModuleType):
+        return method.__reduce__()  # builtin function by its name
+    return bound_method, (owner, method.__name__)
+
+
+class _Pickler(pickle.Pickler):
+    """pickler storing code objects by code_path()"""
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[Function] = _reduce_function
+    dispatch_table[MethodType] = _reduce_method
+    dispatch_table[BuiltinMethodType] = _reduce_method
+
+    def __init__(self, file, code: CodeType) -> None:
+        super().__init__(file, PICKLE_PROTOCOL)
+        self.code = code
+
+    def persistent_id(self, obj):
+        if isinstance(obj, CodeType):
+            path = code_path(self.code, obj)
+            if path is None:
+                raise SnapshotError('code of `{}` is not in the contract'.format(obj.co_name))
+            return path
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """unpickler finding only allowed globals, code objects are resolved by code_at()"""
+
+    def __init__(self, file, code: CodeType, allowed: dict) -> None:
+        super().__init__(file)
+        self.code = code
+        self.allowed = allowed
+
+    def find_class(self, module, name):
+        if module == 'builtins':
+            obj = getattr(builtins, name, None)
+            if name in SAFE_BUILTINS or isinstance(obj, type) and issubclass(obj, BaseException):
+                return obj
+        if (module, name) in SAFE_GLOBALS:
+            return getattr(importlib.import_module(module), name)
+        if (module, name) in self.allowed:
+            return self.allowed[(module, name)]
+        raise SnapshotError('global {}.{} is not allowed in a snapshot'.format(module, name))
+
+    def persistent_load(self, pid):
+        return code_at(self.code, pid)
+
+
+def allowed_globals(b) -> dict:
+    """{(module, qualname): object} of types and functions in buildins"""
+    allowed = dict()
+    for value in (b or dict()).values():
+        module = getattr(value, '__module__', None)
+        qualname = getattr(value, '__qualname__', None)
+        if isinstance(module, str) and isinstance(qualname, str):
+            allowed[(module, qualname)] = value
+    return allowed
+
+
+def _pickle(obj, code: CodeType) -> bytes:
+    fp = io.BytesIO()
+    _Pickler(fp, code).dump(obj)
+    return fp.getvalue()
+
+
+def digest(data: bytes) -> bytes:
+    return sha256(data).digest()[:8]
+
+
+def key_digests(state: dict, code: CodeType) -> dict:
+    """{namespace: {key: digest of pickled value}} to find changes later"""
+    digests = dict()
+    try:
+        for ns in NAMESPACES:
+            if state[ns] is not None:
+                digests[ns] = {key: digest(_pickle(value, code)) for key, value in state[ns].items()}
+    except Exception as e:
+        raise SnapshotError('cannot serialize VM state: {}'.format(e))
+    return digests
+
+
+def snapshot_id(data: bytes) -> bytes:
+    return HEADER.unpack_from(data)[4]
+
+
+def _dumps(obj, code: CodeType) -> bytes:
+    try:
+        return zlib.compress(_pickle(obj, code))
+    except SnapshotError:
+        raise
+    except Exception as e:
+        raise SnapshotError('cannot serialize VM state: {}'.format(e))
+
+
+def encode(state: dict, code: CodeType, sid: bytes = None) -> bytes:
+    body = _dumps(state, code)
+    return HEADER.pack(MAGIC, SNAPSHOT_VERSION, FULL, fingerprint(code), sid or digest(body), bytes(8)) + body
+
+
+def encode_delta(state: dict, code: CodeType, base_id: bytes, base_digests: dict, digests: dict) -> bytes:
+    """
+    state without unchanged keys of namespaces
+    objects shared by a changed and an unchanged key are not shared after restored,
+    take a full snapshot when it matters.
+    """
+    delta = {key: value for key, value in state.items() if key not in NAMESPACES}
+    for ns in NAMESPACES:
+        if state[ns] is None or ns not in base_digests:
+            delta[ns] = (state[ns], None)  # replaced whole
+            continue
+        old = base_digests[ns]
+        new = digests[ns]
+        changed = {key: state[ns][key] for key, value in new.items() if old.get(key) != value}
+        removed = [key for key in old if key not in new]
+        delta[ns] = (changed, removed)
+    body = _dumps(delta, code)
+    return HEADER.pack(MAGIC, SNAPSHOT_VERSION, DELTA, fingerprint(code), digest(body), base_id) + body
+
+
+def decode(data: bytes, code: CodeType, b=None) -> (int, bytes, bytes, dict):
+    """
+    return (kind, id, base id, state)
+    :param b: buildins of the VM, its types and functions may be in the state
+    """
+    if len(data) < HEADER.size:
+        raise SnapshotError('too short snapshot')
+    magic, version, kind, code_fingerprint, sid, base = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError('not a snapshot')
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError('unsupported snapshot version {}'.format(version))
+    if kind not in (FULL, DELTA):
+        raise SnapshotError('unknown snapshot kind {}'.format(kind))
+    if code_fingerprint != fingerprint(code):
+        raise SnapshotError('snapshot of another code object')
+    try:
+        fp = io.BytesIO(zlib.decompress(data[HEADER.size:]))
+        state = _Unpickler(fp, code, allowed_globals(b)).load()
+    except SnapshotError:
+        raise
+    except Exception as e:
+        raise SnapshotError('broken snapshot body: {}'.format(e))
+    return kind, sid, base, state
+
+
+def merge(previous: bytes, delta: bytes, code: CodeType, b=None) -> bytes:
+    """
+    apply a DELTA snapshot to the FULL snapshot it was taken after, return a FULL one
+    :param b: buildins of the VM, its types and functions may be in the state
+    """
+    kind, previous_id, _, state = decode(previous, code, b)
+    if kind != FULL:
+        raise SnapshotError('previous snapshot is not full')
+    kind, sid, base, changes = decode(delta, code, b)
+    if kind == FULL:
+        return delta
+    if base != previous_id:
+        raise SnapshotError('delta is not taken after the previous snapshot')
+    for key, value in changes.items():
+        if key not in NAMESPACES:
+            state[key] = value
+            continue
+        changed, removed = value
+        if removed is None:
+            state[key] = changed
+            continue
+        namespace = state[key]
+        namespace.update(changed)
+        for name in removed:
+            del namespace[name]
+    return encode(state, code, sid)
+
+
+__all__ = [
+    "SNAPSHOT_VERSION",
+    "SAFE_BUILTINS",
+    "SAFE_GLOBALS",
+    "FULL",
+    "DELTA",
+    "SnapshotError",
+    "merge",
+]
@@ -0,0 +1,334 @@
+from operator import itemgetter
+from weakref import WeakValueDictionary
+import sqlite3
+import struct
+
+
+ENCODING_VERSION = 1  # bumped when dumps() changes, stored bytes depend on it
+DEFAULT_MAX_DIRTY = 1024  # buffered writes before written to the transaction
+
+# canonical encoding, a type tag and a body for each value
+# marshal writes sets in hash order, which differs by PYTHONHASHSEED and host
+# versions, so items of sets and keys of dicts are written sorted by their bytes
+# and a same value is always same bytes.
+_LENGTH = struct.Struct('>I')
+_FLOAT = struct.Struct('>d')
+_COMPLEX = struct.Struct('>dd')
+_SINGLETONS = {None: b'N', True: b'T', False: b'F', Ellipsis: b'.'}
+_CONSTANTS = {b'N': None, b'T': True, b'F': False, b'.': Ellipsis}
+_MAX_DEPTH = 200  # nested containers
+
+
+class StorageError(Exception):
+    pass
+
+
+def _encode(value, out: list, depth: int) -> None:
+    cls = type(value)
+    if value is None or cls is bool or value is Ellipsis:
+        out.append(_SINGLETONS[value])
+    elif cls is int:
+        body = value.to_bytes((value + (value < 0)).bit_length() // 8 + 1, 'big', signed=True)
+        out.extend((b'i', _LENGTH.pack(len(body)), body))
+    elif cls is float:
+        out.extend((b'g', _FLOAT.pack(value)))
+    elif cls is complex:
+        out.extend((b'y', _COMPLEX.pack(value.real, value.imag)))
+    elif cls is str:
+        body = value.encode('utf8', 'surrogatepass')
+        out.extend((b'u', _LENGTH.pack(len(body)), body))
+    elif cls is bytes or cls is bytearray:
+        out.extend((b's' if cls is bytes else b'b', _LENGTH.pack(len(value)), bytes(value)))
+    elif _MAX_DEPTH < depth:
+        raise StorageError('too deeply nested')
+    elif cls is tuple or cls is list:
+        out.extend((b'(' if cls is tuple else b'[', _LENGTH.pack(len(value))))
+        for item in value:
+            _encode(item, out, depth + 1)
+    elif cls is set or cls is frozenset:
+        out.extend((b'<' if cls is set else b'>', _LENGTH.pack(len(value))))
+        out.extend(sorted(_dumps(item, depth + 1) for item in value))
+    elif cls is dict:
+        out.extend((b'{', _LENGTH.pack(len(value))))
+        items = [(_dumps(key, depth + 1), item) for key, item in value.items()]
+        for key, item in sorted(items, key=itemgetter(0)):
+            out.append(key)
+            _encode(item, out, depth + 1)
+    else:
+        raise StorageError('cannot store {}'.format(cls.__name__))
+
+
+def _dumps(value, depth: int) -> bytes:
+    out = list()
+    _encode(value, out, depth)
+    return b''.join(out)
+
+
+def _decode(data: bytes, index: int):
+    """value at the index and the index after it"""
+    tag = data[index:index + 1]
+    index += 1
+    if tag in _CONSTANTS:
+        return _CONSTANTS[tag], index
+    if tag == b'g':
+        return _FLOAT.unpack_from(data, index)[0], index + _FLOAT.size
+    if tag == b'y':
+        return complex(*_COMPLEX.unpack_from(data, index)), index + _COMPLEX.size
+    size, = _LENGTH.unpack_from(data, index)
+    index += _LENGTH.size
+    if tag == b'i':
+        return int.from_bytes(data[index:index + size], 'big', signed=True), index + size
+    if tag == b'u':
+        return data[index:index + size].decode('utf8', 'surrogatepass'), index + size
+    if tag == b's':
+        return data[index:index + size], index + size
+    if tag == b'b':
+        return bytearray(data[index:index + size]), index + size
+    if tag == b'{':
+        value = dict()
+        for _ in range(size):
+            key, index = _decode(data, index)
+            value[key], index = _decode(data, index)
+        return value, index
+    items = list()
+    for _ in range(size):
+        item, index = _decode(data, index)
+        items.append(item)
+    if tag == b'[':
+        return items, index
+    if tag == b'(':
+        return tuple(items), index
+    if tag == b'<':
+        return set(items), index
+    if tag == b'>':
+        return frozenset(items), index
+    raise StorageError('unknown tag {!r}'.format(tag))
+
+
+def dumps(value) -> bytes:
+    """canonical bytes of a value, also hashed by rpvm.merkle"""
+    return _dumps(value, 0)
+
+
+def loads(data: bytes):
+    value, index = _decode(data, 0)
+    if index != len(data):
+        raise StorageError('trailing {} bytes'.format(len(data) - index))
+    return value
+
+
+class Storage(object):
+    """
+    sqlite file holding globals of contracts
+    writes of all namespaces go into one transaction until commit() or
+    rollback(), which flush or drop buffered writes of every live namespace.
+    """
+
+    def __init__(self, path=':memory:') -> None:
+        self.path = path
+        self.reads = 0  # keys read from the file
+        self.writes = 0  # keys written to the file
+        self._namespaces = WeakValueDictionary()  # {id: StorageDict} sharing the transaction
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS storage ("
+            "contract TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (contract, key)) WITHOUT ROWID")
+        self._conn.commit()
+
+    def load(self, contract: str, key: str):
+        """stored bytes of the key, None if not found"""
+        self.reads += 1
+        row = self._conn.execute(
+            "SELECT value FROM storage WHERE contract=? AND key=?", (contract, key)).fetchone()
+        return None if row is None else row[0]
+
+    def keys(self, contract: str) -> list:
+        return [row[0] for row in self._conn.execute(
+            "SELECT key FROM storage WHERE contract=? ORDER BY key", (contract,))]
+
+    def write(self, contract: str, items: list) -> None:
+        """write [(key, bytes or None to delete),..] in the transaction"""
+        self.writes += len(items)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO storage (contract, key, value) VALUES (?,?,?)",
+            [(contract, key, data) for key, data in items if data is not None])
+        self._conn.executemany(
+            "DELETE FROM storage WHERE contract=? AND key=?",
+            [(contract, key) for key, data in items if data is None])
+
+    def commit(self) -> None:
+        """flush every namespace and commit them together"""
+        for namespace in list(self._namespaces.values()):
+            namespace.flush()
+        self._conn.commit()
+
+    def rollback(self) -> None:
+        """drop the transaction, every namespace forgets its cached keys"""
+        self._conn.rollback()
+        for namespace in list(self._namespaces.values()):
+            namespace.invalidate()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def namespace(self, contract: str, max_dirty=DEFAULT_MAX_DIRTY) -> 'StorageDict':
+        """globals of the contract for VirtualMachine"""
+        namespace = StorageDict(self, contract, max_dirty)
+        self._namespaces[id(namespace)] = namespace
+        return namespace
+
+
+class StorageDict(dict):
+    """
+    globals loading a key from Storage at the first access
+    loaded keys stay in the dict as cache, written keys are buffered and
+    written at commit() or when more than `max_dirty` keys are buffered.
+    a loaded value modified in place, such as by `list.append()`, is found
+    by comparing the stored bytes at commit.
+    iterating and len() load all keys of the contract.
+    namespaces of a Storage share its transaction, commit() and rollback()
+    apply to all of them.
+    """
+    __slots__ = ('storage', 'contract', 'max_dirty', '_dirty', '_deleted', '_loaded', '__weakref__')
+
+    def __init__(self, storage: Storage, contract: str, max_dirty=DEFAULT_MAX_DIRTY) -> None:
+        dict.__init__(self)
+        self.storage = storage
+        self.contract = contract
+        self.max_dirty = max_dirty
+        self._dirty = set()  # keys written or deleted after the last flush
+        self._deleted = set()  # keys deleted, not loaded again
+        self._loaded = dict()  # key -> stored bytes of loaded keys
+
+    def __reduce__(self):
+        # a snapshot holds all keys as a plain dict
+        return dict, (dict(self.items()),)
+
+    def _fault(self, key) -> bool:
+        """load the key if stored, return True if exists"""
+        if dict.__contains__(self, key):
+            return True
+        if key in self._deleted or key in self._loaded or not isinstance(key, str):
+            return False
+        data = self.storage.load(self.contract, key)
+        if data is None:
+            return False
+        self._loaded[key] = data
+        dict.__setitem__(self, key, loads(data))
+        return True
+
+    def __contains__(self, key):
+        return self._fault(key)
+
+    def __missing__(self, key):
+        if self._fault(key):
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return dict.__getitem__(self, key) if self._fault(key) else default
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise StorageError('key must be str')
+        dict.__setitem__(self, key, value)
+        self._deleted.discard(key)
+        self._dirty.add(key)
+        if self.max_dirty < len(self._dirty):
+            self.flush()
+
+    def __delitem__(self, key):
+        if not self._fault(key):
+            raise KeyError(key)
+        dict.__delitem__(self, key)
+        self._deleted.add(key)
+        self._dirty.add(key)
+
+    def pop(self, key, *args):
+        if self._fault(key):
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+        if args:
+            return args[0]
+        raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        if not self._fault(key):
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def load_all(self) -> None:
+        for key in self.storage.keys(self.contract):
+            self._fault(key)
+
+    def __iter__(self):
+        self.load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.load_all()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+    def flush(self) -> None:
+        """write buffered keys into the storage transaction"""
+        items = list()
+        for key in self._dirty:
+            if dict.__contains__(self, key):
+                data = dumps(dict.__getitem__(self, key))
+                if self._loaded.get(key) != data:
+                    items.append((key, data))
+                self._loaded[key] = data
+            else:
+                items.append((key, None))
+                self._loaded.pop(key, None)
+        # loaded values modified in place
+        for key, data in self._loaded.items():
+            if key not in self._dirty and dict.__contains__(self, key):
+                new = dumps(dict.__getitem__(self, key))
+                if new != data:
+                    items.append((key, new))
+                    self._loaded[key] = new
+        self._dirty.clear()
+        if items:
+            self.storage.write(self.contract, sorted(items, key=lambda item: item[0]))
+
+    def commit(self) -> None:
+        """write all changes of the storage in one batch and commit it"""
+        self.storage.commit()
+
+    def rollback(self) -> None:
+        """drop uncommitted changes of the storage"""
+        self.storage.rollback()
+
+    def invalidate(self) -> None:
+        """forget cached and buffered keys, they are loaded again"""
+        dict.clear(self)
+        self._dirty.clear()
+        self._deleted.clear()
+        self._loaded.clear()
+
+
+__all__ = [
+    "ENCODING_VERSION",
+    "StorageError",
+    "Storage",
+    "StorageDict",
+]
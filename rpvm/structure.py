@@ -0,0 +1,1965 @@
+"""
+statements of the IR laid out again as Python3.6
+
+a host compiler since 3.7 lays out a same statement in its own way. a
+condition jumps at each operand of `and` and `or` since 3.7, SETUP_LOOP and
+BREAK_LOOP are gone since 3.8, an exit such as break or return runs copies of
+the finally body since 3.9, a while condition is copied to the loop end and
+small exit blocks to the jumps since 3.10, and blocks of try, except, finally
+and with are exception tables since 3.11. the same contract would take
+different steps on each host.
+
+rebuild() reads the statements back from the translated instructions, loops,
+if, try and with, and compiles them again as the Python3.6 compiler and its
+peephole optimizer do.
+
+* a condition of the host is a tree of `and`, `or` and `not` again,
+  evaluated as a value before POP_JUMP_IF_FALSE as 3.6
+* loops have SETUP_LOOP, POP_BLOCK and BREAK_LOOP, a continue under a block
+  is CONTINUE_LOOP
+* try, except, finally and with have their 3.6 blocks, exits unwinding them
+  and copies of a finally body are dropped, the VM unwinds as 3.6 ceval
+* copies of an exit block or of the implicit `return None` are one again
+
+a same source has a few readings, such as `not (a or b)` and
+`not a and not b`, a for loop with and without an `else` never reached,
+`continue` and nothing at the end of an except clause ending a loop, or an
+`else` ending in return and the code after a try copied into it. rebuild()
+takes one of them, so a source written so may still take a few different
+steps on a new host.
+"""
+from rpvm.opcodes import *
+from rpvm.frontend import FrontendError, HOST_VERSION, SYNTHETIC, _Instruction
+from rpvm.verify import stack_effect, VerifyError
+
+
+JUMPS = (JUMP_FORWARD, JUMP_ABSOLUTE)
+
+# jump -> value of the condition taking it
+CONDITIONS = {POP_JUMP_IF_FALSE: 0, POP_JUMP_IF_TRUE: 1}
+VALUES = {JUMP_IF_FALSE_OR_POP: 0, JUMP_IF_TRUE_OR_POP: 1}
+
+# control never goes to the next instruction
+TERMINALS = frozenset((
+    JUMP_FORWARD, JUMP_ABSOLUTE, RETURN_VALUE, RAISE_VARARGS, BREAK_LOOP, CONTINUE_LOOP, 'RERAISE'))
+
+# stores of a name -> delete of the name, an `except .. as` name is deleted
+DELETES = {
+    STORE_NAME: DELETE_NAME, STORE_FAST: DELETE_FAST, STORE_GLOBAL: DELETE_GLOBAL,
+    STORE_DEREF: DELETE_DEREF}
+
+LOOPS = ('for', 'while')
+
+# code of a comprehension, its loops have no block
+COMPREHENSIONS = frozenset(('<listcomp>', '<setcomp>', '<dictcomp>', '<genexpr>'))
+
+# layouts of the host compiler
+SETUP_BLOCKS = HOST_VERSION < (3, 8)  # SETUP_LOOP, SETUP_EXCEPT and BREAK_LOOP of 3.6
+CALL_FINALLY = HOST_VERSION == (3, 8)  # an exit calls the finally body
+COPY_FINALLY = (3, 9) <= HOST_VERSION  # an exit runs a copy of the finally body
+COPY_EXITS = (3, 10) <= HOST_VERSION  # small exit blocks are copied to jumps
+ROTATED = (3, 10) <= HOST_VERSION  # a while condition is copied to the loop end
+TABLES = (3, 11) <= HOST_VERSION  # exception tables instead of blocks
+INVERTED = (3, 12) <= HOST_VERSION  # a conditional jump backward is inverted over a jump
+COLD = (3, 12) <= HOST_VERSION  # handlers are laid out after the code
+
+# ops of blocks are host ops named by a str since 3.8
+HOST_POP_EXCEPT = POP_EXCEPT if SETUP_BLOCKS else 'POP_EXCEPT'
+HOST_END_FINALLY = END_FINALLY if SETUP_BLOCKS else 'END_FINALLY'
+HOST_SETUP_FINALLY = SETUP_FINALLY if SETUP_BLOCKS else 'SETUP_FINALLY'
+
+# end of a finally body or of the except clauses at the handler
+FINAL_ENDS = (HOST_END_FINALLY, 'RERAISE')
+
+# handler of a handler since 3.11, the exception of the outer block is back
+CLEANUP = ((COPY, 3), 'POP_EXCEPT', 'RERAISE')
+
+# handler of a with statement calling __exit__
+if SETUP_BLOCKS:
+    WITH_EXITS = (WITH_CLEANUP_START, WITH_CLEANUP_FINISH, END_FINALLY)
+elif CALL_FINALLY:
+    WITH_EXITS = ('WITH_CLEANUP_START', 'WITH_CLEANUP_FINISH', 'END_FINALLY')
+elif COLD:
+    WITH_EXITS = ('PUSH_EXC_INFO', 'WITH_EXCEPT_START', POP_JUMP_IF_TRUE, 'RERAISE', POP_TOP, 'POP_EXCEPT', POP_TOP,
+                  POP_TOP)
+elif TABLES:
+    WITH_EXITS = ('PUSH_EXC_INFO', 'WITH_EXCEPT_START', POP_JUMP_IF_TRUE, 'RERAISE', (COPY, 3), 'POP_EXCEPT',
+                  'RERAISE', POP_TOP, 'POP_EXCEPT', POP_TOP, POP_TOP)
+else:
+    WITH_EXITS = ('WITH_EXCEPT_START', POP_JUMP_IF_TRUE, 'RERAISE', POP_TOP, POP_TOP, POP_TOP, 'POP_EXCEPT', POP_TOP)
+
+
+class _Frame(object):
+    """a block of the statement being read, rpvm.frontend says fblock of compile.c"""
+    __slots__ = ('kind', 'head', 'end', 'handler', 'final', 'name', 'pushed', 'copies')
+
+    def __init__(self, kind, head=None, end=None, handler=None, final=None, name=None, pushed=False) -> None:
+        self.kind = kind  # 'for', 'while', 'except', 'finally', 'with', 'handler' or 'final'
+        self.head = head  # index a continue jumps to
+        self.end = end  # index a break jumps to
+        self.handler = handler  # index of the handler of the block
+        self.final = final  # (start, stop) of the finally body copied by an exit
+        self.name = name  # store of an `except .. as` name, cleared by an exit
+        self.pushed = pushed  # None pushed below a try of a loop by 3.8
+        self.copies = dict()  # index -> end of a copy of the code after the loop at a break
+
+
+class _Reader(object):
+    """
+    statements of instructions, a statement is an instruction or a tuple
+    ('if', offset, test, body, orelse), ('ifexp', offset, test, body, orelse),
+    ('while', offset, test, body, orelse), ('for', offset, iterator, body, orelse),
+    ('break', offset), ('continue', offset), ('assert', offset, test, body),
+    ('boolop', offset, op, values), ('chain', offset, values),
+    ('try', offset, body, handlers, orelse), ('finally', offset, body, final),
+    ('with', offset, context, target, body), ('comprehension', offset, body)
+    a test is ('leaf', items), ('chain', items, values), ('not', test),
+    ('and', tests) or ('or', tests)
+    """
+
+    def __init__(self, ins: list, none, comprehension=False, marked=()) -> None:
+        self.ins = ins
+        self.none = none  # oparg of LOAD_CONST None
+        self.comprehension = comprehension  # loops without SETUP_LOOP
+        self.marked = marked  # instructions after a line of no code
+        self.size = len(ins)  # index of the implicit `return None`
+        self.sources = dict()  # index -> indexes of the jumps to it
+        self.cold = dict()  # index of a handler read after the code since 3.12 -> index after it
+        for index, instr in enumerate(ins):
+            if instr.target is not None:
+                self.sources.setdefault(instr.target, list()).append(index)
+
+    def fail(self, index, reason) -> FrontendError:
+        offset = self.ins[index].offset if index < self.size else 'end'
+        return FrontendError('{} at {}'.format(reason, offset))
+
+    def resolve(self, index) -> int:
+        """index control goes to, through unconditional jumps"""
+        for _ in range(self.size):
+            if index < self.size and self.ins[index].op in JUMPS:
+                index = self.ins[index].target
+            else:
+                break
+        return index
+
+    def same(self, a, b) -> bool:
+        """control going to a goes to b"""
+        return a is not None and b is not None and self.resolve(a) == self.resolve(b)
+
+    def effect(self, index) -> int:
+        instr = self.ins[index]
+        if not isinstance(instr.op, int):
+            raise self.fail(index, 'host op {} out of its statement'.format(instr.op))
+        try:
+            return stack_effect(instr.op, instr.oparg)
+        except VerifyError:
+            raise self.fail(index, 'op {} out of its statement'.format(instr.op))
+
+    # statements
+
+    def block(self, i, stop, frames, follow, halt=None, depth=0) -> (list, int):
+        """
+        statements from i until stop or halt, control falls to follow
+        :param depth: values pushed before i, an item of a for loop
+        :return: (statements, index the block ends at)
+        """
+        ins = self.ins
+        items = list()
+        start = mark = i
+        while i < stop:
+            if depth == 0:
+                start, mark = i, len(items)
+                if i in self.cold:
+                    i = self.skip(i)
+                    continue
+                if halt is not None and halt(i):
+                    break
+                instr = ins[i]
+                if instr.op in JUMPS and i + 1 < instr.target == self.skip(i + 1):
+                    # over handlers read after the code since 3.12
+                    i = instr.target
+                    continue
+                if instr.op in JUMPS and self.skip(i + 1) == stop and self.same(instr.target, follow):
+                    i = stop
+                    break
+                found = self.leave(i, stop, frames, follow, False) or self.statement(i, stop, frames, follow)
+                if found is not None:
+                    nodes, i = found
+                    items.extend(nodes)
+                    continue
+            elif depth == 1 and frames:
+                found = self.leave(i, stop, frames, follow, True)
+                if found is not None:
+                    nodes, i = found
+                    items.extend(nodes)
+                    depth = 0
+                    continue
+            instr = ins[i]
+            op = instr.op
+            if op in CONDITIONS or op in VALUES:
+                found = self.value(i, stop, depth)
+                if found is None and op in CONDITIONS and self.test_jump(i, depth):
+                    found = self.conditional(start, items[mark:], i, stop, frames, follow)
+                    if found is not None:
+                        del items[mark:]
+                        depth = 0
+                if found is None:
+                    raise self.fail(i, 'jump of no statement')
+                node, i = found
+                items.append(node)
+                depth += self.pushed(node)
+                continue
+            if op == FOR_ITER and self.comprehension:
+                node, i = self.comprehension_loop(i, frames)
+                items.append(node)
+                depth -= 1
+                continue
+            if op == FOR_ITER and depth == 1:
+                node, i = self.loop(start, items[mark:], i, stop, frames, follow)
+                del items[mark:]
+                items.append(node)
+                depth = 0
+                continue
+            if op in (SETUP_WITH, 'SETUP_WITH', 'BEFORE_WITH') and depth == 1:
+                node, i = self.with_(start, items[mark:], i, stop, frames, follow)
+                del items[mark:]
+                items.append(node)
+                depth = 0
+                continue
+            if op == 'SETUP_FINALLY' and CALL_FINALLY and depth == 1 and \
+                    self.match(start, ((LOAD_CONST, self.none), op)) == i + 1:
+                # a try of a loop pushes None for a break in its finally body
+                del items[mark:]
+                nodes, i = self.try_(i, stop, frames, follow, pushed=True)
+                items.extend(nodes)
+                depth = 0
+                continue
+            if op in TERMINALS and op not in (RETURN_VALUE, RAISE_VARARGS):
+                raise self.fail(i, 'jump of no statement')
+            depth += self.effect(i)
+            items.append(instr)
+            i += 1
+        return items, i
+
+    def statement(self, i, stop, frames, follow):
+        """a loop or a block starting at i, None if no such statement"""
+        ins = self.ins
+        op = ins[i].op
+        if op == SETUP_LOOP:
+            return self.setup_loop(i, stop, frames, follow)
+        if op in (SETUP_EXCEPT, SETUP_FINALLY, 'SETUP_FINALLY'):
+            return self.try_(i, stop, frames, follow)
+        if TABLES:
+            handler = self.entered(i, frames)
+            if handler is not None:
+                return self.try_(i, stop, frames, follow, handler)
+        back = [j for j in self.sources.get(i, ()) if i <= j < stop and ins[j].op in JUMPS and not self.read(j)]
+        if back and not (frames and frames[-1].kind == 'while' and frames[-1].head == i):
+            found = self.scan(i, stop)
+            if found is None or not self.while_test(i, found[1], stop):
+                return self.while_(i, None, None, max(back), stop, frames, follow)
+        return None
+
+    def read(self, i) -> bool:
+        """i is in a handler read after the code since 3.12, a jump back from it ends a try statement"""
+        return any(start <= i < end for start, end in self.cold.items())
+
+    def skip(self, i) -> int:
+        """index after the handlers read after the code since 3.12 that start at i"""
+        while i in self.cold:
+            i = self.cold[i]
+        return i
+
+    def leave(self, i, stop, frames, follow, value):
+        """
+        break, continue or return unwinding blocks at i
+        :param value: a return value is on the stack
+        :return: (statements, index after the exit) or None
+        """
+        ins = self.ins
+        instr = ins[i]
+        if not value:
+            if instr.op == BREAK_LOOP:
+                return [('break', instr.offset)], i + 1
+            if instr.op == CONTINUE_LOOP:
+                return [('continue', instr.offset)], i + 1
+        loop = None
+        for position in range(len(frames) - 1, -1, -1):
+            if frames[position].kind in LOOPS:
+                loop = position
+                break
+        if not value and loop is not None and i in frames[loop].copies:
+            return [('break', instr.offset)], frames[loop].copies[i]
+        if not value and loop is not None:
+            inner = frames[loop + 1:]
+            j = self.unwind(i, inner, False)
+            if j is not None and j < self.size and ins[j].op in JUMPS and \
+                    self.same(ins[j].target, frames[loop].head):
+                return [('continue', instr.offset)], j + 1
+            if j is not None:
+                j = self.unwind(j, frames[loop:loop + 1], False)
+            if j is not None and j < self.size and ins[j].op in JUMPS and \
+                    self.same(ins[j].target, frames[loop].end) and \
+                    not (self.same(follow, frames[loop].end) and j + 1 >= stop):
+                return [('break', instr.offset)], j + 1
+        if SETUP_BLOCKS:
+            return None
+        j = self.unwind(i, frames, value)
+        if j is None or j >= self.size:
+            return None
+        if value:
+            if ins[j].op == RETURN_VALUE and j > i:
+                return [ins[j]], j + 1
+            return None
+        if ins[j].op == LOAD_CONST and j + 1 < self.size and ins[j + 1].op == RETURN_VALUE and j > i:
+            return [ins[j], ins[j + 1]], j + 2
+        if ins[j].op in JUMPS and ins[j].target == self.size and (j > i or not self.same(follow, self.size)):
+            return [_Instruction(LOAD_CONST, self.none, None, instr.offset),
+                    _Instruction(RETURN_VALUE, 0, 0, instr.offset)], j + 1
+        return None
+
+    def unwind(self, i, frames, value):
+        """index after the host code unwinding frames at i, innermost first, None if not there"""
+        for frame in reversed(frames):
+            i = self.unwind_one(i, frame, value)
+            if i is None:
+                return None
+        return i
+
+    def unwind_one(self, i, frame, value):
+        """index after the host code unwinding frame at i, None if not there"""
+        kind = frame.kind
+        if kind == 'while' or SETUP_BLOCKS:
+            return i
+        rotate = (ROT_TWO,) if value else ()
+        if kind == 'for':
+            return self.match(i, rotate + (POP_TOP,))
+        if kind == 'except':
+            return i if TABLES else self.match(i, (POP_BLOCK,))
+        if kind == 'handler':
+            name = frame.name
+            clear = () if name is None else (
+                (LOAD_CONST, self.none), (name.op, name.oparg), (DELETES[name.op], name.oparg))
+            if TABLES:
+                return self.match(i, rotate + ('POP_EXCEPT',) + clear)
+            rotate = ('ROT_FOUR',) if value else ()
+            if name is None:
+                return self.match(i, rotate + ('POP_EXCEPT',))
+            if CALL_FINALLY:
+                return self.match(i, rotate + (POP_BLOCK, 'POP_EXCEPT', 'CALL_FINALLY'))
+            return self.match(i, (POP_BLOCK,) + rotate + ('POP_EXCEPT',) + clear)
+        if kind == 'finally':
+            if CALL_FINALLY:
+                if not frame.pushed:
+                    return self.match(i, (POP_BLOCK, 'CALL_FINALLY'))
+                if value:
+                    return self.match(i, (POP_BLOCK, ROT_TWO, POP_TOP, 'CALL_FINALLY'))
+                return self.match(i, (POP_BLOCK, 'CALL_FINALLY', POP_TOP))
+            if not TABLES:
+                i = self.match(i, (POP_BLOCK,))
+            return None if i is None else self.copy(i, frame.final)
+        if kind == 'final':
+            if CALL_FINALLY:
+                return self.match(i, (('POP_FINALLY', int(value)),) + (rotate + (POP_TOP,) if frame.pushed else ()))
+            if TABLES:
+                return self.match(i, rotate + (POP_TOP,) + rotate + ('POP_EXCEPT',))
+            rotate = ('ROT_FOUR',) if value else ()
+            return self.match(i, rotate + (POP_TOP, POP_TOP, POP_TOP) + rotate + ('POP_EXCEPT',))
+        if kind == 'with':
+            if CALL_FINALLY:
+                return self.match(i, (POP_BLOCK,) + rotate + (
+                    'BEGIN_FINALLY', 'WITH_CLEANUP_START', 'WITH_CLEANUP_FINISH', ('POP_FINALLY', 0)))
+            # __exit__ called with three None
+            if TABLES:
+                none = (LOAD_CONST, self.none)
+                return self.match(i, rotate + (none, none, none, (CALL_FUNCTION, 2), POP_TOP))
+            return self.match(i, (POP_BLOCK,) + rotate + (
+                (LOAD_CONST, self.none), DUP_TOP, DUP_TOP, (CALL_FUNCTION, 3), POP_TOP))
+        raise self.fail(i, 'no exit of {}'.format(kind))
+
+    def match(self, i, ops):
+        """index after ops at i, an op or (op, oparg), None if other ops"""
+        return _matched(self.ins, i, ops)
+
+    def copy(self, i, final):
+        """
+        index after a copy of the finally body at final (start, stop) made
+        by the host at an exit since 3.9, None if not there, the finally body
+        at the handler unwinds the exception at its own exits
+        """
+        start, stop = final
+        frame = _Frame('final')
+        ins = self.ins
+        a = start
+        while a < stop:
+            for value in (False, True):
+                b = self.unwind_one(a, frame, value)
+                if b is not None and b > a:
+                    j = self.copy(i, (b, stop))
+                    if j is not None:
+                        return j
+            if i >= self.size or ins[i].op != ins[a].op or ins[i].arg != ins[a].arg:
+                return None
+            a += 1
+            i += 1
+        return i
+
+    # loops
+
+    def setup_loop(self, i, stop, frames, follow):
+        """SETUP_LOOP of 3.6 and 3.7, the loop follows it"""
+        end = self.ins[i].target
+        j = i + 1
+        back = [k for k in self.sources.get(j, ()) if j <= k < end and self.ins[k].op in JUMPS]
+        found = self.scan(j, end)
+        if found is not None and found[1] < end and self.ins[found[1]].op in CONDITIONS:
+            test_items, jump = found
+            test, body, anchor = self.condition(jump, end)
+            if anchor is not None and self.ins[anchor].op == POP_BLOCK and anchor - 1 >= body and \
+                    self.ins[anchor - 1].op in JUMPS and self.ins[anchor - 1].target == j:
+                first = self.leaf(test_items, test)
+                return self.while_(j, first, (body, anchor), anchor - 1, end, frames, follow, end)
+        # a for loop or a loop without a test
+        items, k = self.expression(j, end, stop_ops=(FOR_ITER,))
+        if k is not None and k < end and self.ins[k].op == FOR_ITER:
+            node, after = self.loop(j, items, k, end, frames, follow, end)
+            return [node], after
+        if back:
+            return self.while_(j, None, None, max(back), end, frames, follow, end)
+        raise self.fail(i, 'loop of no statement')
+
+    def while_test(self, start, jump, stop):
+        """the condition at jump starting at start is of a while loop"""
+        test, body, anchor = self.condition(jump, stop)
+        if anchor is None or anchor <= body:
+            return False
+        last = self.ins[anchor - 1]
+        if last.op in JUMPS and last.target == start:
+            return True
+        if ROTATED and self.bottom(start, body, anchor) is not None:
+            return True
+        return False
+
+    def bottom(self, start, body, anchor):
+        """
+        (index of the copy of a while condition at the loop end since 3.10,
+        index the loop ends at), None if not there
+        """
+        ins = self.ins
+        if anchor - 1 > body and ins[anchor - 1].op in JUMPS and self.same(ins[anchor - 1].target, anchor):
+            # the copy falls to a jump to the end
+            found = self.bottom(start, body, anchor - 1)
+            if found is not None:
+                return found
+        last = ins[anchor - 1]
+        if last.op in CONDITIONS and last.target == body:
+            pass
+        elif last.op in JUMPS and last.target == body and anchor - 2 >= body and \
+                ins[anchor - 2].op in CONDITIONS and ins[anchor - 2].target == anchor:
+            pass
+        else:
+            return None
+        first = self.scan(start, body)
+        if first is None:
+            return None
+        size = first[1] - start
+        for j in range(anchor - 1 - size, body - 1, -1):
+            if all(self.alike(start + k, j + k) for k in range(size)) and self.test_code(j, anchor, body):
+                return j, anchor
+        return None
+
+    def alike(self, a, b) -> bool:
+        x, y = self.ins[a], self.ins[b]
+        return x.op == y.op and x.arg == y.arg and x.target is None and y.target is None
+
+    def test_code(self, j, stop, body) -> bool:
+        """instructions from j to stop are a condition jumping to body or stop"""
+        ins = self.ins
+        while j < stop:
+            found = self.scan(j, stop)
+            if found is None:
+                return False
+            k = found[1]
+            if ins[k].target != body and not self.same(ins[k].target, stop) and not (j < ins[k].target < stop):
+                return False
+            j = k + 1
+            if j < stop and ins[j].op in JUMPS and ins[j].target == body:
+                j += 1
+            chain = self.chain_leaf(k)
+            if chain is not None:
+                j = chain[1]
+        return j == stop
+
+    def while_(self, start, first, test, back, stop, frames, follow, end=None):
+        """
+        a while loop from start
+        :param first: statements of the first leaf of the test, None without a test
+        :param test: (index of the body, anchor) of the test, None without a test
+        :param back: index of the jump to start at the loop end, or of the copied test
+        :param end: end of SETUP_LOOP, None since 3.8
+        """
+        ins = self.ins
+        offset = ins[start].offset
+        if test is None:
+            body, anchor = start, back + 1
+            body_stop = back
+            tree = None
+        else:
+            body, anchor = test
+            tree = first
+            body_stop = back
+        if end is not None:
+            # SETUP_LOOP end; ...; anchor: POP_BLOCK; orelse; end
+            orelse_start = anchor + 1 if anchor < end and ins[anchor].op == POP_BLOCK else anchor
+            loop_end = end
+        else:
+            orelse_start = anchor
+            loop_end = self.loop_end(body, body_stop, anchor, stop)
+        frame = _Frame('while', head=start, end=loop_end if loop_end > anchor else anchor)
+        following = list()
+        if test is None and end is None:
+            # no `else` of a loop never ending, a break jumps to code of the statement around it
+            orelse_start = loop_end = anchor
+            if COPY_EXITS and frame.end == anchor:
+                frame.copies = self.copies(body, body_stop, start)
+                if frame.copies:
+                    last = max(frame.copies)
+                    following = self.block(last, frame.copies[last], frames, follow)[0]
+        items, _ = self.block(body, body_stop, frames + [frame], start)
+        orelse = None
+        if orelse_start < loop_end:
+            orelse, _ = self.block(orelse_start, loop_end, frames, follow)
+        after = max(loop_end, orelse_start) if end is None else end
+        return [('while', offset, tree, items, orelse)] + following, after
+
+    def copies(self, body, stop, head):
+        """
+        copies of the code after a loop never ending at its breaks since 3.10,
+        a break is a line of no code before its copy, index -> end of the copy
+        """
+        ins = self.ins
+        found = dict()
+        for k in range(body, stop):
+            if ins[k] not in self.marked or k in self.sources:
+                continue
+            for e in range(k, min(k + 4, stop)):
+                if ins[e].target is not None and ins[e].op not in JUMPS or k < e and e in self.sources:
+                    break
+                if ins[e].op in (RETURN_VALUE, RAISE_VARARGS) or \
+                        ins[e].op in JUMPS and not self.same(ins[e].target, head):
+                    found[k] = e + 1
+                    break
+        return found
+
+    def loop_end(self, body, body_stop, anchor, stop):
+        """index a break of a loop since 3.8 jumps to, the anchor if no `else`"""
+        ends = [ins.target for ins in self.ins[body:body_stop]
+                if ins.op in JUMPS and anchor < ins.target < self.size]
+        if not ends:
+            return anchor
+        return min(min(ends), stop)
+
+    def loop(self, start, iterator, i, stop, frames, follow, end=None):
+        """a for loop, FOR_ITER at i, iterator: statements before it"""
+        ins = self.ins
+        exit = ins[i].target
+        back = exit - 1
+        if not (i < back and ins[back].op in JUMPS and ins[back].target == i):
+            back = exit
+        if end is not None:
+            orelse_start = exit + 1 if exit < end and ins[exit].op == POP_BLOCK else exit
+            loop_end = end
+        else:
+            orelse_start = exit
+            loop_end = self.loop_end(i + 1, back, exit, stop)
+        frame = _Frame('for', head=i, end=loop_end if loop_end > exit else exit)
+        items, _ = self.block(i + 1, back, frames + [frame], i, depth=1)
+        orelse = None
+        if orelse_start < loop_end:
+            orelse, _ = self.block(orelse_start, loop_end, frames, follow)
+        after = max(loop_end, orelse_start) if end is None else end
+        return ('for', ins[i].offset, iterator, items, orelse), after
+
+    def comprehension_loop(self, i, frames):
+        """a loop of a comprehension, FOR_ITER at i, the iterator stays below the body"""
+        ins = self.ins
+        exit = ins[i].target
+        back = exit - 1
+        if not (i < back and ins[back].op in JUMPS and ins[back].target == i):
+            raise self.fail(i, 'loop of a comprehension')
+        frame = _Frame('for', head=i, end=exit)
+        items, _ = self.block(i + 1, back, frames + [frame], i, depth=1)
+        return ('comprehension', ins[i].offset, items), exit
+
+    # expressions
+
+    def expression(self, i, stop, stop_ops=()):
+        """
+        an expression from i, (statements, index of the first instruction
+        after it or of stop_ops), (None, None) if not an expression
+        """
+        ins = self.ins
+        items = list()
+        depth = 0
+        while i < stop:
+            op = ins[i].op
+            if op in stop_ops and depth == 1:
+                return items, i
+            if op in CONDITIONS or op in VALUES:
+                found = self.value(i, stop, depth)
+                if found is None:
+                    return (items, i) if self.test_jump(i, depth) else (None, None)
+                node, i = found
+                items.append(node)
+                depth += self.pushed(node)
+                continue
+            if not isinstance(op, int) or op in TERMINALS or op in (FOR_ITER, SETUP_LOOP, SETUP_EXCEPT,
+                                                                   SETUP_FINALLY, SETUP_WITH, POP_BLOCK):
+                break
+            try:
+                after = depth + stack_effect(op, ins[i].oparg)
+            except VerifyError:
+                break
+            if after < 1 and depth >= 1:
+                break
+            depth = after
+            items.append(ins[i])
+            i += 1
+        if depth == 1:
+            return items, i
+        return None, None
+
+    def pure(self, i, stop) -> list:
+        """statements of an expression exactly from i to stop, None if not one"""
+        items, j = self.expression(i, stop)
+        if items is None or j != stop:
+            return None
+        return items
+
+    def scan(self, i, stop):
+        """a leaf of a condition from i, (statements, index of its jump), None if not one"""
+        ins = self.ins
+        items = list()
+        depth = 0
+        while i < stop:
+            op = ins[i].op
+            if op in CONDITIONS or op in VALUES:
+                found = self.value(i, stop, depth)
+                if found is None:
+                    if op in CONDITIONS and self.test_jump(i, depth):
+                        return items, i
+                    return None
+                node, i = found
+                items.append(node)
+                depth += self.pushed(node)
+                continue
+            if not isinstance(op, int) or op in TERMINALS or op in (FOR_ITER, SETUP_LOOP, SETUP_EXCEPT,
+                                                                   SETUP_FINALLY, SETUP_WITH, POP_BLOCK):
+                return None
+            try:
+                depth += stack_effect(op, ins[i].oparg)
+            except VerifyError:
+                return None
+            if depth < 1:
+                return None
+            items.append(ins[i])
+            i += 1
+        return None
+
+    def test_jump(self, i, depth) -> bool:
+        """the jump at i ends a leaf of a condition, a comparison chain jumps over a copy"""
+        return depth == 1 or depth == 2 and self.chain_leaf(i) is not None
+
+    def pushed(self, node) -> int:
+        """stack effect of a value from its jump, a chain drops the copy"""
+        return -1 if node[0] == 'chain' else 0
+
+    def value(self, i, stop, depth):
+        """a value of `and`, `or`, a comparison chain or an if expression at the jump at i"""
+        ins = self.ins
+        instr = ins[i]
+        op = instr.op
+        if op in VALUES:
+            chain = self.value_chain(i)
+            if chain is not None:
+                return chain
+            return self.boolop(i, op, instr.target, stop)
+        if depth < 1:
+            return None
+        # a jump of `and` or `or` to the next test of `or` or `and`, see threaded()
+        target = instr.target
+        if 0 < target < self.size and ins[target - 1].op in VALUES and \
+                VALUES[ins[target - 1].op] != CONDITIONS[op] and i < target - 1:
+            return self.boolop(i, JUMP_IF_FALSE_OR_POP if CONDITIONS[op] == 0 else JUMP_IF_TRUE_OR_POP,
+                               target - 1, stop)
+        return self.ifexp(i, stop, depth)
+
+    def boolop(self, i, op, end, stop):
+        """values of `and` or `or` from the jump at i to end"""
+        ins = self.ins
+        offset = ins[i].offset
+        values = list()
+        j = i + 1
+        while True:
+            items, k = self.expression(j, end + 1 if end < stop and ins[end].op in VALUES else min(end, stop),
+                                       stop_ops=())
+            if items is None:
+                raise self.fail(j, 'value of `and` or `or`')
+            values.append(items)
+            if k == end:
+                break
+            jump = ins[k]
+            if jump.op in VALUES and jump.target == end and jump.op == op:
+                j = k + 1
+                continue
+            if jump.op in CONDITIONS and 0 < jump.target and ins[jump.target - 1] is ins[end] and \
+                    CONDITIONS[jump.op] == VALUES[op]:
+                j = k + 1
+                continue
+            raise self.fail(k, 'value of `and` or `or`')
+        return ('boolop', offset, op, values), end
+
+    def value_chain(self, i):
+        """a comparison chain as a value, JUMP_IF_FALSE_OR_POP at i to its cleanup"""
+        ins = self.ins
+        cleanup = ins[i].target
+        if not (i >= 3 and ins[i].op == JUMP_IF_FALSE_OR_POP and ins[i - 1].op == COMPARE_OP and
+                ins[i - 2].op == ROT_THREE and ins[i - 3].op == DUP_TOP and
+                cleanup + 1 < self.size and ins[cleanup].op == ROT_TWO and ins[cleanup + 1].op == POP_TOP and
+                ins[cleanup - 1].op == JUMP_FORWARD and ins[cleanup - 1].target == cleanup + 2):
+            return None
+        values = list()
+        j = i + 1
+        while True:
+            items = list()
+            depth = 0
+            while j < cleanup - 1:
+                op = ins[j].op
+                if op == JUMP_IF_FALSE_OR_POP and ins[j].target == cleanup:
+                    break
+                if op in CONDITIONS or op in VALUES:
+                    node, j = self.value(j, cleanup, depth)
+                    items.append(node)
+                    depth += self.pushed(node)
+                    continue
+                depth += self.effect(j)
+                items.append(ins[j])
+                j += 1
+            values.append(items)
+            if j >= cleanup - 1:
+                break
+            j += 1
+        return ('chain', ins[i].offset, values), cleanup + 2
+
+    def ifexp(self, i, stop, depth):
+        """an if expression, the first jump of its test at i, None if not one"""
+        ins = self.ins
+        test, body, orelse = self.condition(i, stop)
+        if orelse is None or orelse <= body + 1 or orelse >= stop:
+            return None
+        jump = ins[orelse - 1]
+        if jump.op not in JUMPS or jump.target <= orelse or jump.target > stop:
+            return None
+        end = jump.target
+        first = self.pure(body, orelse - 1)
+        second = self.pure(orelse, end)
+        if first is None or second is None:
+            return None
+        return ('ifexp', ins[i].offset, test, first, second), end
+
+    # conditions
+
+    def chain_leaf(self, k):
+        """
+        a comparison chain jumping since 3.7, (items of its values, index after
+        it, (op, target) of its last jump) if the jump at k is its first one
+        """
+        ins = self.ins
+        cleanup = ins[k].target
+        if not (k >= 3 and ins[k].op == POP_JUMP_IF_FALSE and ins[k - 1].op == COMPARE_OP and
+                ins[k - 2].op == ROT_THREE and ins[k - 3].op == DUP_TOP and
+                k < cleanup < self.size and ins[cleanup].op == POP_TOP and
+                ins[cleanup - 1].op == JUMP_FORWARD and ins[cleanup - 2].op in CONDITIONS):
+            return None
+        # a false comparison before the last one jumps where the last false one does
+        last = ins[cleanup - 2]
+        after = cleanup + 1
+        if last.op == POP_JUMP_IF_FALSE:
+            if not (after < self.size and ins[after].op in JUMPS and self.same(ins[after].target, last.target)):
+                return None
+            after += 1
+        if ins[cleanup - 1].target != after:
+            return None
+        values = list()
+        j = k + 1
+        while True:
+            items = list()
+            depth = 0
+            while j < cleanup - 2:
+                op = ins[j].op
+                if op == POP_JUMP_IF_FALSE and ins[j].target == cleanup:
+                    break
+                if op in CONDITIONS or op in VALUES:
+                    found = self.value(j, cleanup, depth)
+                    if found is None:
+                        return None
+                    node, j = found
+                    items.append(node)
+                    depth += self.pushed(node)
+                    continue
+                if not isinstance(op, int):
+                    return None
+                depth += self.effect(j)
+                items.append(ins[j])
+                j += 1
+            values.append(items)
+            if j >= cleanup - 2:
+                break
+            j += 1
+        return values, after, (last.op, last.target)
+
+    def leaves(self, k, stop):
+        """
+        leaves of a condition from its first jump at k
+        :return: [(statements, index of the leaf, value jumping, target, index after it),..]
+        """
+        ins = self.ins
+        found = list()
+
+        def add(items, start, jump):
+            chain = self.chain_leaf(jump)
+            if chain is not None:
+                values, after, (op, target) = chain
+                found.append((('chain', items, values), start, CONDITIONS[op], target, after))
+            else:
+                found.append((('leaf', items), start, CONDITIONS[ins[jump].op], ins[jump].target, jump + 1))
+
+        add([], k, k)
+        best = None
+        while True:
+            if self.valid(found):
+                best = len(found)
+            j = found[-1][4]
+            # `if a: pass`, the jump goes to the next instruction
+            if j >= stop or found[-1][3] == j:
+                break
+            # a leaf no jump from outside of the condition goes to
+            starts = set(leaf[1] for leaf in found)
+            if any(source < found[0][1] and source not in starts for source in self.sources.get(j, ())):
+                break
+            leaf = self.scan(j, stop)
+            if leaf is None:
+                break
+            add(leaf[0], j, leaf[1])
+        if best is None:
+            return None
+        return found[:best]
+
+    def valid(self, leaves) -> bool:
+        """leaves jump inside, to the end or to a single target outside"""
+        starts = set(leaf[1] for leaf in leaves[1:])
+        end = leaves[-1][4]
+        outside = set()
+        for index, leaf in enumerate(leaves):
+            target = leaf[3]
+            if target in starts:
+                if target <= leaf[1]:
+                    return False
+            elif target != end:
+                outside.add(target)
+        return len(outside) == 1 and leaves[-1][3] in outside or not outside and leaves[-1][3] == end
+
+    def condition(self, k, stop):
+        """(test, index of the body, index jumped to if false) of a condition from the jump at k"""
+        leaves = self.leaves(k, stop)
+        if leaves is None:
+            return None, None, None
+        end = leaves[-1][4]
+        false = leaves[-1][3]
+        return self.tree(leaves, 0, len(leaves), false, 0, end), end, false
+
+    def tree(self, leaves, lo, hi, target, cond, fall):
+        """test of leaves[lo:hi] jumping to target if its value is cond, otherwise falling to fall"""
+        if hi - lo == 1:
+            item, _, value, jumps, _ = leaves[lo]
+            if jumps != target:
+                raise self.fail(leaves[lo][1], 'condition of no test')
+            return item if value == cond else ('not', item)
+        for goal, inner in ((target, cond), (fall, 1 - cond)):
+            groups = self.groups(leaves, lo, hi, goal, target)
+            if groups is None:
+                continue
+            tests = list()
+            for position, (a, b) in enumerate(groups):
+                last = position == len(groups) - 1
+                group_fall = leaves[b - 1][4]
+                if last:
+                    tests.append(self.tree(leaves, a, b, target, cond, fall))
+                else:
+                    tests.append(self.tree(leaves, a, b, goal, inner, group_fall))
+            # `or` jumps on a true operand, `and` on a false one
+            if all(test[0] == 'not' for test in tests):
+                # `not (a or b)` rather than `not a and not b`
+                return ('not', ('and' if inner == 1 else 'or', [test[1] for test in tests]))
+            return ('or' if inner == 1 else 'and', tests)
+        return ('not', self.tree(leaves, lo, hi, target, 1 - cond, fall))
+
+    def groups(self, leaves, lo, hi, goal, target):
+        """operands of leaves[lo:hi], each ends at a jump to goal, the last at a jump to target"""
+        groups = list()
+        a = lo
+        for b in range(lo, hi):
+            end = leaves[b][4]
+            wanted = target if b == hi - 1 else goal
+            if leaves[b][3] != wanted:
+                continue
+            inner = set(leaf[1] for leaf in leaves[a + 1:b + 1])
+            if any(leaves[c][3] > end and leaves[c][3] in self.starts_of(leaves, b + 1, hi)
+                   for c in range(a, b + 1)):
+                continue
+            if b < hi - 1 and goal == target and any(
+                    leaves[c][3] == target for c in range(b + 1, hi - 1)) and False:
+                continue
+            groups.append((a, b + 1))
+            a = b + 1
+        if a != hi or len(groups) < 2:
+            return None
+        return groups
+
+    def starts_of(self, leaves, lo, hi):
+        return set(leaf[1] for leaf in leaves[lo:hi])
+
+    def leaf(self, items, test):
+        """test with statements of its first leaf"""
+        kind = test[0]
+        if kind == 'leaf':
+            return ('leaf', list(items) + test[1])
+        if kind == 'chain':
+            return ('chain', list(items) + test[1], test[2])
+        if kind == 'not':
+            return ('not', self.leaf(items, test[1]))
+        return (kind, [self.leaf(items, test[1][0])] + test[1][1:])
+
+    def conditional(self, start, first, k, stop, frames, follow):
+        """an if, while or assert statement, first: statements of the first leaf before the jump at k"""
+        ins = self.ins
+        test, body, false = self.condition(k, stop)
+        if test is None:
+            return None
+        tree = self.leaf(first, test)
+        offset = ins[start].offset
+        if body == false:
+            return ('if', offset, tree, [], None), body
+        end = self.passed(body, false, stop)
+        if end is not None:
+            return ('if', offset, tree, [], None), end
+        # a while loop since 3.8, the loop of 3.6 and 3.7 has SETUP_LOOP
+        if not SETUP_BLOCKS and body < false <= stop:
+            last = ins[false - 1]
+            if false - 1 >= body and last.op in JUMPS and last.target == start:
+                nodes, after = self.while_(start, tree, (body, false), false - 1, stop, frames, follow)
+                return nodes[0], after
+            found = self.bottom(start, body, false) if ROTATED else None
+            if found is not None:
+                copy, anchor = found
+                nodes, after = self.while_(start, tree, (body, anchor), copy, stop, frames, follow)
+                return nodes[0], after
+        if body < false <= stop:
+            assertion = self.assertion(body, false)
+            if assertion is not None:
+                leaves = self.leaves(k, stop)
+                test = self.tree(leaves, 0, len(leaves), false, 1, body)
+                return ('assert', offset, self.leaf(first, test), assertion), false
+            then_stop = false
+            orelse = None
+            after = false
+            last = ins[false - 1] if false - 1 >= body else None
+            if last is not None and last.op in JUMPS:
+                target = last.target
+                if target >= false and (target <= stop or self.same(target, follow)) and \
+                        not self.breaks(target, frames):
+                    then_stop = false - 1
+                    end = min(target, stop)
+                    orelse = self.block(false, end, frames, follow)[0]
+                    after = end
+            items = self.block(body, then_stop, frames, follow if orelse is not None or then_stop == stop
+                               else false)[0]
+            return ('if', offset, tree, items, orelse), after
+        if self.same(false, follow) or false == stop:
+            items = self.block(body, stop, frames, follow)[0]
+            return ('if', offset, tree, items, None), stop
+        # since 3.8 a jump to an `else: break` goes to the end of the loop
+        orelse = self.threaded(body, stop, false)
+        if orelse is not None:
+            items = self.block(body, orelse, frames, follow)[0]
+            return ('if', offset, tree, items, self.block(orelse, stop, frames, follow)[0]), stop
+        raise self.fail(k, 'condition jumping out of its statement')
+
+    def passed(self, body, false, stop):
+        """
+        end of the body of `if a: pass` since 3.10, the code after the statement
+        is copied to the body as a small exit block, None if not so
+        """
+        ins = self.ins
+        if not COPY_EXITS or body >= false:
+            return None
+        if self.same(false, self.size):
+            # the implicit `return None`, its jumps go to the end
+            end = self.match(body, ((LOAD_CONST, self.none), RETURN_VALUE))
+            if end is not None and (end == stop or COLD and ins[end].op == 'PUSH_EXC_INFO'):
+                return end
+            return None
+        size = false - body
+        if ins[false - 1].op in TERMINALS and false + size <= self.size and \
+                all(_same_instruction(ins[body + n], ins[false + n], False) for n in range(size)):
+            return false
+        return None
+
+    def breaks(self, target, frames) -> bool:
+        """a jump to target leaves a block in a loop, the body of a with read to the end of the loop since 3.12"""
+        for position in range(len(frames) - 1, -1, -1):
+            if frames[position].kind in LOOPS:
+                return self.same(target, frames[position].end) and \
+                    any(frame.handler is not None for frame in frames[position + 1:])
+        return False
+
+    def threaded(self, body, stop, false):
+        """start of an else of a jump after the if body going where false goes, None if no such else"""
+        ins = self.ins
+        for e in range(stop - 1, body, -1):
+            if ins[e].op in JUMPS and ins[e - 1].op in TERMINALS and self.same(e, false):
+                return e
+        return None
+
+    def assertion(self, body, false):
+        """statements raising AssertionError from body to false, None if not those"""
+        ins = self.ins
+        first, last = ins[body], ins[false - 1]
+        if first.op != LOAD_GLOBAL or first.arg != 'AssertionError' or last.op != RAISE_VARARGS or last.oparg != 1:
+            return None
+        if false - 1 == body + 1:
+            return ins[body:false]
+        if ins[false - 2].op != CALL_FUNCTION or ins[false - 2].oparg != 1:
+            return None
+        message = self.pure(body + 1, false - 2)
+        if message is None:
+            return None
+        return [first] + message + ins[false - 2:false]
+
+    # blocks
+
+    def handler_of(self, frames):
+        """handler of the innermost block of frames, None out of any"""
+        for frame in reversed(frames):
+            if frame.handler is not None:
+                return frame.handler
+        return None
+
+    def inside(self, handler, outer) -> bool:
+        """code handled by handler is in the block of outer since 3.11, the handler of a handler is outside it"""
+        seen = set()
+        while handler is not None and handler not in seen:
+            if handler == outer:
+                return True
+            seen.add(handler)
+            handler = self.ins[handler].handler
+        return outer is None
+
+    def entered(self, i, frames):
+        """handler of a try statement starting at i since 3.11, None if no try starts at i"""
+        ins = self.ins
+        outer = self.handler_of(frames)
+        handler = ins[i].handler
+        found = None
+        seen = set()
+        while handler is not None and handler != outer and handler not in seen:
+            seen.add(handler)
+            if ins[handler].op == 'PUSH_EXC_INFO' and ins[handler + 1].op != 'WITH_EXCEPT_START':
+                found = handler
+            handler = ins[handler].handler
+        return found if handler == outer else None
+
+    def clause(self, handler) -> bool:
+        """an except clause at handler rather than a finally body"""
+        ins = self.ins
+        if TABLES:
+            if ins[handler + 1].op == POP_TOP:
+                return True
+            items, k = self.expression(handler + 1, self.size, stop_ops=('CHECK_EXC_MATCH',))
+            return k is not None and k < self.size and ins[k].op == 'CHECK_EXC_MATCH'
+        return ins[handler].op == DUP_TOP or self.match(handler, (POP_TOP, POP_TOP, POP_TOP)) is not None
+
+    def try_(self, i, stop, frames, follow, handler=None, pushed=False):
+        """
+        a try statement at its SETUP_EXCEPT or SETUP_FINALLY at i, at its
+        first instruction of the handler since 3.11
+        :param pushed: None pushed below it in a loop by 3.8
+        """
+        ins = self.ins
+        start = i
+        if not TABLES:
+            handler = ins[i].target
+            start = i + 1
+        if ins[i].op == SETUP_FINALLY if SETUP_BLOCKS else not self.clause(handler):
+            return self.finally_(i, start, handler, stop, frames, follow, pushed)
+        return self.except_(i, start, handler, stop, frames, follow)
+
+    def finally_(self, i, start, handler, stop, frames, follow, pushed):
+        ins = self.ins
+        offset = ins[i].offset
+        # the finally body at the handler, its exits unwind the exception
+        final_start = handler + 1 if TABLES else handler
+        final_bound = ins[handler].handler if TABLES else stop
+        frame = _Frame('final', handler=ins[handler].handler if TABLES else None, pushed=pushed)
+        final, final_stop = self.block(final_start, final_bound, frames + [frame], final_bound,
+                                       halt=lambda k: ins[k].op in FINAL_ENDS)
+        after = final_stop + 1
+        if CALL_FINALLY and pushed:
+            after = self.match(after, (POP_TOP,))
+        elif TABLES:
+            after = self.match(after, CLEANUP)
+        if final_stop >= final_bound or after is None:
+            raise self.fail(final_start, 'finally body')
+        frame = _Frame('finally', handler=handler, final=(final_start, final_stop), pushed=pushed)
+        inner = frames + [frame]
+        if TABLES:
+            # the try body leaves the block of the handler at the copy of the finally body
+            body, j = self.block(start, stop, inner, stop, halt=lambda k: not self.inside(
+                ins[k].handler, handler) and not self.exits(k, handler, inner, follow))
+            # no copy when the try body never ends
+            k = self.copy(j, frame.final)
+            if COLD:
+                self.cold[handler] = after
+                after = j if k is None else k
+                # a copy jumped to from handlers only is laid out among them
+                for m in range(j, self.size):
+                    sources = self.sources.get(m, ())
+                    if not sources or self.read(m) or not all(self.read(source) for source in sources):
+                        continue
+                    end = self.copy(m, frame.final)
+                    if end is not None and end < self.size and ins[end].op in JUMPS and \
+                            (self.same(ins[end].target, follow) or self.same(ins[end].target, after)):
+                        self.cold[m] = end + 1
+            elif not (k is None and j == handler or k == handler or k == handler - 1 and ins[k].op in JUMPS):
+                raise self.fail(j, 'copy of a finally body')
+            return [('finally', offset, body, final)], after
+        # the try body ends at POP_BLOCK and LOAD_CONST None, BEGIN_FINALLY or a copy of the finally body
+        body_stop = handler
+        if not COPY_FINALLY:
+            if self.match(handler - 2, (POP_BLOCK, LOAD_CONST if SETUP_BLOCKS else 'BEGIN_FINALLY')) == handler:
+                body_stop = handler - 2
+        else:
+            copy_stop = handler - 1 if ins[handler - 1].op in JUMPS else handler
+            for k in range(copy_stop, start - 1, -1):
+                if ins[k].op == POP_BLOCK and self.copy(k + 1, frame.final) == copy_stop:
+                    body_stop = k
+                    break
+        body, _ = self.block(start, body_stop, inner, body_stop)
+        return [('finally', offset, body, final)], after
+
+    def except_(self, i, start, handler, stop, frames, follow):
+        ins = self.ins
+        offset = ins[i].offset
+        inner = frames + [_Frame('except', handler=handler)]
+        if TABLES:
+            # the try body leaves the block of the handler, the else body follows it before a jump over the handler
+            jumped = not COLD and ins[handler - 1].op in JUMPS
+            body_stop = stop if COLD else handler - 1 if jumped else handler
+            body, j = self.block(start, body_stop, inner, body_stop, halt=lambda k: not self.inside(
+                ins[k].handler, handler) and not self.exits(k, handler, inner, follow))
+            cleanup = ins[handler].handler
+            clauses, _, end = self.clauses(handler + 1, cleanup, self.size, frames, cleanup, cleanup)
+            after = self.match(cleanup, CLEANUP)
+            if after is None:
+                raise self.fail(cleanup, 'end of except clauses')
+            if COLD:
+                # the else body is before the end the except clauses jump back to
+                self.cold[handler] = after
+                if end is not None and j <= end and (end <= stop or end == self.size):
+                    orelse, k = self.block(j, min(end, stop), frames, end, halt=lambda k: ins[k].op in JUMPS and
+                                           self.same(ins[k].target, end))
+                    return [('try', offset, body, clauses, orelse)], k + 1 if k < end else end
+                return [('try', offset, body, clauses, list())], j
+            if jumped:
+                orelse, _ = self.block(j, body_stop, frames, ins[body_stop].target)
+                return [('try', offset, body, clauses, orelse)], after
+            return self.following(offset, body, clauses, j, handler, end, after, frames, follow)
+        # the try body ends at POP_BLOCK and a jump to the else body
+        if self.match(handler - 2, (POP_BLOCK,)) is not None and ins[handler - 1].op in JUMPS:
+            body, _ = self.block(start, handler - 2, inner, handler - 2)
+            j = handler - 1
+        else:
+            body, j = self.block(start, handler, inner, handler, halt=lambda k: ins[k].op == POP_BLOCK and
+                                 not self.exits(k, handler, inner, follow))
+            if j < handler:
+                j += 1
+        orelse_start = None
+        if j == handler - 1 and ins[j].op in JUMPS and handler < ins[j].target <= stop:
+            orelse_start = ins[j].target
+        limit = orelse_start
+        if limit is not None and ins[limit - 1].op in FINAL_ENDS:
+            limit -= 1
+        clauses, after, end = self.clauses(handler, limit, stop, frames, orelse_start)
+        if after < self.size and ins[after].op in FINAL_ENDS:
+            after += 1
+        if orelse_start is None:
+            return self.following(offset, body, clauses, j, handler, end, after, frames, follow)
+        orelse = list()
+        if after == orelse_start and end is not None and orelse_start < end <= stop:
+            orelse, after = self.block(orelse_start, end, frames, end)
+        return [('try', offset, body, clauses, orelse)], after
+
+    def exits(self, k, handler, frames, follow) -> bool:
+        """
+        an exit of the try body at k, not the code after the statement copied
+        to the end of the body since 3.10, such as the implicit `return None`
+        """
+        ins = self.ins
+        found = self.leave(k, handler, frames, follow, False)
+        if found is None:
+            return TABLES and self.match(k, (LOAD_CONST, RETURN_VALUE)) is not None
+        j = found[1]
+        last = j == handler or COLD and j < self.size and ins[j].op == 'PUSH_EXC_INFO'
+        return not (last and ins[j - 1].op in JUMPS and self.same(ins[j - 1].target, follow))
+
+    def following(self, offset, body, clauses, j, handler, end, after, frames, follow):
+        """
+        a try statement with code from j to the handler after its try body,
+        the code after the statement copied there since 3.10 or the else body
+        when an except clause goes elsewhere
+        """
+        items, k = self.block(j, handler, frames, follow)
+        if k != handler or items and not self.same(end, j) and end is not None:
+            return [('try', offset, body, clauses, items)], after
+        return [('try', offset, body, clauses, list())] + items, after
+
+    def clauses(self, j, limit, stop, frames, follow, cleanup=None):
+        """
+        except clauses from j until the last one or limit
+        :param cleanup: handler of the clauses since 3.11
+        :return: (clauses, index after them, index their ends jump to or None)
+        """
+        ins = self.ins
+        clauses = list()
+        end = None
+        while j < self.size and ins[j].op not in FINAL_ENDS and j != limit:
+            offset = ins[j].offset
+            test = None
+            following = limit
+            if TABLES and ins[j].op != POP_TOP or not TABLES and ins[j].op == DUP_TOP:
+                first = j if TABLES else j + 1
+                if TABLES:
+                    ops = ('CHECK_EXC_MATCH', POP_JUMP_IF_FALSE)
+                elif COPY_FINALLY:
+                    ops = ('JUMP_IF_NOT_EXC_MATCH',)
+                else:
+                    ops = ((COMPARE_OP, 10), POP_JUMP_IF_FALSE)
+                k = first
+                while k < self.size and self.match(k, ops) is None:
+                    k += 1
+                test = self.pure(first, k)
+                if test is None:
+                    raise self.fail(j, 'type of an except clause')
+                j = self.match(k, ops)
+                following = ins[j - 1].target
+            # the exception, its value and traceback of 3.6 are one since 3.11
+            name = None
+            if TABLES:
+                if ins[j].op != POP_TOP:
+                    name = ins[j]
+                j += 1
+            else:
+                if self.match(j, (POP_TOP,)) is None or self.match(j + 2, (POP_TOP,)) is None:
+                    raise self.fail(j, 'except clause')
+                if ins[j + 1].op != POP_TOP:
+                    name = ins[j + 1]
+                j += 3
+            if name is not None and name.op not in DELETES:
+                raise self.fail(j, 'name of an except clause')
+            if name is None:
+                body, j, target = self.unnamed(j, following, stop, frames, follow, cleanup)
+            else:
+                body, j, target = self.named(j, following, name, stop, frames)
+            if target is not None:
+                end = target
+            clauses.append((offset, test, name, body))
+            if test is None:
+                break
+        return clauses, j, end
+
+    def unnamed(self, j, limit, stop, frames, follow, cleanup):
+        """
+        body of an except clause without a name from j, cleanup is the handler
+        of the clauses since 3.11
+        :return: (body, index after it, index its end jumps to)
+        """
+        ins = self.ins
+        frame = _Frame('handler', handler=cleanup)
+        inner = frames + [frame]
+        pops = (HOST_POP_EXCEPT,)
+        if limit is not None:
+            if self.match(limit - 2, pops) is not None and ins[limit - 1].op in JUMPS:
+                body, _ = self.block(j, limit - 2, inner, limit - 2)
+                return body, limit, ins[limit - 1].target
+            body, _ = self.block(j, limit, inner, limit)
+            return body, limit, None
+        # the last clause, its end is a POP_EXCEPT and a jump forward
+        body, k = self.block(j, stop, inner, follow, halt=lambda k: self.match(k, pops) is not None and
+                             k + 1 < self.size and ins[k + 1].op in JUMPS and ins[k + 1].target > k)
+        if k < stop:
+            return body, k + 2, ins[k + 1].target
+        return body, k, None
+
+    def named(self, j, limit, name, stop, frames):
+        """body of an except clause with a name from j, (body, index after it, index its end jumps to)"""
+        ins = self.ins
+        clear = ((LOAD_CONST, self.none), (name.op, name.oparg), (DELETES[name.op], name.oparg))
+        # the name is cleared at the end of SETUP_FINALLY, the handler of the body since 3.11
+        if TABLES:
+            cleanup = limit - 4
+            if self.match(cleanup, clear + ('RERAISE',)) != limit:
+                raise self.fail(j, 'except clause')
+        else:
+            if ins[j].op != HOST_SETUP_FINALLY:
+                raise self.fail(j, 'except clause')
+            cleanup = ins[j].target
+            j += 1
+        frame = _Frame('handler', handler=cleanup if TABLES else None, name=name)
+        end = None
+        # the body falls to the end of SETUP_FINALLY or jumps to the end since 3.9
+        if SETUP_BLOCKS and HOST_VERSION < (3, 7):
+            tail = (POP_BLOCK, POP_EXCEPT, LOAD_CONST)
+        elif SETUP_BLOCKS:
+            tail = (POP_BLOCK, LOAD_CONST)
+        elif CALL_FINALLY:
+            tail = (POP_BLOCK, 'BEGIN_FINALLY')
+        else:
+            tail = (POP_BLOCK,) * (not TABLES) + ('POP_EXCEPT',) + clear
+        body_stop = cleanup
+        if COPY_FINALLY:
+            if self.match(cleanup - len(tail) - 1, tail) == cleanup - 1 and ins[cleanup - 1].op in JUMPS:
+                body_stop = cleanup - len(tail) - 1
+                end = ins[cleanup - 1].target
+        elif self.match(cleanup - len(tail), tail) == cleanup:
+            body_stop = cleanup - len(tail)
+        body, _ = self.block(j, body_stop, frames + [frame], body_stop)
+        after = self.match(cleanup, clear + (FINAL_ENDS[COPY_FINALLY],))
+        if after is None:
+            raise self.fail(cleanup, 'end of an except clause')
+        if not COPY_FINALLY:
+            if HOST_VERSION >= (3, 7):
+                after = self.match(after, (HOST_POP_EXCEPT,))
+            if after is not None and after < self.size and ins[after].op in JUMPS:
+                end = ins[after].target
+                after += 1
+            if after is None:
+                raise self.fail(cleanup, 'end of an except clause')
+        return body, after, end
+
+    def with_(self, start, context, i, stop, frames, follow):
+        """a with statement, context: statements of the context manager before SETUP_WITH or BEFORE_WITH at i"""
+        ins = self.ins
+        offset = ins[i].offset
+        handler = ins[i + 1].handler if TABLES else ins[i].target
+        # statements storing the value of __enter__
+        j = i + 1
+        depth = 1
+        target = list()
+        while depth > 0 and j < handler:
+            depth += self.effect(j)
+            target.append(ins[j])
+            j += 1
+        frame = _Frame('with', handler=handler)
+        inner = frames + [frame]
+        if COLD:
+            # the body leaves the block of the handler at the exit calling __exit__
+            body, k = self.block(j, stop, inner, stop, halt=lambda k: not self.inside(
+                ins[k].handler, handler) and not self.exits(k, handler, inner, follow))
+            # no exit when the body leaves the function
+            after = k if k == handler else self.unwind_one(k, frame, False)
+            cleanup = ins[handler].handler
+            end = self.match(handler, WITH_EXITS)
+            if after is None or end is None or self.match(cleanup, CLEANUP) is None:
+                raise self.fail(k, 'exit of a with statement')
+            # the code after the statement may be laid out between them or jumped back to
+            if end < self.size and ins[end].op in JUMPS and ins[end].target < handler:
+                end += 1
+            self.cold[handler] = end
+            self.cold[cleanup] = cleanup + len(CLEANUP)
+            return ('with', offset, context, target, body), after
+        body_stop = handler
+        if SETUP_BLOCKS or CALL_FINALLY:
+            if self.match(handler - 2, (POP_BLOCK, LOAD_CONST if SETUP_BLOCKS else 'BEGIN_FINALLY')) == handler:
+                body_stop = handler - 2
+        elif ins[handler - 1].op in JUMPS:
+            for k in range(handler - 2, j - 1, -1):
+                if self.unwind_one(k, frame, False) == handler - 1:
+                    body_stop = k
+                    break
+        body, _ = self.block(j, body_stop, inner, body_stop)
+        after = self.match(handler, WITH_EXITS)
+        if after is None:
+            raise self.fail(handler, 'exit of a with statement')
+        return ('with', offset, context, target, body), after
+
+
+class _Label(object):
+    __slots__ = ('index',)
+
+    def __init__(self) -> None:
+        self.index = None
+
+
+class _Compiler(object):
+    """statements compiled as the Python3.6 compiler, jump targets are labels"""
+
+    def __init__(self, none) -> None:
+        self.none = none  # oparg of LOAD_CONST None
+        self.out = list()
+        self.frames = list()  # 'loop', 'except', 'finally_try' or 'finally_end'
+        self.returned = False  # a return in the current block, b_return of compile.c
+
+    def emit(self, op, oparg, arg, offset, target=None) -> None:
+        self.out.append(_Instruction(op, oparg, arg, offset, target))
+        if op == RETURN_VALUE:
+            self.returned = True
+
+    def jump(self, op, label, offset) -> None:
+        self.emit(op, None, None, offset, label)
+
+    def place(self, label) -> None:
+        label.index = len(self.out)
+        self.returned = False
+
+    def body(self, items) -> None:
+        for item in items:
+            if isinstance(item, _Instruction):
+                self.out.append(_Instruction(item.op, item.oparg, item.arg, item.offset))
+                if item.op == RETURN_VALUE:
+                    self.returned = True
+            else:
+                getattr(self, 'compile_' + item[0])(*item[1:])
+
+    def value(self, test) -> None:
+        """a test evaluated as a value"""
+        kind = test[0]
+        if kind == 'leaf':
+            self.body(test[1])
+        elif kind == 'chain':
+            self.body(test[1])
+            self.compile_chain(None, test[2])
+        elif kind == 'not':
+            self.value(test[1])
+            self.emit(UNARY_NOT, 0, 0, self.offset(test))
+        else:
+            end = _Label()
+            op = JUMP_IF_FALSE_OR_POP if kind == 'and' else JUMP_IF_TRUE_OR_POP
+            for operand in test[1][:-1]:
+                self.value(operand)
+                self.jump(op, end, self.offset(operand))
+            self.value(test[1][-1])
+            self.place(end)
+
+    def start(self, items, offset) -> int:
+        """offset of the first of statements"""
+        for item in items:
+            return item.offset if isinstance(item, _Instruction) else item[1]
+        return offset
+
+    def offset(self, test) -> int:
+        while test[0] in ('not', 'and', 'or'):
+            test = test[1] if test[0] == 'not' else test[1][-1]
+        for item in test[1]:
+            if isinstance(item, _Instruction):
+                return item.offset
+            return item[1]
+        return self.out[-1].offset if self.out else 0
+
+    def compile_boolop(self, offset, op, values) -> None:
+        end = _Label()
+        for items in values:
+            self.jump(op, end, offset)
+            self.body(items)
+        self.place(end)
+
+    def compile_chain(self, offset, values) -> None:
+        # the first values and the comparison are before it
+        cleanup, end = _Label(), _Label()
+        for items in values:
+            self.jump(JUMP_IF_FALSE_OR_POP, cleanup, offset)
+            self.body(items)
+        offset = self.out[-1].offset
+        self.jump(JUMP_FORWARD, end, offset)
+        self.place(cleanup)
+        self.emit(ROT_TWO, 0, 0, offset)
+        self.emit(POP_TOP, 0, 0, offset)
+        self.place(end)
+
+    def compile_ifexp(self, offset, test, body, orelse) -> None:
+        following, end = _Label(), _Label()
+        self.value(test)
+        self.jump(POP_JUMP_IF_FALSE, following, offset)
+        self.body(body)
+        self.jump(JUMP_FORWARD, end, offset)
+        self.place(following)
+        self.body(orelse)
+        self.place(end)
+
+    def compile_if(self, offset, test, body, orelse) -> None:
+        end = _Label()
+        following = _Label() if orelse else end
+        self.value(test)
+        self.jump(POP_JUMP_IF_FALSE, following, offset)
+        self.body(body)
+        if orelse:
+            self.jump(JUMP_FORWARD, end, offset)
+            self.place(following)
+            self.body(orelse)
+        self.place(end)
+
+    def compile_assert(self, offset, test, body) -> None:
+        end = _Label()
+        self.value(test)
+        self.jump(POP_JUMP_IF_TRUE, end, offset)
+        self.body(body)
+        self.place(end)
+
+    def compile_while(self, offset, test, body, orelse) -> None:
+        loop, end, anchor = _Label(), _Label(), _Label()
+        self.jump(SETUP_LOOP, end, offset)
+        self.place(loop)
+        self.frames.append(('loop', loop))
+        if test is not None:
+            self.value(test)
+            self.jump(POP_JUMP_IF_FALSE, anchor, offset)
+        self.body(body)
+        self.jump(JUMP_ABSOLUTE, loop, offset)
+        if test is not None:
+            self.place(anchor)
+        self.emit(POP_BLOCK, 0, 0, offset)
+        self.frames.pop()
+        if orelse:
+            self.body(orelse)
+        self.place(end)
+
+    def compile_for(self, offset, iterator, body, orelse) -> None:
+        # offset of FOR_ITER, SETUP_LOOP is at the iterator
+        start, cleanup, end = _Label(), _Label(), _Label()
+        self.jump(SETUP_LOOP, end, self.start(iterator, offset))
+        self.frames.append(('loop', start))
+        self.body(iterator)
+        self.place(start)
+        self.jump(FOR_ITER, cleanup, offset)
+        self.body(body)
+        self.jump(JUMP_ABSOLUTE, start, offset)
+        self.place(cleanup)
+        self.emit(POP_BLOCK, 0, 0, offset)
+        self.frames.pop()
+        if orelse:
+            self.body(orelse)
+        self.place(end)
+
+    def compile_comprehension(self, offset, body) -> None:
+        start, anchor = _Label(), _Label()
+        self.place(start)
+        self.jump(FOR_ITER, anchor, offset)
+        self.body(body)
+        self.jump(JUMP_ABSOLUTE, start, offset)
+        self.place(anchor)
+
+    def compile_break(self, offset) -> None:
+        self.emit(BREAK_LOOP, 0, 0, offset)
+
+    def compile_continue(self, offset) -> None:
+        kind, label = self.frames[-1]
+        if kind == 'loop':
+            self.jump(JUMP_ABSOLUTE, label, offset)
+            return
+        for kind, label in reversed(self.frames):
+            if kind == 'finally_end':
+                raise FrontendError('continue in a finally body at {} has no Python3.6 IR'.format(offset))
+            if kind == 'loop':
+                self.jump(CONTINUE_LOOP, label, offset)
+                return
+        raise FrontendError('continue out of a loop at {}'.format(offset))
+
+    def compile_try(self, offset, body, handlers, orelse) -> None:
+        handler, following, end = _Label(), _Label(), _Label()
+        self.jump(SETUP_EXCEPT, handler, offset)
+        self.frames.append(('except', handler))
+        self.body(body)
+        self.emit(POP_BLOCK, 0, 0, offset)
+        self.frames.pop()
+        self.jump(JUMP_FORWARD, following, offset)
+        self.place(handler)
+        for clause_offset, test, name, items in handlers:
+            after = _Label()
+            if test is not None:
+                self.emit(DUP_TOP, 0, 0, clause_offset)
+                self.body(test)
+                self.emit(COMPARE_OP, 10, 10, clause_offset)
+                self.jump(POP_JUMP_IF_FALSE, after, clause_offset)
+            self.emit(POP_TOP, 0, 0, clause_offset)
+            if name is None:
+                self.emit(POP_TOP, 0, 0, clause_offset)
+                self.emit(POP_TOP, 0, 0, clause_offset)
+                self.frames.append(('finally_try', None))
+                self.body(items)
+                self.emit(POP_EXCEPT, 0, 0, clause_offset)
+                self.frames.pop()
+            else:
+                # the name is cleared by a finally body
+                cleanup = _Label()
+                self.emit(name.op, name.oparg, name.arg, name.offset)
+                self.emit(POP_TOP, 0, 0, clause_offset)
+                self.jump(SETUP_FINALLY, cleanup, clause_offset)
+                self.frames.append(('finally_try', cleanup))
+                self.body(items)
+                self.emit(POP_BLOCK, 0, 0, clause_offset)
+                self.emit(POP_EXCEPT, 0, 0, clause_offset)
+                self.frames.pop()
+                self.emit(LOAD_CONST, self.none, None, clause_offset)
+                self.place(cleanup)
+                self.frames.append(('finally_end', cleanup))
+                self.emit(LOAD_CONST, self.none, None, clause_offset)
+                self.emit(name.op, name.oparg, name.arg, clause_offset)
+                self.emit(DELETES[name.op], name.oparg, name.arg, clause_offset)
+                self.emit(END_FINALLY, 0, 0, clause_offset)
+                self.frames.pop()
+            self.jump(JUMP_FORWARD, end, clause_offset)
+            self.place(after)
+        self.emit(END_FINALLY, 0, 0, offset)
+        self.place(following)
+        self.body(orelse)
+        self.place(end)
+
+    def compile_finally(self, offset, body, final) -> None:
+        end = _Label()
+        self.jump(SETUP_FINALLY, end, offset)
+        self.frames.append(('finally_try', end))
+        self.body(body)
+        self.emit(POP_BLOCK, 0, 0, offset)
+        self.frames.pop()
+        self.emit(LOAD_CONST, self.none, None, offset)
+        self.place(end)
+        self.frames.append(('finally_end', end))
+        self.body(final)
+        self.emit(END_FINALLY, 0, 0, offset)
+        self.frames.pop()
+
+    def compile_with(self, offset, context, target, body) -> None:
+        end = _Label()
+        self.body(context)
+        self.jump(SETUP_WITH, end, offset)
+        self.frames.append(('finally_try', end))
+        self.body(target)
+        self.body(body)
+        self.emit(POP_BLOCK, 0, 0, offset)
+        self.frames.pop()
+        self.emit(LOAD_CONST, self.none, None, offset)
+        self.place(end)
+        self.frames.append(('finally_end', end))
+        self.emit(WITH_CLEANUP_START, 0, 0, offset)
+        self.emit(WITH_CLEANUP_FINISH, 0, 0, offset)
+        self.emit(END_FINALLY, 0, 0, offset)
+        self.frames.pop()
+
+
+def _peephole(out) -> list:
+    """jumps, UNARY_NOT and code after RETURN_VALUE as the Python3.6 peephole optimizer"""
+    size = len(out)
+    blocks = [0] * (size + 1)
+    for instr in out:
+        if instr.target is not None:
+            blocks[instr.target] = 1
+    count = 0
+    for index in range(size + 1):
+        count += blocks[index]
+        blocks[index] = count
+    nop = NOP
+
+    def find(index):
+        while index < size and out[index].op == nop:
+            index += 1
+        return index
+
+    i = find(0)
+    while i < size:
+        instr = out[i]
+        op = instr.op
+        following = find(i + 1)
+        next_op = out[following].op if following < size else None
+        if op == UNARY_NOT:
+            if next_op == POP_JUMP_IF_FALSE and blocks[i] == blocks[following]:
+                instr.op = nop
+                out[following].op = POP_JUMP_IF_TRUE
+        elif op == COMPARE_OP:
+            if 6 <= instr.oparg <= 9 and next_op == UNARY_NOT and blocks[i] == blocks[following]:
+                instr.oparg = instr.arg = instr.oparg ^ 1
+                out[following].op = nop
+        elif op == LOAD_CONST:
+            if next_op == POP_JUMP_IF_FALSE and blocks[i] == blocks[following] and instr.arg:
+                instr.op = nop
+                out[following].op = nop
+                following = find(following + 1)
+        elif op in VALUES or op in CONDITIONS or op in JUMPS or op in (
+                FOR_ITER, CONTINUE_LOOP, SETUP_LOOP, SETUP_EXCEPT, SETUP_FINALLY, SETUP_WITH):
+            target = find(instr.target)
+            if op in VALUES and target < size and (out[target].op in CONDITIONS or out[target].op in VALUES):
+                second = out[target].op
+                if (second in (POP_JUMP_IF_TRUE, JUMP_IF_TRUE_OR_POP)) == (op == JUMP_IF_TRUE_OR_POP):
+                    instr.target = out[target].target
+                    instr.op = second
+                else:
+                    instr.target = target + 1
+                    instr.op = POP_JUMP_IF_TRUE if op == JUMP_IF_TRUE_OR_POP else POP_JUMP_IF_FALSE
+                following = i
+            elif op in JUMPS and target < size and out[target].op == RETURN_VALUE:
+                instr.op, instr.oparg, instr.arg, instr.target = RETURN_VALUE, 0, 0, None
+            elif target < size and out[target].op in JUMPS:
+                goal = out[target].target
+                if op == JUMP_FORWARD:
+                    instr.op = JUMP_ABSOLUTE
+                    instr.target = goal
+                elif op in (JUMP_ABSOLUTE, CONTINUE_LOOP) or op in VALUES or op in CONDITIONS:
+                    instr.target = goal
+                elif goal >= i + 1:
+                    instr.target = goal
+        if op == RETURN_VALUE or instr.op == RETURN_VALUE:
+            h = i + 1
+            while h < size and blocks[h] == blocks[i]:
+                out[h].op = nop
+                h += 1
+            following = find(h)
+        i = following
+    # NOPs removed
+    positions = list()
+    kept = list()
+    for instr in out:
+        positions.append(len(kept))
+        if instr.op != nop:
+            kept.append(instr)
+    positions.append(len(kept))
+    for instr in kept:
+        if instr.target is not None:
+            instr.target = positions[instr.target]
+    return kept
+
+
+def _merge_exits(ins, marked) -> list:
+    """
+    copies of the implicit `return None`, of small exit blocks and of exit
+    blocks of no line made by the host compiler since 3.10 are jumps to one
+    again, index len(ins) is the implicit `return None`
+    :param marked: instructions after a line of no code, kept so
+    """
+    targets = set(instr.target for instr in ins if instr.target is not None)
+    edits = dict()
+    for index in range(len(ins) - 1):
+        instr, following = ins[index], ins[index + 1]
+        previous = ins[index - 1] if index else None
+        if instr.op == LOAD_CONST and instr.arg is None and following.op == RETURN_VALUE and \
+                index + 1 not in targets and \
+                not (previous is not None and (previous.op in CONDITIONS or previous.op in VALUES) and
+                     previous.target > index):
+            edits[index] = _Instruction(JUMP_ABSOLUTE, None, None, instr.offset, len(ins), instr.line)
+            edits[index + 1] = None
+            if instr in marked:
+                marked.add(edits[index])
+    ins = _edited(ins, edits)
+    # a copy only jumped to is a jump to the end
+    edits = dict()
+    size = len(ins)
+    for index, instr in enumerate(ins):
+        if index and instr.op == JUMP_ABSOLUTE and instr.target == size and ins[index - 1].op in TERMINALS:
+            edits[index] = None
+            for source in ins:
+                if source.target == index:
+                    source.target = size
+    ins = _edited(ins, edits)
+    # an exit block of no line copied to each jump to it, the first instructions have the line of the jump
+    targets = set(instr.target for instr in ins if instr.target is not None)
+    size = len(ins)
+    ends = [index for index, instr in enumerate(ins) if instr.op in (RETURN_VALUE, RAISE_VARARGS, 'RERAISE') or
+            instr.op == JUMP_ABSOLUTE and instr.target == size]
+    edits = dict()
+    for b in sorted(targets):
+        if b == 0 or b >= size or ins[b - 1].op not in TERMINALS or b in edits:
+            continue
+        end = b
+        while end < size and end not in ends and ins[end].target is None and (end == b or end not in targets):
+            end += 1
+        if end not in ends or end > b and end in targets:
+            continue
+        for a_end in ends:
+            a = a_end - (end - b)
+            if a_end == end or a < 0 or a_end in edits or a <= end and b <= a_end or \
+                    ins[a_end].line != ins[end].line or \
+                    any(ins[k].target is not None or k + 1 in targets for k in range(a, a_end)) or \
+                    not all(_same_instruction(ins[a + k], ins[b + k], False) for k in range(end - b + 1)):
+                continue
+            if a in targets and ins[a - 1].op in TERMINALS:
+                for source in ins:
+                    if source.target == b:
+                        source.target = a
+                for index in range(b, end + 1):
+                    edits[index] = None
+            else:
+                # a copy falling from its block replaced the jump
+                edits[a] = _Instruction(JUMP_ABSOLUTE, None, None, ins[a].offset, b, ins[a].line)
+                if ins[a] in marked:
+                    marked.add(edits[a])
+                for index in range(a + 1, a_end + 1):
+                    edits[index] = None
+            break
+    ins = _edited(ins, edits)
+    # an exit block copied to a jump, same instructions of same lines
+    targets = set(instr.target for instr in ins if instr.target is not None)
+    handlers = set()
+    for index, instr in enumerate(ins):
+        if instr.op == WITH_EXITS[0] and _matched(ins, index, WITH_EXITS) is not None:
+            handlers.update(range(index, index + len(WITH_EXITS)))
+    edits = dict()
+    size = len(ins)
+    ends = [index for index, instr in enumerate(ins)
+            if instr.op in (RETURN_VALUE, RAISE_VARARGS) or instr.op == JUMP_ABSOLUTE and instr.target == size]
+    # handlers are after the code since 3.12, a copy there is of the code before
+    cold = next((index for index, instr in enumerate(ins) if instr.op == 'PUSH_EXC_INFO'), size) if COLD else size
+    for position, a in enumerate(ends):
+        if a in edits:
+            continue
+        for b in reversed(ends[position + 1:]):
+            size = 0
+            while size < 4 and a - size >= 0 and b - size > a and a - size not in edits and \
+                    _same_instruction(ins[a - size], ins[b - size]) and (size == 0 or a - size + 1 not in targets):
+                size += 1
+            # the end of the handler of a with statement is no copy
+            while size and (a - size + 1 in handlers or b - size + 1 in handlers):
+                size -= 1
+            if size:
+                copy, original = (b, a) if a < cold <= b else (a, b)
+                start = copy - size + 1
+                edits[start] = _Instruction(JUMP_ABSOLUTE, None, None, ins[start].offset, original - size + 1,
+                                            ins[start].line)
+                if ins[start] in marked:
+                    marked.add(edits[start])
+                for index in range(start + 1, copy + 1):
+                    edits[index] = None
+                break
+    return _edited(ins, edits)
+
+
+def _fold_inverted(ins, marked) -> list:
+    """
+    a conditional jump over a jump backward, made by the host compiler since
+    3.12 having no conditional jump backward, is one conditional jump again
+    """
+    targets = set(instr.target for instr in ins if instr.target is not None)
+    edits = dict()
+    for index in range(len(ins) - 1):
+        instr, following = ins[index], ins[index + 1]
+        if instr.op in CONDITIONS and instr.target == index + 2 and following.op == JUMP_ABSOLUTE and \
+                following.target <= index and not following.first and index + 1 not in targets and \
+                index not in edits:
+            op = POP_JUMP_IF_TRUE if instr.op == POP_JUMP_IF_FALSE else POP_JUMP_IF_FALSE
+            edits[index] = _Instruction(op, None, None, instr.offset, following.target, instr.line, instr.first)
+            edits[index + 1] = None
+            if instr in marked:
+                marked.add(edits[index])
+    return _edited(ins, edits)
+
+
+def _edited(ins, edits) -> list:
+    """
+    instructions with edits, index -> instruction written instead or None if
+    removed, jump targets and handlers go to the instruction written at them
+    """
+    if not edits:
+        return ins
+    positions = list()
+    edited = list()
+    for index, instr in enumerate(ins):
+        positions.append(len(edited))
+        if index not in edits:
+            edited.append(instr)
+        elif edits[index] is not None:
+            edited.append(edits[index])
+    positions.append(len(edited))
+    for instr in edited:
+        if instr.target is not None:
+            instr.target = positions[instr.target]
+        if instr.handler is not None:
+            instr.handler = positions[instr.handler]
+    return edited
+
+
+def _matched(ins, i, ops):
+    """index after ops at i, an op or (op, oparg), None if other ops"""
+    for op in ops:
+        if i >= len(ins):
+            return None
+        instr = ins[i]
+        if op.__class__ is tuple:
+            if instr.op != op[0] or instr.oparg != op[1]:
+                return None
+        elif instr.op != op:
+            return None
+        i += 1
+    return i
+
+
+def _same_instruction(a, b, line=True) -> bool:
+    return a.op == b.op and a.arg == b.arg and a.oparg == b.oparg and (a.line == b.line or not line) and \
+        a.target == b.target and a.handler == b.handler
+
+
+def rebuild(out, starts, code) -> list:
+    """
+    instructions of a code object laid out again as Python3.6
+    :param out: instructions translated by rpvm.frontend, jump targets are host offsets
+    :param starts: host offset -> index of out
+    :param code: the code object
+    :return: instructions, jump targets are indexes of them
+    """
+    ins = list()
+    for instr in out:
+        copy = _Instruction(instr.op, instr.oparg, instr.arg, instr.offset, None, instr.line, instr.first)
+        if instr.target is not None:
+            if instr.target not in starts:
+                raise FrontendError('jump target {} out of range'.format(instr.target))
+            copy.target = starts[instr.target]
+        if instr.handler is not None:
+            copy.handler = starts[instr.handler]
+        ins.append(copy)
+    # a line of no code such as break before a copied exit block
+    marked = set(ins[index + 1] for index, instr in enumerate(ins[:-1]) if instr.op == NOP)
+    ins = _edited(ins, {index: None for index, instr in enumerate(ins) if instr.op == NOP})
+    if INVERTED:
+        ins = _fold_inverted(ins, marked)
+    if COPY_EXITS:
+        ins = _merge_exits(ins, marked)
+    none = SYNTHETIC
+    for index, const in enumerate(code.co_consts):
+        if const is None:
+            none = index
+            break
+    reader = _Reader(ins, none, code.co_name in COMPREHENSIONS, marked)
+    items, end = reader.block(0, reader.size, [], reader.size)
+    if end != reader.size:
+        raise reader.fail(end, 'statement')
+    compiler = _Compiler(none)
+    compiler.body(items)
+    if not compiler.returned:
+        offset = compiler.out[-1].offset if compiler.out else 0
+        compiler.emit(LOAD_CONST, compiler.none, None, offset)
+        compiler.emit(RETURN_VALUE, 0, 0, offset)
+    code = compiler.out
+    for instr in code:
+        if isinstance(instr.target, _Label):
+            instr.target = instr.target.index
+    return _peephole(code)
+
+
+__all__ = [
+    "rebuild",
+]
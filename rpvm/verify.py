@@ -0,0 +1,270 @@
+from rpvm.opcodes import *
+from rpvm.decode import Program, DECODE_CACHE_SIZE, decode
+from types import CodeType
+from functools import lru_cache
+
+
+# stack effect of opcodes not depending on oparg, Python3.6 ceval
+STACK_EFFECTS = {
+    NOP: 0, POP_TOP: -1, ROT_TWO: 0, ROT_THREE: 0, DUP_TOP: 1, DUP_TOP_TWO: 2,
+    UNARY_POSITIVE: 0, UNARY_NEGATIVE: 0, UNARY_NOT: 0, UNARY_INVERT: 0,
+    GET_ITER: 0, GET_YIELD_FROM_ITER: 0,
+    STORE_SUBSCR: -3, DELETE_SUBSCR: -2,
+    SETUP_LOOP: 0, BREAK_LOOP: 0, CONTINUE_LOOP: 0,
+    SET_ADD: -1, LIST_APPEND: -1, MAP_ADD: -2,
+    RETURN_VALUE: -1, YIELD_VALUE: 0, YIELD_FROM: -1, SETUP_ANNOTATIONS: 0,
+    IMPORT_STAR: -1, IMPORT_NAME: -1, IMPORT_FROM: 1,
+    POP_BLOCK: 0, SETUP_EXCEPT: 0, SETUP_FINALLY: 0, POP_EXCEPT: 0, SETUP_WITH: 1,
+    END_FINALLY: -1, WITH_CLEANUP_START: 1, WITH_CLEANUP_FINISH: -2,
+    STORE_NAME: -1, DELETE_NAME: 0, STORE_ATTR: -2, DELETE_ATTR: -1,
+    STORE_GLOBAL: -1, DELETE_GLOBAL: 0,
+    LOAD_CONST: 1, LOAD_NAME: 1, LOAD_ATTR: 0, LOAD_GLOBAL: 1,
+    LOAD_FAST: 1, STORE_FAST: -1, DELETE_FAST: 0,
+    LOAD_CLOSURE: 1, LOAD_DEREF: 1, STORE_DEREF: -1, DELETE_DEREF: 0, LOAD_CLASSDEREF: 1,
+    COMPARE_OP: -1,
+    JUMP_FORWARD: 0, JUMP_ABSOLUTE: 0, POP_JUMP_IF_TRUE: -1, POP_JUMP_IF_FALSE: -1,
+    PRINT_EXPR: -1, LOAD_BUILD_CLASS: 1, EXTENDED_ARG: 0,
+    LIST_EXTEND: -1, SET_UPDATE: -1, DICT_UPDATE: -1, DICT_MERGE: -1, LIST_TO_TUPLE: 0,
+    COPY: 1, SWAP: 0,
+}
+
+# operands of opcodes popping more than their stack effect shows and not depending on oparg
+OPERANDS = {
+    ROT_TWO: 2, ROT_THREE: 3, DUP_TOP: 1, DUP_TOP_TWO: 2,
+    UNARY_POSITIVE: 1, UNARY_NEGATIVE: 1, UNARY_NOT: 1, UNARY_INVERT: 1,
+    GET_ITER: 1, GET_YIELD_FROM_ITER: 1, FOR_ITER: 1, YIELD_VALUE: 1, YIELD_FROM: 2,
+    IMPORT_NAME: 2, IMPORT_FROM: 1, SETUP_WITH: 1, WITH_CLEANUP_START: 2,
+    LOAD_ATTR: 1, COMPARE_OP: 2, JUMP_IF_TRUE_OR_POP: 1, JUMP_IF_FALSE_OR_POP: 1,
+    UNPACK_SEQUENCE: 1, UNPACK_EX: 1, LIST_TO_TUPLE: 1,
+}
+for _op in (
+        BINARY_POWER, BINARY_MULTIPLY, BINARY_MATRIX_MULTIPLY, BINARY_FLOOR_DIVIDE,
+        BINARY_TRUE_DIVIDE, BINARY_MODULO, BINARY_ADD, BINARY_SUBTRACT, BINARY_SUBSCR,
+        BINARY_LSHIFT, BINARY_RSHIFT, BINARY_AND, BINARY_XOR, BINARY_OR,
+        INPLACE_POWER, INPLACE_MULTIPLY, INPLACE_MATRIX_MULTIPLY, INPLACE_FLOOR_DIVIDE,
+        INPLACE_TRUE_DIVIDE, INPLACE_MODULO, INPLACE_ADD, INPLACE_SUBTRACT,
+        INPLACE_LSHIFT, INPLACE_RSHIFT, INPLACE_AND, INPLACE_XOR, INPLACE_OR):
+    STACK_EFFECTS[_op] = -1
+    OPERANDS[_op] = 2
+del _op
+
+# pushed by the VM when jumping to the handler of a block, see rpvm.handlers
+HANDLER_EFFECTS = {SETUP_EXCEPT: 3, SETUP_FINALLY: 1, SETUP_WITH: 1}
+
+# opcodes reaching the item below their operands, oparg + operands <= depth
+DEEP_OPS = {
+    LIST_APPEND: 1, SET_ADD: 1, MAP_ADD: 2,
+    LIST_EXTEND: 1, SET_UPDATE: 1, DICT_UPDATE: 1, DICT_MERGE: 1, COPY: 0, SWAP: 0}
+
+# control never goes to the next instruction
+NO_FALLTHROUGH = (
+    JUMP_FORWARD, JUMP_ABSOLUTE, CONTINUE_LOOP, BREAK_LOOP, RETURN_VALUE, RAISE_VARARGS)
+
+MAX_COMPARE_OP = 10  # COMPARE_OP oparg the VM implements, 10 is exception match
+
+
+class VerifyError(ValueError):
+    pass
+
+
+def stack_effect(op, oparg, jump=False) -> int:
+    """
+    change of stack depth by the instruction
+    :param jump: effect when jumping to the target, otherwise going to the next
+    """
+    if op == FOR_ITER:
+        return -1 if jump else 1
+    if op in (JUMP_IF_TRUE_OR_POP, JUMP_IF_FALSE_OR_POP):
+        return 0 if jump else -1
+    if jump and op in HANDLER_EFFECTS:
+        return HANDLER_EFFECTS[op]
+    if op in STACK_EFFECTS:
+        return STACK_EFFECTS[op]
+    if op == UNPACK_SEQUENCE:
+        return oparg - 1
+    if op == UNPACK_EX:
+        return (oparg & 0xff) + (oparg >> 8)
+    if op in (BUILD_TUPLE, BUILD_LIST, BUILD_SET, BUILD_STRING, BUILD_TUPLE_UNPACK,
+              BUILD_LIST_UNPACK, BUILD_MAP_UNPACK, BUILD_SET_UNPACK,
+              BUILD_MAP_UNPACK_WITH_CALL, BUILD_TUPLE_UNPACK_WITH_CALL, BUILD_SLICE):
+        return 1 - oparg
+    if op == BUILD_MAP:
+        return 1 - oparg * 2
+    if op == BUILD_CONST_KEY_MAP:
+        return -oparg
+    if op == RAISE_VARARGS:
+        return -oparg
+    if op == CALL_FUNCTION:
+        return -oparg
+    if op == CALL_FUNCTION_KW:
+        return -oparg - 1
+    if op == CALL_FUNCTION_EX:
+        return -1 - (oparg & 0x01)
+    if op == MAKE_FUNCTION:
+        return -1 - bin(oparg & 0x0f).count('1')
+    if op == FORMAT_VALUE:
+        return -1 if oparg & 0x04 else 0
+    raise VerifyError('unknown stack effect of op {}'.format(op))
+
+
+def pops(op, oparg) -> int:
+    """operands the instruction pops or reads, the stack must have them before it runs"""
+    if op in OPERANDS:
+        return OPERANDS[op]
+    if op in DEEP_OPS:
+        return oparg + DEEP_OPS[op]
+    if op in (BUILD_TUPLE, BUILD_LIST, BUILD_SET, BUILD_STRING, BUILD_TUPLE_UNPACK,
+              BUILD_LIST_UNPACK, BUILD_MAP_UNPACK, BUILD_SET_UNPACK,
+              BUILD_MAP_UNPACK_WITH_CALL, BUILD_TUPLE_UNPACK_WITH_CALL, BUILD_SLICE):
+        return oparg
+    if op == BUILD_MAP:
+        return oparg * 2
+    if op == BUILD_CONST_KEY_MAP:
+        return oparg + 1
+    if op == CALL_FUNCTION:
+        return oparg + 1
+    if op == CALL_FUNCTION_KW:
+        return oparg + 2
+    if op == CALL_FUNCTION_EX:
+        return 2 + (oparg & 0x01)
+    if op == MAKE_FUNCTION:
+        return 2 + bin(oparg & 0x0f).count('1')
+    if op == FORMAT_VALUE:
+        return 2 if oparg & 0x04 else 1
+    return max(0, -stack_effect(op, oparg))
+
+
+def _check_instructions(program: Program, supported) -> None:
+    """opcode, operand index and jump target of each instruction"""
+    code = program.code
+    size = len(program)
+    for index, (op, oparg, arg) in enumerate(zip(program.ops, program.opargs, program.args)):
+        if op not in supported:
+            raise VerifyError('op {} is not supported at {}'.format(op, index))
+        if op in haslocal and code.co_nlocals <= oparg:
+            raise VerifyError('local index {} out of range at {}'.format(oparg, index))
+        if op in hasfree and len(code.co_cellvars) + len(code.co_freevars) <= oparg:
+            raise VerifyError('cell index {} out of range at {}'.format(oparg, index))
+        if op == COMPARE_OP and MAX_COMPARE_OP < oparg:
+            raise VerifyError('compare op {} is not supported at {}'.format(oparg, index))
+        if op in hasjrel or op in hasjabs:
+            if not 0 <= arg < size:
+                raise VerifyError('jump target {} out of range at {}'.format(arg, index))
+            if 0 < arg and program.ops[arg - 1] == EXTENDED_ARG:
+                raise VerifyError('jump into EXTENDED_ARG at {}'.format(index))
+    if size == 0 or program.ops[-1] == EXTENDED_ARG:
+        raise VerifyError('incomplete last instruction')
+
+
+def block_flow(program: Program, strict=True) -> (int, list):
+    """
+    dataflow pass over stack effects and blocks from the entry
+    every path reaching an instruction must have a same stack depth and same
+    blocks, VerifyError is raised if not. a path of malformed code just stops
+    if not strict.
+
+    :return: (max stack depth, blocks of each instruction), blocks are a tuple of
+        (setup opcode, handler index, stack level) from the outermost, None if not reached
+    """
+    ops = program.base_ops
+    opargs = program.opargs
+    args = program.base_args
+    # (depth, blocks, depth where the exception type of an except handler is TOS)
+    states = [None] * len(ops)
+    states[0] = (0, (), None)
+    todo = [0]
+    max_depth = 0
+
+    def flow(target, depth, blocks, raised, index):
+        nonlocal max_depth
+        if depth < 0:
+            raise VerifyError('stack underflow at {}'.format(index))
+        if len(ops) <= target:
+            raise VerifyError('fall off the end at {}'.format(index))
+        if raised is not None and depth < raised:
+            raised = None  # popped by the handler
+        max_depth = max(max_depth, depth)
+        state = (depth, blocks, raised)
+        if states[target] is None:
+            states[target] = state
+            todo.append(target)
+        elif states[target][0] != depth:
+            raise VerifyError('stack depth {} and {} at {}'.format(states[target][0], depth, target))
+        elif states[target] != state:
+            raise VerifyError('blocks differ at {}'.format(target))
+
+    while todo:
+        index = todo.pop()
+        op = ops[index]
+        oparg = opargs[index]
+        depth, blocks, raised = states[index]
+        try:
+            if depth < pops(op, oparg) or op in DEEP_OPS and oparg <= 0:
+                raise VerifyError('stack underflow at {}'.format(index))
+            if op in (SETUP_LOOP, SETUP_EXCEPT, SETUP_FINALLY, SETUP_WITH):
+                # the handler runs outside the block, SETUP_WITH leaves __exit__ below the level
+                level = depth
+                after = depth + stack_effect(op, oparg, jump=True)
+                flow(args[index], after, blocks,
+                     after if op == SETUP_EXCEPT else raised, index)
+                inner = blocks + ((op, args[index], level),)
+                flow(index + 1, depth + stack_effect(op, oparg), inner, raised, index)
+            elif op == POP_BLOCK:
+                if not blocks:
+                    raise VerifyError('POP_BLOCK without a block at {}'.format(index))
+                flow(index + 1, depth, blocks[:-1], raised, index)
+            elif op == END_FINALLY:
+                # re-raise of an exception no except clause matched does not go next
+                if raised != depth:
+                    flow(index + 1, depth - 1, blocks, raised, index)
+            elif op in (BREAK_LOOP, CONTINUE_LOOP):
+                # the VM jumps by the loop block, the target is reached by the loop itself
+                if all(block[0] != SETUP_LOOP for block in blocks):
+                    raise VerifyError('break or continue outside a loop at {}'.format(index))
+            else:
+                if op in hasjrel or op in hasjabs:
+                    flow(args[index], depth + stack_effect(op, oparg, jump=True), blocks, raised, index)
+                if op not in NO_FALLTHROUGH:
+                    flow(index + 1, depth + stack_effect(op, oparg), blocks, raised, index)
+        except VerifyError:
+            if strict:
+                raise
+    return max_depth, [state and state[1] for state in states]
+
+
+def max_stack_depth(program: Program) -> int:
+    """
+    dataflow pass over stack effects from the entry
+    every path reaching an instruction must have a same stack depth.
+    """
+    return block_flow(program)[0]
+
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def verify(code: CodeType, supported: frozenset) -> Program:
+    """
+    decode and verify code once, raise VerifyError if malformed
+    the returned Program is marked by `max_stack`.
+
+    :param code: code object
+    :param supported: opcodes the VM implements
+    """
+    try:
+        program = decode(code)
+    except ValueError as e:
+        raise VerifyError(str(e))
+    _check_instructions(program, supported)
+    if program.max_stack is None:
+        # depth stored in an artifact is not searched again
+        program.max_stack = max_stack_depth(program)
+    return program
+
+
+__all__ = [
+    "VerifyError",
+    "stack_effect",
+    "pops",
+    "block_flow",
+    "max_stack_depth",
+    "verify",
+]
@@ -1,8 +1,45 @@
 from rpvm.opcodes import *
-from collections import Iterator
+from collections.abc import Iterator
 from types import CodeType
-from opcode import opname
-import io
+from rpvm.decode import decode
+from rpvm.frontend import FrontendError
+from rpvm.gas import DEFAULT_SCHEDULE, GasSchedule
+from rpvm.optimizer import optimize as optimize_program
+from rpvm.blocks import blocks as compile_blocks
+from rpvm.comprehension import fast_loops
+from rpvm.handlers import handler_table, find_handler, Unwind, SILENCED, \
+    WHY_EXCEPTION, WHY_RETURN, WHY_BREAK, WHY_CONTINUE, WHY_SILENCED
+from rpvm.verify import verify as verify_code, VerifyError
+from rpvm.namespace import EMPTY_BUILTINS, is_shared
+from rpvm import snapshot as snapshot_format
+from rpvm.snapshot import SnapshotError
+from rpvm.journal import JournaledDict, COPIED_TYPES
+from rpvm.limits import DEFAULT_LIMITS, Limits, estimate, SEQUENCE_TYPES, FORMAT_TYPES, CHECKED_OPS
+from rpvm.profiler import Profiler, opnames
+from rpvm.frame import Frame, Function, bind, make_cells, UNSUPPORTED_FLAGS
+from time import monotonic
+from inspect import CO_OPTIMIZED
+
+
+# status of VirtualMachine.run()
+FINISHED = 'finished'
+OUT_OF_STEPS = 'out of steps'
+OUT_OF_TIME = 'out of time'
+OUT_OF_GAS = 'out of gas'
+ERROR = 'error'
+
+# execution engine of VirtualMachine.run()
+INTERPRETER = 'interpreter'  # one instruction per handler call
+BLOCKS = 'blocks'  # basic blocks compiled into functions, see rpvm.blocks
+
+DEADLINE_INTERVAL = 256  # check deadline once every N steps
+
+_unbound = object()  # empty slot of fast locals
+
+# builtin types whose attributes cannot be modified, LOAD_ATTR caches them by type
+CACHEABLE_TYPES = frozenset((
+    int, float, complex, bool, str, bytes, bytearray, list, tuple, dict, set,
+    frozenset, range, slice))
 
 
 class VirtualMachine(object):
@@ -26,490 +63,1334 @@ class VirtualMachine(object):
     >>> c.co_consts[0].co_code   # bytecode
     """
 
-    def __init__(self, code: CodeType, b: dict, l: dict, g: dict) -> None:
+    __slots__ = (
+        'code', 'program', 'pc', 'stack', 'handling', 'buildins', 'shared_buildins',
+        '_locals', 'fastlocals', 'cells', 'frames', '_free_frames', '_functions',
+        'globals', 'finish', 'return_value', 'error', 'steps', 'gas_used', 'gas_limit',
+        'schedule', 'limits', 'buildins_version', 'globals_version', 'cache_hits',
+        'cache_misses', '_caches', '_handlers', '_dispatch', 'engine', 'optimize', 'verify', '_block_costs',
+        '_snapshot_base', 'journal')
+
+    def __init__(self, code: CodeType, b: dict, l: dict, g: dict,
+                 gas_limit: int = None, schedule: GasSchedule = None, limits: Limits = None,
+                 optimize: bool = False, engine: str = INTERPRETER, verify: bool = False) -> None:
         """
         :param code: code object
-        :param b: buildins
-        :param l: locals
+        :param b: buildins, or shared one by rpvm.namespace.share_builtins()
+        :param l: locals, arguments of a function code object
+        :param g: globals
+        :param gas_limit: raise OutOfGasError when gas_used exceeds, None is unlimited
+        :param schedule: gas cost schedule
+        :param limits: size limit of int and sequence results
+        :param optimize: use superinstructions of rpvm.optimizer in run()
+        :param engine: INTERPRETER or BLOCKS, steps and gas are same by both
+        :param verify: reject malformed code by raising VerifyError before execution
+        """
+        if engine not in (INTERPRETER, BLOCKS):
+            raise ValueError('unknown engine {}'.format(engine))
+        self.gas_limit = gas_limit
+        self.schedule = schedule or DEFAULT_SCHEDULE
+        self.limits = limits or DEFAULT_LIMITS
+        self.optimize = optimize
+        self.engine = engine
+        self.verify = verify
+        self._dispatch = dispatch_table
+        self.program = None
+        self.stack = list()  # TOS is the last
+        self.handling = list()  # [(exception, blocks of its handler),..] being handled
+        self.fastlocals = list()  # slot of co_varnames
+        self.cells = ()  # cells of co_cellvars and co_freevars
+        self.frames = list()  # callers of the running function, the contract code is the first
+        self._free_frames = list()  # frames returned, reused by next calls
+        self._functions = dict()  # code -> (program, inline caches) of functions
+        self.buildins_version = 0  # bumped when buildins is modified
+        self.globals_version = 0  # bumped when globals or buildins is modified
+        self._block_costs = dict()  # program -> {start pc: gas of the block}
+        self.buildins = None  # overlay of shared_buildins
+        self.shared_buildins = EMPTY_BUILTINS
+        self.reset(code, l, g, b)
+
+    def reset(self, code: CodeType, l: dict, g: dict, b=None) -> None:
+        """
+        prepare to execute code from the start, reusing buffers of this VM
+        settings given to __init__ and gas_limit are kept.
+
+        :param code: code object
+        :param l: locals, arguments of a function code object
         :param g: globals
+        :param b: buildins or shared buildins, None keeps current one
+            but drops additions to shared buildins
         """
+        program = self._program(code)
+        if program is not self.program:
+            self._block_costs.clear()
+            self._functions.clear()
+        self._clear_frames()
         self.code = code
-        self.bytecode = io.BytesIO(code.co_code)
-        self.bytecode_index = 0
-        self.stack = list()
-        self.block_stack = [(0, len(code.co_code))]  # [(start, size),..]
-        self.buildins = b
-        self.locals = l
+        self.program = program
+        self.pc = 0  # index of program
+        self.stack.clear()
+        self.handling.clear()
+        self.cells = ()
+        if b is not None and not is_shared(b):
+            self.shared_buildins = EMPTY_BUILTINS
+            self.buildins = b
+        elif b is not None or self.shared_buildins is not EMPTY_BUILTINS:
+            # shared buildins is not copied, additions go to own buildins dict
+            if self.shared_buildins is EMPTY_BUILTINS:
+                self.buildins = dict()
+            else:
+                self.buildins.clear()  # additions of previous contract
+            if b is not None:
+                self.shared_buildins = b
+        self._locals = l
+        fastlocals = self.fastlocals
+        fastlocals.clear()
+        if code.co_nlocals:
+            fastlocals.extend([_unbound] * code.co_nlocals)
+            if code.co_flags & CO_OPTIMIZED:
+                for index, name in enumerate(code.co_varnames):
+                    if name in l:
+                        fastlocals[index] = l[name]
         self.globals = g
+        # undo log of JournaledDict namespaces, STORE_SUBSCR and DELETE_SUBSCR record to it too
+        if isinstance(g, JournaledDict):
+            self.journal = g.journal
+        elif isinstance(l, JournaledDict):
+            self.journal = l.journal
+        else:
+            self.journal = None
         self.finish = False
         self.return_value = None
+        self.error = None  # exception raised in run()
+        self.steps = 0  # total executed steps
+        self.gas_used = 0
+        # inline caches of LOAD_NAME, LOAD_GLOBAL and LOAD_ATTR, indexed by pc
+        # versions only go up, caches of functions kept in _functions are of other namespaces
+        self.buildins_version += 1
+        self.globals_version += 1
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._caches = [None] * len(program)
+        self._handlers = handler_table(program)  # blocks enclosing each instruction
+        self._snapshot_base = None  # (id, key digests) of the last snapshot
+
+    def _program(self, code: CodeType):
+        """Program of code by settings of this VM"""
+        program = verify_code(code, SUPPORTED_OPS) if self.verify else decode(code)
+        if self.optimize:
+            max_stack = program.max_stack
+            program = optimize_program(program)
+            if max_stack is not None:
+                program.max_stack = max_stack
+        return program
+
+    def _load(self, code: CodeType) -> tuple:
+        """(program, inline caches, handler table) of function code, shared by all calls of it"""
+        loaded = self._functions.get(code)
+        if loaded is None:
+            try:
+                program = self._program(code)
+            except (VerifyError, FrontendError) as e:
+                # not an error of the contract, handlers of it must not catch
+                raise VirtualMachineError('cannot load `{}`: {}'.format(code.co_name, e))
+            loaded = self._functions[code] = (program, [None] * len(program), handler_table(program))
+        return loaded
+
+    def _push_frame(self, frame: Frame, code: CodeType, loaded: tuple, cells: tuple) -> None:
+        """save the running frame to the frame and start code, fastlocals are already given"""
+        program, caches, handlers = loaded
+        frame.code, self.code = self.code, code
+        frame.program, self.program = self.program, program
+        frame.caches, self._caches = self._caches, caches
+        frame.handlers, self._handlers = self._handlers, handlers
+        frame.pc, self.pc = self.pc, 0
+        frame.cells, self.cells = self.cells, cells
+        frame.stack, self.stack = self.stack, frame.stack
+        frame.handling, self.handling = self.handling, frame.handling
+        frame.fastlocals, self.fastlocals = self.fastlocals, frame.fastlocals
+        self.frames.append(frame)
+
+    def _pop_frame(self) -> None:
+        """return to the caller, lists of the callee are kept by the free frame"""
+        frame = self.frames.pop()
+        self.code = frame.code
+        self.program = frame.program
+        self._caches = frame.caches
+        self._handlers = frame.handlers
+        self.pc = frame.pc
+        self.cells = frame.cells
+        frame.stack, self.stack = self.stack, frame.stack
+        frame.handling, self.handling = self.handling, frame.handling
+        frame.fastlocals, self.fastlocals = self.fastlocals, frame.fastlocals
+        self._release(frame)
+
+    def _release(self, frame: Frame) -> None:
+        frame.stack.clear()
+        frame.handling.clear()
+        frame.fastlocals.clear()
+        frame.code = frame.program = frame.caches = frame.handlers = None
+        frame.cells = ()
+        self._free_frames.append(frame)
+
+    def _clear_frames(self) -> None:
+        """drop calls in progress, the contract code becomes the running frame"""
+        if self.frames:
+            bottom = self.frames[0]
+            self.code = bottom.code
+            self.program = bottom.program
+            self._caches = bottom.caches
+            self._handlers = bottom.handlers
+            bottom.stack, self.stack = self.stack, bottom.stack
+            bottom.handling, self.handling = self.handling, bottom.handling
+            bottom.fastlocals, self.fastlocals = self.fastlocals, bottom.fastlocals
+            for frame in self.frames:
+                self._release(frame)
+            self.frames.clear()
+
+    def _call(self, function: Function, args, kwargs) -> None:
+        """push a frame of the function, raise before pushing if arguments do not match"""
+        if self.limits.max_depth <= len(self.frames):
+            raise ResourceLimitError('call depth is over the limit {}'.format(self.limits.max_depth))
+        loaded = self._load(function.code)
+        frame = self._free_frames.pop() if self._free_frames else Frame()
+        try:
+            bind(function, args, kwargs, frame.fastlocals, _unbound)
+            cells = make_cells(function, frame.fastlocals)
+        except Exception:
+            self._release(frame)
+            raise
+        self._push_frame(frame, function.code, loaded, cells)
+
+    def _unwind(self, why, value) -> bool:
+        """
+        jump to the handler of why found in the handler table by the last instruction
+        an exception searches the callers too and leaves the frames between.
+        False if no block handles it, the VM is not changed then.
+        """
+        handlers = self._handlers
+        pc = self.pc
+        depth = len(self.frames)
+        while True:
+            blocks = handlers[pc - 1]
+            index = find_handler(blocks, why) if blocks else -1
+            if 0 <= index:
+                break
+            if why != WHY_EXCEPTION or depth == 0:
+                return False
+            depth -= 1
+            handlers = self.frames[depth].handlers
+            pc = self.frames[depth].pc
+        while depth < len(self.frames):
+            self._pop_frame()
+        block = blocks[index]
+        kind, handler, level = block
+        handling = self.handling
+        while handling and block in handling[-1][1]:
+            handling.pop()  # unwinding leaves the handler of the exception
+        if why == WHY_CONTINUE and kind == SETUP_LOOP:
+            # the loop keeps its iterator, blocks inside it are left
+            if index + 1 < len(blocks):
+                del self.stack[blocks[index + 1][2]:]
+            self.pc = value
+            return True
+        del self.stack[level:]
+        if kind == SETUP_LOOP:
+            self.pc = handler
+            return True
+        if why == WHY_EXCEPTION:
+            value.__traceback__ = None  # frames of the host are not shown to the contract
+            handling.append((value, self._handlers[handler]))
+        if kind == SETUP_EXCEPT:
+            self.stack.extend((None, value, type(value)))
+        else:
+            self.stack.append(Unwind(why, value))
+        self.pc = handler
+        return True
+
+    def _frame_states(self) -> list:
+        """[(code, pc, stack, handling, fastlocals, cells),..] from the contract code"""
+        states = [(frame.code, frame.pc, frame.stack, frame.handling, frame.fastlocals, frame.cells)
+                  for frame in self.frames]
+        states.append((self.code, self.pc, self.stack, self.handling, self.fastlocals, self.cells))
+        return states
+
+    @property
+    def locals(self) -> dict:
+        """locals dict of the contract code, fast locals are copied to it when accessed"""
+        code, _, _, _, fastlocals, _ = self._frame_states()[0]
+        if fastlocals:
+            for name, value in zip(code.co_varnames, fastlocals):
+                if value is _unbound:
+                    self._locals.pop(name, None)
+                else:
+                    self._locals[name] = value
+        return self._locals
+
+    def snapshot(self, delta=False) -> bytes:
+        """
+        serialize state to resume by `VirtualMachine.restore()` on another process
+        code and buildins are not included, shared buildins additions are included.
+
+        :param delta: only changes of namespaces since the last snapshot of this VM,
+            the receiver merges it to the last one by `rpvm.snapshot.merge()`
+        """
+        locals_is_globals = self._locals is self.globals
+        code = self.frames[0].code if self.frames else self.code
+        frames = list()
+        for frame_code, pc, stack, handling, fastlocals, cells in self._frame_states():
+            path = snapshot_format.code_path(code, frame_code)
+            if path is None:
+                raise SnapshotError('code of `{}` is not in the contract'.format(frame_code.co_name))
+            frames.append({
+                'code': path,
+                'pc': pc,
+                'stack': stack,
+                'handling': handling,
+                'fastlocals': {index: value for index, value in enumerate(fastlocals) if value is not _unbound},
+                'cells': cells,
+            })
+        bottom = frames.pop(0)
+        state = {
+            'pc': bottom['pc'],
+            'stack': bottom['stack'],
+            'handling': bottom['handling'],
+            'fastlocals': bottom['fastlocals'],
+            'frames': frames,  # functions being called, the last is running
+            'locals': None if locals_is_globals else self._locals,
+            'globals': self.globals,
+            'locals_is_globals': locals_is_globals,
+            'buildins': None if self.shared_buildins is EMPTY_BUILTINS else self.buildins,
+            'finish': self.finish,
+            'return_value': self.return_value,
+            'error': self.error,
+            'steps': self.steps,
+            'gas_used': self.gas_used,
+            'gas_limit': self.gas_limit,
+        }
+        digests = snapshot_format.key_digests(state, code)
+        if delta and self._snapshot_base is not None:
+            base_id, base_digests = self._snapshot_base
+            data = snapshot_format.encode_delta(state, code, base_id, base_digests, digests)
+        else:
+            data = snapshot_format.encode(state, code)
+        self._snapshot_base = (snapshot_format.snapshot_id(data), digests)
+        return data
+
+    @classmethod
+    def restore(cls, data: bytes, code: CodeType, b, previous: bytes = None, **kwargs) -> 'VirtualMachine':
+        """
+        build a VM from a snapshot, raise SnapshotError if broken
+        :param data: snapshot
+        :param code: code object the snapshot was taken from
+        :param b: buildins or shared buildins
+        :param previous: last FULL snapshot when data is a DELTA one
+        :param kwargs: other settings of VirtualMachine
+        """
+        if previous is not None:
+            data = snapshot_format.merge(previous, data, code, b)
+        kind, sid, _, state = snapshot_format.decode(data, code, b)
+        if kind != snapshot_format.FULL:
+            raise snapshot_format.SnapshotError('delta snapshot needs the previous one')
+        g = state['globals']
+        l = g if state['locals_is_globals'] else state['locals']
+        vm = cls(code, b, l, g, **kwargs)
+        if not 0 <= state['pc'] <= len(vm.program):
+            raise snapshot_format.SnapshotError('pc out of range')
+        vm.pc = state['pc']
+        vm.stack.extend(state['stack'])
+        vm.handling.extend(state['handling'])
+        for index, value in state['fastlocals'].items():
+            vm.fastlocals[index] = value
+        for frame_state in state.get('frames', ()):
+            nested = snapshot_format.code_at(code, frame_state['code'])
+            loaded = vm._load(nested)
+            if not 0 <= frame_state['pc'] <= len(loaded[0]):
+                raise snapshot_format.SnapshotError('pc out of range')
+            frame = Frame()
+            frame.fastlocals.extend([_unbound] * nested.co_nlocals)
+            for index, value in frame_state['fastlocals'].items():
+                frame.fastlocals[index] = value
+            vm._push_frame(frame, nested, loaded, tuple(frame_state['cells']))
+            vm.pc = frame_state['pc']
+            vm.stack.extend(frame_state['stack'])
+            vm.handling.extend(frame_state['handling'])
+        if state['buildins'] is not None:
+            vm.buildins.update(state['buildins'])
+        vm.finish = state['finish']
+        vm.return_value = state['return_value']
+        vm.error = state['error']
+        vm.steps = state['steps']
+        vm.gas_used = state['gas_used']
+        vm.gas_limit = state['gas_limit']
+        vm._snapshot_base = (sid, snapshot_format.key_digests(state, code))
+        return vm
+
+    def invalidate_caches(self) -> None:
+        """call after modifying namespaces outside the VM"""
+        self.buildins_version += 1
+        self.globals_version += 1
 
     def close(self) -> None:
-        self.bytecode.close()
+        self._clear_frames()
         self.stack.clear()
-        self.block_stack.clear()
-
-    def _read(self, size) -> bytes:
-        self.bytecode_index += size
-        return self.bytecode.read(size)
-
-    def _seek(self, index, flag) -> None:
-        if flag == io.SEEK_SET:
-            self.bytecode_index = index
-            self.bytecode.seek(index, io.SEEK_SET)
-        elif flag == io.SEEK_CUR:
-            self.bytecode_index += index
-            self.bytecode.seek(index, io.SEEK_CUR)
-        else:
-            raise VirtualMachineError('not found seek flag')
+        self.fastlocals.clear()
+        self.handling.clear()
+
+    def peek(self, n=0):
+        """n-th object from the top of stack, 0 is TOS"""
+        return self.stack[-1 - n]
+
+    def _pop_items(self, n) -> list:
+        """pop n objects, return by the pushed order"""
+        if n == 0:
+            return list()
+        items = self.stack[-n:]
+        del self.stack[-n:]
+        return items
+
+    def _load_buildin(self, name):
+        """overlay buildins first, then shared buildins, _unbound if not found"""
+        if name in self.buildins:
+            return self.buildins[name]
+        return self.shared_buildins.get(name, _unbound)
+
+    def _meter(self, op, data, stack=None) -> int:
+        """
+        check result size limit and return gas cost of a dynamic opcode
+        :param stack: operands, the stack of VM if None
+        """
+        if stack is None:
+            stack = self.stack
+        bits, items = self._check_size(op, data, stack)
+        return self.schedule.meter(op, stack, data, bits, items)
+
+    def _check_size(self, op, data, stack) -> (int, int):
+        """estimated (bits, items) of the result, raise ResourceLimitError if over the limits"""
+        bits, items = estimate(op, stack, data)
+        if self.limits.max_int_bits < bits or self.limits.max_items < items:
+            raise ResourceLimitError('`{}` result is about {} bits {} items, over the limit'
+                                     .format(opnames[op], bits, items))
+        return bits, items
 
     def exec(self) -> (int, int):
-        # fetch
-        bytecode = self._read(2)
-        if len(bytecode) == 0:
+        # fetch, execute one original instruction even if optimized
+        pc = self.pc
+        program = self.program
+        if program.max_stack is None and len(program.ops) <= pc:
+            # verified code never runs over the end
             raise VirtualMachineError('EOF')
-        elif len(bytecode) != 2:
-            raise VirtualMachineError('unexpected')
-        else:
-            code, data = bytecode
+        code = program.base_ops[pc]
+        data = program.base_args[pc]
+
+        # gas
+        cost = self.schedule.costs[code]
+        if cost < 0:
+            cost = self._meter(code, data)
+        if self.gas_limit is not None and self.gas_limit < self.gas_used + cost:
+            raise OutOfGasError('need {} gas but remain {}'.format(cost, self.gas_limit - self.gas_used))
+        self.gas_used += cost
 
         # execute
-        if code == NOP:
-            pass
-        if code == POP_TOP:
-            # スタックの先頭 (TOS) の要素を取り除きます。
-            self.stack.pop(0)
-        elif code == ROT_TWO:
-            # スタックの先頭の2つの要素を入れ替えます。
-            f, s = self.stack[0:2]
-            self.stack[0:2] = s, f
-        elif code == ROT_THREE:
-            # スタックの2番目と3番目の要素の位置を1つ上げ、先頭を3番目へ下げます。
-            f, s, t = self.stack[0:3]
-            self.stack[0:3] = s, t, f
-        elif code == DUP_TOP:
-            # スタックの先頭にある参照の複製を作ります。
-            tos = self.stack[0]
-            self.stack.insert(0, tos)
-        elif code == DUP_TOP_TWO:
-            # スタックの先頭の2つの参照を、そのままの順番で複製します。
-            two_tos = self.stack[0:2]
-            self.stack = two_tos + self.stack
-
-        elif code == UNARY_POSITIVE:
-            self.stack[0] = + self.stack[0]
-        elif code == UNARY_NEGATIVE:
-            self.stack[0] = - self.stack[0]
-        elif code == UNARY_NOT:
-            self.stack[0] = not self.stack[0]
-        elif code == UNARY_INVERT:
-            self.stack[0] = ~ self.stack[0]
-        elif code == GET_ITER:
-            self.stack[0] = iter(self.stack[0])
-        elif code == GET_YIELD_FROM_ITER:
-            if not isinstance(self.stack[0], Iterator):
-                self.stack[0] = iter(self.stack[0])
-
-        elif code == BINARY_POWER:
-            f, s = self.stack[0:2]
-            self.stack[0] = s ** f
-            self.stack.pop(1)
-        elif code == BINARY_MULTIPLY:
-            f, s = self.stack[0:2]
-            self.stack[0] = s * f
-            self.stack.pop(1)
-        elif code == BINARY_MATRIX_MULTIPLY:
-            f, s = self.stack[0:2]
-            self.stack[0] = s @ f
-            self.stack.pop(1)
-        elif code == BINARY_FLOOR_DIVIDE:
-            f, s = self.stack[0:2]
-            self.stack[0] = s // f
-            self.stack.pop(1)
-        elif code == BINARY_TRUE_DIVIDE:
-            f, s = self.stack[0:2]
-            self.stack[0] = s / f
-            self.stack.pop(1)
-        elif code == BINARY_MODULO:
-            f, s = self.stack[0:2]
-            self.stack[0] = s % f
-            self.stack.pop(1)
-        elif code == BINARY_ADD:
-            f, s = self.stack[0:2]
-            self.stack[0] = s + f
-            self.stack.pop(1)
-        elif code == BINARY_SUBTRACT:
-            f, s = self.stack[0:2]
-            self.stack[0] = s - f
-            self.stack.pop(1)
-        elif code == BINARY_SUBSCR:
-            f, s = self.stack[0:2]
-            self.stack[0] = s[f]
-            self.stack.pop(1)
-        elif code == BINARY_LSHIFT:
-            f, s = self.stack[0:2]
-            self.stack[0] = s << f
-            self.stack.pop(1)
-        elif code == BINARY_RSHIFT:
-            f, s = self.stack[0:2]
-            self.stack[0] = s >> f
-            self.stack.pop(1)
-        elif code == BINARY_AND:
-            f, s = self.stack[0:2]
-            self.stack[0] = s & f
-            self.stack.pop(1)
-        elif code == BINARY_XOR:
-            f, s = self.stack[0:2]
-            self.stack[0] = s ^ f
-            self.stack.pop(1)
-        elif code == BINARY_OR:
-            f, s = self.stack[0:2]
-            self.stack[0] = s | f
-            self.stack.pop(1)
-
-        elif code == INPLACE_POWER:
-            self.stack[1] **= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_MULTIPLY:
-            self.stack[1] *= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_MATRIX_MULTIPLY:
-            self.stack[1] @= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_FLOOR_DIVIDE:
-            self.stack[1] //= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_TRUE_DIVIDE:
-            self.stack[1] /= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_MODULO:
-            self.stack[1] %= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_ADD:
-            self.stack[1] += self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_SUBTRACT:
-            self.stack[1] -= self.stack[0]
-            self.stack.pop(0)
-        elif code == STORE_SUBSCR:
-            self.stack[1][self.stack[0]] = self.stack[2]
-            self.stack.pop(0)
-        elif code == DELETE_SUBSCR:
-            del self.stack[1][self.stack[0]]
-            self.stack.pop(0)
-        elif code == INPLACE_LSHIFT:
-            self.stack[1] <<= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_RSHIFT:
-            self.stack[1] >>= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_AND:
-            self.stack[1] &= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_XOR:
-            self.stack[1] ^= self.stack[0]
-            self.stack.pop(0)
-        elif code == INPLACE_OR:
-            self.stack[1] |= self.stack[0]
-            self.stack.pop(0)
-
-        elif code == GET_AWAITABLE:
-            raise NotImplementedError
-        elif code == GET_AITER:
-            raise NotImplementedError
-        elif code == GET_ANEXT:
-            raise NotImplementedError
-        elif code == BEFORE_ASYNC_WITH:
-            raise NotImplementedError
-        elif code == SETUP_ASYNC_WITH:
-            raise NotImplementedError
-
-        elif code == FOR_ITER:
-            # TOS はイテレータです。 その __next__() メソッドを呼び出します。
-            # 要素が尽きた場合は、TOS がポップされ、バイトコードカウンタが delta だけ増やされます。
-            assert isinstance(self.stack[0], Iterator)
+        self.pc = pc + 1
+        self.steps += 1
+        try:
+            self._dispatch[code](self, data)
+        except VirtualMachineError:
+            raise
+        except Exception as e:
+            # raised to the caller only when no handler of the contract catches it
+            if not self._unwind(WHY_EXCEPTION, e):
+                raise
+        return code, program.opargs[pc]
+
+    def run(self, max_steps, deadline=None) -> (int, str):
+        """
+        execute instructions in a tight loop until finish or budget is used up
+        exception is not raised but stored to `error`, and the VM stays stopped.
+
+        :param max_steps: max steps of this quantum
+        :param deadline: stop by this `time.monotonic()`, checked every DEADLINE_INTERVAL steps
+        :return: (consumed steps, FINISHED or OUT_OF_STEPS or OUT_OF_TIME or OUT_OF_GAS or ERROR)
+        """
+        if self.finish:
+            return 0, FINISHED
+        if self.error is not None:
+            return 0, OUT_OF_GAS if isinstance(self.error, OutOfGasError) else ERROR
+        program = self.program
+        ops = program.ops
+        dispatch = self._dispatch
+        op_costs = self.schedule.costs
+        meter = self._meter
+        gas = self.gas_used
+        gas_limit = float('inf') if self.gas_limit is None else self.gas_limit
+        steps = 0
+        pc = width = 0
+        status = OUT_OF_STEPS
+        while True:
             try:
-                new = self.stack[0].__next__()
-                self.stack.insert(0, new)
-            except StopIteration:
-                self.stack.pop(0)
-                self._seek(data, io.SEEK_CUR)
-        elif code == SETUP_LOOP:
-            # ループのためのブロックをブロックスタックにプッシュします。
-            # ブロックは現在の命令から delta バイトの大きさを占めます。
-            self.block_stack.insert(0, (self.bytecode_index, data))
-        elif code == BREAK_LOOP:
-            # break 文によってループを終了します。
-            start, size = self.block_stack.pop(0)
-            self._seek(start + size, io.SEEK_SET)
-        elif code == CONTINUE_LOOP:
-            # continue 文によってループを継続します。
-            # target はジャンプするアドレスです (アドレスは FOR_ITER 命令でなければなりません)。
-            self._seek(data, io.SEEK_SET)
-
-        elif code == SET_ADD:
-            raise NotImplementedError
-        elif code == LIST_APPEND:
-            raise NotImplementedError
-        elif code == MAP_ADD:
-            raise NotImplementedError
-
-        elif code == RETURN_VALUE:
-            self.finish = True
-            self.return_value = self.stack[0]
-        elif code == YIELD_VALUE:
-            raise NotImplementedError
-        elif code == YIELD_FROM:
-            raise NotImplementedError
-        elif code == SETUP_ANNOTATIONS:
-            pass  # do nothing
-
-        elif code == SETUP_WITH:
-            raise NotImplementedError
-        elif code == WITH_CLEANUP_START:
-            raise NotImplementedError
-        elif code == WITH_CLEANUP_FINISH:
-            raise NotImplementedError
-
-        elif code == IMPORT_STAR:
-            raise NotImplementedError
-        elif code == IMPORT_NAME:
-            raise NotImplementedError  # use at initialize
-        elif code == IMPORT_FROM:
-            raise NotImplementedError  # use at initialize
-
-        elif code == POP_BLOCK:
-            self.block_stack.pop(0)
-        elif code == SETUP_EXCEPT:
-            # try-except 節から try ブロックをブロックスタックにプッシュします。
-            self.block_stack.insert(0, (self.bytecode_index, data))
-        elif code == SETUP_FINALLY:
-            raise NotImplementedError
-        elif code == POP_EXCEPT:
-            self.block_stack.pop(0)
-        elif code == END_FINALLY:
-            raise NotImplementedError
-
-        elif code == STORE_NAME:
-            name = self.code.co_names[data]
-            self.locals[name] = self.stack.pop(0)
-        elif code == DELETE_NAME:
-            name = self.code.co_names[data]
-            del self.locals[name]
-        elif code == UNPACK_SEQUENCE:
-            tos = self.stack.pop(0)
-            for d in tos:
-                self.stack.insert(0, d)
-        elif code == UNPACK_EX:
-            raise NotImplementedError
-        elif code == STORE_ATTR:
-            assert isinstance(self.stack[0], type), self.stack[0]
-            setattr(self.stack[0], self.code.co_names[data], self.stack[1])
-        elif code == DELETE_ATTR:
-            assert isinstance(self.stack[0], type), self.stack[0]
-            delattr(self.stack[0], self.code.co_names[data])
-        elif code == STORE_GLOBAL:
-            name = self.code.co_names[data]
-            self.globals[name] = self.stack.pop(0)
-        elif code == DELETE_GLOBAL:
-            name = self.code.co_names[data]
+                while steps < max_steps:
+                    if deadline is None:
+                        end = max_steps
+                    elif deadline <= monotonic():
+                        status = OUT_OF_TIME
+                        break
+                    else:
+                        end = min(max_steps, steps + DEADLINE_INTERVAL)
+                    # a call or a return switches the program
+                    program = self.program
+                    ops = program.ops
+                    args = program.args
+                    widths = program.widths
+                    costs = self.schedule.program_costs(program, self.limits.max_items)
+                    # a profiler counts each instruction, comprehensions run one by one then
+                    loops = fast_loops(program) if dispatch is dispatch_table else None
+                    if self.engine == BLOCKS:
+                        blocks = compile_blocks(program)
+                        block_costs = self._block_costs.get(program)
+                        if block_costs is None:
+                            block_costs = self._block_costs[program] = dict()
+                    else:
+                        blocks = block_costs = None
+                    while steps < end:
+                        pc = self.pc
+                        if loops is not None and loops[pc] is not None:
+                            # many elements of a comprehension at once, charged per element
+                            used, cost, error = loops[pc].run(self, end - steps, gas_limit - gas, op_costs)
+                            gas += cost
+                            steps += used
+                            if error is not None:
+                                width = 1  # raised by FOR_ITER, nothing to refund
+                                raise error
+                            if used:
+                                continue
+                        if blocks is not None and blocks[pc] is not None:
+                            block = blocks[pc]
+                            cost = block_costs.get(pc)
+                            if cost is None:
+                                cost = block_costs[pc] = sum(
+                                    op_costs[op] for op in program.base_ops[pc:block.end])
+                            width = block.end - pc
+                            if width <= max_steps - steps and gas + cost <= gas_limit:
+                                # charge whole block at once, refunded below when it fails
+                                gas += cost
+                                steps += width
+                                if block.fnc(self):
+                                    break
+                                continue
+                        op = ops[pc]
+                        arg = args[pc]
+                        cost = costs[pc]
+                        width = widths[pc]
+                        if width != 1 and (cost < 0 or max_steps - steps < width or gas_limit < gas + cost):
+                            # superinstruction does not fit the budget, run the original one
+                            op = program.base_ops[pc]
+                            arg = program.base_args[pc]
+                            cost = op_costs[op]
+                            width = 1
+                        if cost < 0:
+                            cost = meter(op, arg)
+                        gas += cost
+                        if gas_limit < gas:
+                            gas -= cost
+                            width = 1
+                            raise OutOfGasError('need {} gas but remain {}'.format(cost, gas_limit - gas))
+                        self.pc = pc + width
+                        steps += width
+                        # handler returns True when finished or the frame is switched
+                        if dispatch[op](self, arg):
+                            break
+                    if self.finish:
+                        status = FINISHED
+                        break
+                break
+            except OutOfGasError as e:
+                self.error = e
+                status = OUT_OF_GAS
+            except IndexError as e:
+                if self.pc < len(ops):
+                    self.error = e
+                else:
+                    self.error = VirtualMachineError('EOF')
+                status = ERROR
+            except Exception as e:
+                self.error = e
+                status = ERROR
+            if status == ERROR and pc < self.pc < pc + width:
+                # superinstruction or block failed, refund the original instructions not reached
+                unreached = range(self.pc, pc + width)
+                steps -= len(unreached)
+                gas -= sum(op_costs[program.base_ops[i]] for i in unreached)
+            if status != ERROR or isinstance(self.error, VirtualMachineError) or \
+                    not self._unwind(WHY_EXCEPTION, self.error):
+                break
+            # caught by a handler of the contract, keep running
+            self.error = None
+            status = OUT_OF_STEPS
+            width = 0
+        self.steps += steps
+        self.gas_used = gas
+        return steps, status
+
+    def profile(self, timing=False) -> Profiler:
+        """
+        count executed instructions until `profiler.detach()`
+        VMs not profiled have no overhead, see rpvm.profiler
+        """
+        return Profiler(timing).attach(self)
+
+    # opcode handlers
+    # each handler is registered to `dispatch_table` by the opcode name,
+    # `_op_pop_top` handles POP_TOP and so on.
+    # a handler returns True when the VM finished or a call or a return switched
+    # the running frame, otherwise None.
+
+    def _op_not_supported(self, data):
+        raise NotImplementedError
+
+    def _op_not_found(self, data):
+        code = self.program.ops[self.pc - 1]
+        raise VirtualMachineError('not found op `{}`'.format(code))
+
+    def _op_nop(self, data):
+        pass
+
+    def _op_extended_arg(self, data):
+        pass  # folded into next oparg by decoder
+
+    def _op_pop_top(self, data):
+        # スタックの先頭 (TOS) の要素を取り除きます。
+        self.stack.pop()
+
+    def _op_rot_two(self, data):
+        # スタックの先頭の2つの要素を入れ替えます。
+        s, f = self.stack[-2:]
+        self.stack[-2:] = f, s
+
+    def _op_rot_three(self, data):
+        # スタックの2番目と3番目の要素の位置を1つ上げ、先頭を3番目へ下げます。
+        t, s, f = self.stack[-3:]
+        self.stack[-3:] = f, t, s
+
+    def _op_dup_top(self, data):
+        # スタックの先頭にある参照の複製を作ります。
+        self.stack.append(self.stack[-1])
+
+    def _op_dup_top_two(self, data):
+        # スタックの先頭の2つの参照を、そのままの順番で複製します。
+        self.stack.extend(self.stack[-2:])
+
+    def _op_unary_positive(self, data):
+        self.stack[-1] = + self.stack[-1]
+
+    def _op_unary_negative(self, data):
+        self.stack[-1] = - self.stack[-1]
+
+    def _op_unary_not(self, data):
+        self.stack[-1] = not self.stack[-1]
+
+    def _op_unary_invert(self, data):
+        self.stack[-1] = ~ self.stack[-1]
+
+    def _op_get_iter(self, data):
+        self.stack[-1] = iter(self.stack[-1])
+
+    def _op_get_yield_from_iter(self, data):
+        if not isinstance(self.stack[-1], Iterator):
+            self.stack[-1] = iter(self.stack[-1])
+
+    def _op_binary_power(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] ** f
+
+    def _op_binary_multiply(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] * f
+
+    def _op_binary_matrix_multiply(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] @ f
+
+    def _op_binary_floor_divide(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] // f
+
+    def _op_binary_true_divide(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] / f
+
+    def _op_binary_modulo(self, data):
+        if isinstance(self.stack[-2], FORMAT_TYPES):
+            self._check_size(BINARY_MODULO, data, self.stack)
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] % f
+
+    def _op_binary_add(self, data):
+        if isinstance(self.stack[-1], SEQUENCE_TYPES):
+            self._check_size(BINARY_ADD, data, self.stack)
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] + f
+
+    def _op_binary_subtract(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] - f
+
+    def _op_binary_subscr(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1][f]
+
+    def _op_binary_lshift(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] << f
+
+    def _op_binary_rshift(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] >> f
+
+    def _op_binary_and(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] & f
+
+    def _op_binary_xor(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] ^ f
+
+    def _op_binary_or(self, data):
+        f = self.stack.pop()
+        self.stack[-1] = self.stack[-1] | f
+
+    def _op_inplace_power(self, data):
+        f = self.stack.pop()
+        self.stack[-1] **= f
+
+    def _op_inplace_multiply(self, data):
+        f = self.stack.pop()
+        self.stack[-1] *= f
+
+    def _op_inplace_matrix_multiply(self, data):
+        f = self.stack.pop()
+        self.stack[-1] @= f
+
+    def _op_inplace_floor_divide(self, data):
+        f = self.stack.pop()
+        self.stack[-1] //= f
+
+    def _op_inplace_true_divide(self, data):
+        f = self.stack.pop()
+        self.stack[-1] /= f
+
+    def _op_inplace_modulo(self, data):
+        if isinstance(self.stack[-2], FORMAT_TYPES):
+            self._check_size(INPLACE_MODULO, data, self.stack)
+        f = self.stack.pop()
+        self.stack[-1] %= f
+
+    def _op_inplace_add(self, data):
+        if isinstance(self.stack[-1], SEQUENCE_TYPES):
+            self._check_size(INPLACE_ADD, data, self.stack)
+        f = self.stack.pop()
+        self.stack[-1] += f
+
+    def _op_inplace_subtract(self, data):
+        f = self.stack.pop()
+        self.stack[-1] -= f
+
+    def _op_store_subscr(self, data):
+        key = self.stack.pop()
+        obj = self.stack.pop()
+        value = self.stack.pop()
+        if self.journal is not None:
+            self.journal.record(obj, key)
+        obj[key] = value
+
+    def _op_delete_subscr(self, data):
+        key = self.stack.pop()
+        obj = self.stack.pop()
+        if self.journal is not None:
+            self.journal.record_delete(obj, key)
+        del obj[key]
+
+    def _op_inplace_lshift(self, data):
+        f = self.stack.pop()
+        self.stack[-1] <<= f
+
+    def _op_inplace_rshift(self, data):
+        f = self.stack.pop()
+        self.stack[-1] >>= f
+
+    def _op_inplace_and(self, data):
+        f = self.stack.pop()
+        self.stack[-1] &= f
+
+    def _op_inplace_xor(self, data):
+        f = self.stack.pop()
+        self.stack[-1] ^= f
+
+    def _op_inplace_or(self, data):
+        f = self.stack.pop()
+        self.stack[-1] |= f
+
+    def _op_for_iter(self, data):
+        # TOS はイテレータです。 その __next__() メソッドを呼び出します。
+        # 要素が尽きた場合は、TOS がポップされ、バイトコードカウンタが delta だけ増やされます。
+        assert isinstance(self.stack[-1], Iterator)
+        try:
+            new = self.stack[-1].__next__()
+            self.stack.append(new)
+        except StopIteration:
+            self.stack.pop()
+            self.pc = data
+
+    def _op_setup_loop(self, data):
+        # ループのブロックはロード時にハンドラ表へ入っているので、何もしません。
+        pass
+
+    def _op_break_loop(self, data):
+        # break 文によってループを終了します。 間にある finally 節を先に実行します。
+        if not self._unwind(WHY_BREAK, None):
+            raise VirtualMachineError('break outside a loop')
+
+    def _op_continue_loop(self, data):
+        # continue 文によってループを継続します。
+        # target はジャンプするアドレスです (アドレスは FOR_ITER 命令でなければなりません)。
+        if not self._unwind(WHY_CONTINUE, data):
+            raise VirtualMachineError('continue outside a loop')
+
+    def _op_list_append(self, data):
+        # TOS を data 番目のリストへ追加します。 大きなリスト表示と内包表記で使われます。
+        v = self.stack.pop()
+        self.stack[-data].append(v)
+
+    def _op_set_add(self, data):
+        v = self.stack.pop()
+        self.stack[-data].add(v)
+
+    def _op_map_add(self, data):
+        # TOS がキー、 TOS1 が値です (Python3.6)。
+        key = self.stack.pop()
+        value = self.stack.pop()
+        self.stack[-data][key] = value
+
+    def _op_return_value(self, data):
+        value = self.stack.pop()
+        if self._handlers[self.pc - 1] and self._unwind(WHY_RETURN, value):
+            return  # finally 節を実行してから戻ります。
+        return self._return(value)
+
+    def _return(self, value):
+        if self.frames:
+            # 呼び出し元のフレームへ戻り、戻り値をスタックにプッシュします。
+            self._pop_frame()
+            self.stack.append(value)
+            return True
+        self.finish = True
+        self.return_value = value
+        return True
+
+    def _op_setup_annotations(self, data):
+        pass  # do nothing
+
+    def _op_pop_block(self, data):
+        pass  # ブロックはハンドラ表にあるので何もしません。
+
+    def _op_setup_except(self, data):
+        # try-except 節の try ブロックです。 例外はハンドラ表から except 節へ飛びます。
+        pass
+
+    def _op_setup_finally(self, data):
+        # try-finally 節の try ブロックです。 return、break、例外は finally 節を経由します。
+        pass
+
+    def _op_pop_except(self, data):
+        # except 節の終わりで、処理中の例外を取り除きます。
+        if not self.handling:
+            raise VirtualMachineError('no exception is handled')
+        self.handling.pop()
+
+    def _op_end_finally(self, data):
+        # finally 節の終わりです。 TOS が None なら次へ進み、
+        # Unwind なら中断された処理を再開し、例外の型なら一致しなかった例外を再送出します。
+        tos = self.stack.pop()
+        if tos is None:
+            return
+        if type(tos) is Unwind:
+            why = tos.why
+            if why == WHY_EXCEPTION:
+                raise tos.value
+            if why == WHY_SILENCED:
+                self.handling.pop()
+                return
+            if self._unwind(why, tos.value):
+                return
+            if why == WHY_RETURN:
+                return self._return(tos.value)
+            raise VirtualMachineError('{} outside a loop'.format(why))
+        if isinstance(tos, type) and issubclass(tos, BaseException):
+            value = self.stack.pop()
+            self.stack.pop()  # traceback
+            raise value
+        raise VirtualMachineError('END_FINALLY of {}'.format(type(tos).__name__))
+
+    def _op_setup_with(self, data):
+        # TOS の __exit__ を TOS と置き換え、 __enter__() の結果をプッシュします。
+        manager = self.stack[-1]
+        cls = type(manager)
+        exit = cls.__exit__
+        enter = cls.__enter__
+        self.stack[-1] = exit.__get__(manager, cls)
+        self.stack.append(enter.__get__(manager, cls)())
+
+    def _op_with_cleanup_start(self, data):
+        # TOS が None または Unwind で、その下の __exit__ を呼び出します。
+        tos = self.stack.pop()
+        exit = self.stack.pop()
+        if type(tos) is Unwind and tos.why == WHY_EXCEPTION:
+            e = tos.value
+            result = exit(type(e), e, e.__traceback__)
+        else:
+            result = exit(None, None, None)
+        self.stack.extend((tos, tos, result))
+
+    def _op_with_cleanup_finish(self, data):
+        # __exit__() の結果が真なら例外を抑止し、 END_FINALLY は次へ進みます。
+        result = self.stack.pop()
+        tos = self.stack.pop()
+        if type(tos) is Unwind and tos.why == WHY_EXCEPTION and result:
+            self.stack[-1] = SILENCED
+
+    def _op_store_name(self, name):
+        self._locals[name] = self.stack.pop()
+        if self._locals is self.globals:
+            self.globals_version += 1
+
+    def _op_delete_name(self, name):
+        try:
+            del self._locals[name]
+        except KeyError:
+            raise NameError("name '{}' is not defined".format(name))
+        if self._locals is self.globals:
+            self.globals_version += 1
+
+    def _op_unpack_sequence(self, data):
+        items = tuple(self.stack.pop())
+        if len(items) != data:
+            raise ValueError('expected {} values to unpack, got {}'.format(data, len(items)))
+        self.stack.extend(reversed(items))
+
+    def _op_store_attr(self, name):
+        assert isinstance(self.stack[-1], type), self.stack[-1]
+        obj = self.stack.pop()
+        setattr(obj, name, self.stack.pop())
+
+    def _op_delete_attr(self, name):
+        assert isinstance(self.stack[-1], type), self.stack[-1]
+        delattr(self.stack.pop(), name)
+
+    def _op_store_global(self, name):
+        self.globals[name] = self.stack.pop()
+        self.globals_version += 1
+
+    def _op_delete_global(self, name):
+        try:
             del self.globals[name]
+        except KeyError:
+            raise NameError("name '{}' is not defined".format(name))
+        self.globals_version += 1
 
-        elif code == LOAD_CONST:
-            self.stack.insert(0, self.code.co_consts[data])
-        elif code == LOAD_NAME:
-            name = self.code.co_names[data]
-            if name in self.locals:
-                self.stack.insert(0, self.locals[name])
-            elif name in self.buildins:
-                self.stack.insert(0, self.buildins[name])
-            else:
-                raise VirtualMachineError('not found `{}`'.format(name))
-        elif code == LOAD_ATTR:
-            self.stack[0] = getattr(self.stack[0], self.code.co_names[data])
-        elif code == LOAD_GLOBAL:
-            name = self.code.co_names[data]
-            self.stack.insert(0, self.globals[name])
-        elif code == LOAD_FAST:
-            name = self.code.co_varnames[data]
-            self.stack.insert(0, self.locals[name])
-        elif code == STORE_FAST:
-            name = self.code.co_varnames[data]
-            self.locals[name] = self.stack.pop(0)
-        elif code == DELETE_FAST:
-            name = self.code.co_varnames[data]
-            del self.locals[name]
-
-        elif code == BUILD_TUPLE:
-            n = reversed(self.stack[0:data])
-            self.stack = self.stack[data:]
-            self.stack.insert(0, tuple(n))
-        elif code == BUILD_LIST:
-            n = reversed(self.stack[0:data])
-            self.stack = self.stack[data:]
-            self.stack.insert(0, list(n))
-        elif code == BUILD_SET:
-            n = reversed(self.stack[0:data])
-            self.stack = self.stack[data:]
-            self.stack.insert(0, set(n))
-        elif code == BUILD_MAP:
-            d = dict()
-            for i in range(data):
-                d[self.stack[i*2+1]] = self.stack[i*2]
-            self.stack = self.stack[data*2:]
-            self.stack.insert(0, d)
-        elif code == BUILD_CONST_KEY_MAP:
-            raise NotImplementedError
-        elif code == BUILD_STRING:
-            raise NotImplementedError
-        elif code == BUILD_TUPLE_UNPACK:
-            l = list()
-            for n in reversed(self.stack[0:data]):
-                l.extend(n)
-            self.stack = self.stack[data:]
-            self.stack.insert(0, tuple(l))
-        elif code == BUILD_LIST_UNPACK:
-            l = list()
-            for n in reversed(self.stack[0:data]):
-                l.extend(n)
-            self.stack = self.stack[data:]
-            self.stack.insert(0, l)
-        elif code == BUILD_MAP_UNPACK:
-            d = dict()
-            for _ in range(data):
-                d.update(self.stack.pop(0))
-            self.stack.insert(0, d)
-        elif code == BUILD_SET_UNPACK:
-            s = set()
-            for _ in range(data):
-                s.update(self.stack.pop(0))
-            self.stack.insert(0, s)
-        elif code == BUILD_MAP_UNPACK_WITH_CALL:
-            raise NotImplementedError
-        elif code == BUILD_TUPLE_UNPACK_WITH_CALL:
-            raise NotImplementedError
-
-        elif code == COMPARE_OP:
-            right = self.stack.pop(0)
-            left = self.stack[0]
-            if data == 0:
-                self.stack[0] = left < right
-            elif data == 1:
-                self.stack[0] = left <= right
-            elif data == 2:
-                self.stack[0] = left == right
-            elif data == 3:
-                self.stack[0] = left != right
-            elif data == 4:
-                self.stack[0] = left > right
-            elif data == 5:
-                self.stack[0] = left >= right
-            elif data == 6:
-                self.stack[0] = left in right
-            elif data == 7:
-                self.stack[0] = left not in right
-            else:
-                raise VirtualMachineError('not found cmp code {}'.format(data))
-
-        elif code == JUMP_FORWARD:
-            self._seek(data, io.SEEK_CUR)
-        elif code == POP_JUMP_IF_TRUE:
-            if self.stack.pop(0):
-                self._seek(data, io.SEEK_SET)
-        elif code == POP_JUMP_IF_FALSE:
-            if not self.stack.pop(0):
-                self._seek(data, io.SEEK_SET)
-        elif code == JUMP_IF_TRUE_OR_POP:
-            if self.stack.pop[0]:
-                self._seek(data, io.SEEK_SET)
-            else:
-                self.stack.pop(0)
-        elif code == JUMP_IF_FALSE_OR_POP:
-            if not self.stack.pop[0]:
-                self._seek(data, io.SEEK_SET)
-            else:
-                self.stack.pop(0)
-        elif code == JUMP_ABSOLUTE:
-            self._seek(data, io.SEEK_SET)
-
-        elif code == RAISE_VARARGS:
-            if data == 0:
-                raise NotImplementedError
-            elif data == 1:
-                raise self.stack.pop(0)
-            elif data == 2:
-                tos = self.stack.pop(0)
-                raise self.stack.pop(0) from tos
-            else:
-                raise VirtualMachineError('not found argc {}'.format(data))
-
-        elif code == CALL_FUNCTION:
-            args = list()
-            for _ in range(data):
-                args.append(self.stack.pop(0))
-            fnc = self.stack.pop(0)
-            self.stack.insert(0, fnc(*args))
-        elif code == MAKE_FUNCTION:
-            raise NotImplementedError
-        elif code == BUILD_SLICE:
-            if data == 2:
-                tos = self.stack.pop(0)
-                self.stack[0] = slice(self.stack[0], tos)
-            elif data == 3:
-                tos = self.stack.pop(0)
-                tos1 = self.stack.pop(0)
-                self.stack[0] = slice(self.stack[0], tos1, tos)
-            else:
-                raise VirtualMachineError('slice argc is 2 or 3 not {}'.format(data))
-        elif code == LOAD_CLOSURE:
-            raise NotImplementedError
-        elif code == LOAD_DEREF:
-            raise NotImplementedError
-        elif code == STORE_DEREF:
-            raise NotImplementedError
-        elif code == DELETE_DEREF:
-            raise NotImplementedError
-        elif code == CALL_FUNCTION_KW:
-            kwd_list = self.stack.pop(0)
-            kwds = dict()
-            for k in kwd_list:
-                kwds[k] = self.stack.pop(0)
-            args = list()
-            for _ in range(data - len(kwd_list)):
-                args = self.stack.pop(0)
-            fnc = self.stack[0]
-            self.stack[0] = fnc(*args, **kwds)
-        elif code == CALL_FUNCTION_EX:
-            if data & 0x01:
-                kwds = self.stack.pop(0)
-            else:
-                kwds = dict()
-            args = self.stack.pop(0)
-            fnc = self.stack[0]
-            self.stack[0] = fnc(*args, **kwds)
-        elif code == LOAD_CLASSDEREF:
-            raise NotImplementedError
-
-        elif code == PRINT_EXPR:
-            raise NotImplementedError
-        elif code == LOAD_BUILD_CLASS:
-            raise NotImplementedError
-        elif code == HAVE_ARGUMENT:
-            raise NotImplementedError
-        elif code == EXTENDED_ARG:
-            raise NotImplementedError
-        elif code == FORMAT_VALUE:
-            # Used for implementing formatted literal strings (f-strings)
-            raise NotImplementedError
+    def _op_load_const(self, const):
+        self.stack.append(const)
+
+    def _op_load_name(self, name):
+        if name in self._locals:
+            self.stack.append(self._locals[name])
+            return
+        # cache only a name found in buildins, a local is overwritten frequently
+        cache = self._caches[self.pc - 1]
+        if cache is not None and cache[0] == self.buildins_version:
+            self.cache_hits += 1
+            self.stack.append(cache[1])
+        else:
+            self.cache_misses += 1
+            value = self._load_buildin(name)
+            if value is _unbound:
+                raise NameError("name '{}' is not defined".format(name))
+            self._caches[self.pc - 1] = (self.buildins_version, value)
+            self.stack.append(value)
+
+    def _op_load_attr(self, name):
+        # cache a class attribute of builtin types, an instance of them has no __dict__
+        obj = self.stack[-1]
+        cache = self._caches[self.pc - 1]
+        if cache is not None and cache[0] is type(obj):
+            self.cache_hits += 1
+            self.stack[-1] = cache[1](obj, cache[0]) if cache[1] else cache[2]
+            return
+        self.cache_misses += 1
+        self.stack[-1] = getattr(obj, name)
+        cls = type(obj)
+        if cls in CACHEABLE_TYPES:
+            for klass in cls.__mro__:
+                if name in klass.__dict__:
+                    attr = klass.__dict__[name]
+                    get = attr.__get__ if hasattr(type(attr), '__get__') else None
+                    self._caches[self.pc - 1] = (cls, get, attr)
+                    break
+
+    def _op_load_global(self, name):
+        cache = self._caches[self.pc - 1]
+        if cache is not None and cache[0] == self.globals_version:
+            self.cache_hits += 1
+            self.stack.append(cache[1])
+            if self.journal is not None and isinstance(cache[1], COPIED_TYPES):
+                # read without the namespace, copy it as JournaledDict does
+                self.journal.record_contents(cache[1])
+            return
+        self.cache_misses += 1
+        if name in self.globals:
+            value = self.globals[name]
+        else:
+            value = self._load_buildin(name)
+            if value is _unbound:
+                raise NameError("name '{}' is not defined".format(name))
+        self._caches[self.pc - 1] = (self.globals_version, value)
+        self.stack.append(value)
+
+    # superinstructions of rpvm.optimizer
+    # self.pc already points after all the original instructions, a failed one
+    # rewinds it to just after the original instruction which raised.
+
+    def _op_name_const_binary_store(self, data):
+        name, const, op, fnc, store = data
+        if name in self._locals:
+            value = self._locals[name]
+        else:
+            value = self._load_buildin(name)
+            if value is _unbound:
+                self.pc -= 3
+                raise NameError("name '{}' is not defined".format(name))
+        try:
+            if op in CHECKED_OPS and isinstance(value, SEQUENCE_TYPES):
+                self._check_size(op, None, (value, const))
+            value = fnc(value, const)
+        except Exception:
+            self.pc -= 1
+            raise
+        self._locals[store] = value
+        if self._locals is self.globals:
+            self.globals_version += 1
+
+    def _op_name_const_compare_jump(self, data):
+        name, const, fnc, jump_if, target = data
+        if name in self._locals:
+            value = self._locals[name]
+        else:
+            value = self._load_buildin(name)
+            if value is _unbound:
+                self.pc -= 3
+                raise NameError("name '{}' is not defined".format(name))
+        try:
+            value = fnc(value, const)
+        except Exception:
+            self.pc -= 1
+            raise
+        if bool(value) is jump_if:
+            self.pc = target
+
+    def _op_const_tuple(self, const):
+        self.stack.append(const)
+
+    def _op_load_fast(self, index):
+        value = self.fastlocals[index]
+        if value is _unbound:
+            raise UnboundLocalError("local variable '{}' referenced before assignment"
+                                    .format(self.code.co_varnames[index]))
+        self.stack.append(value)
+
+    def _op_store_fast(self, index):
+        self.fastlocals[index] = self.stack.pop()
+
+    def _op_delete_fast(self, index):
+        if self.fastlocals[index] is _unbound:
+            raise UnboundLocalError("local variable '{}' referenced before assignment"
+                                    .format(self.code.co_varnames[index]))
+        self.fastlocals[index] = _unbound
+
+    def _op_build_tuple(self, data):
+        self.stack.append(tuple(self._pop_items(data)))
+
+    def _op_build_list(self, data):
+        self.stack.append(self._pop_items(data))
+
+    def _op_build_set(self, data):
+        self.stack.append(set(self._pop_items(data)))
+
+    def _op_build_map(self, data):
+        items = self._pop_items(data * 2)
+        self.stack.append(dict(zip(items[0::2], items[1::2])))
+
+    def _op_build_const_key_map(self, data):
+        keys = self.stack.pop()
+        self.stack.append(dict(zip(keys, self._pop_items(data))))
+
+    def _op_build_tuple_unpack(self, data):
+        l = list()
+        for n in self._pop_items(data):
+            l.extend(n)
+        self.stack.append(tuple(l))
+
+    def _op_build_list_unpack(self, data):
+        l = list()
+        for n in self._pop_items(data):
+            l.extend(n)
+        self.stack.append(l)
+
+    def _op_build_map_unpack(self, data):
+        d = dict()
+        for n in self._pop_items(data):
+            d.update(n)
+        self.stack.append(d)
+
+    def _op_build_tuple_unpack_with_call(self, data):
+        self._op_build_tuple_unpack(data)
+
+    def _op_build_map_unpack_with_call(self, data):
+        # f(**a, **b) のキーワード引数、 重複したキーはエラーです。
+        d = dict()
+        for n in self._pop_items(data):
+            for key in n.keys():
+                if key in d:
+                    raise TypeError('got multiple values for keyword argument {!r}'.format(key))
+            d.update(n)
+        self.stack.append(d)
+
+    def _op_build_set_unpack(self, data):
+        s = set()
+        for n in self._pop_items(data):
+            s.update(n)
+        self.stack.append(s)
+
+    # IR opcodes of host bytecode newer than Python3.6, see rpvm.frontend
+
+    def _op_list_extend(self, data):
+        seq = self.stack.pop()
+        self.stack[-data].extend(seq)
+
+    def _op_set_update(self, data):
+        seq = self.stack.pop()
+        self.stack[-data].update(seq)
+
+    def _op_dict_update(self, data):
+        d = self.stack.pop()
+        self.stack[-data].update(d)
+
+    def _op_dict_merge(self, data):
+        # キーワード引数の ** 展開、重複したキーはエラーです。
+        d = self.stack.pop()
+        target = self.stack[-data]
+        for key in d.keys():
+            if key in target:
+                raise TypeError('got multiple values for keyword argument {!r}'.format(key))
+        target.update(d)
+
+    def _op_list_to_tuple(self, data):
+        self.stack[-1] = tuple(self.stack[-1])
+
+    def _op_copy(self, data):
+        self.stack.append(self.stack[-data])
+
+    def _op_swap(self, data):
+        stack = self.stack
+        stack[-1], stack[-data] = stack[-data], stack[-1]
+
+    def _op_compare_op(self, data):
+        right = self.stack.pop()
+        left = self.stack[-1]
+        if data == 0:
+            self.stack[-1] = left < right
+        elif data == 1:
+            self.stack[-1] = left <= right
+        elif data == 2:
+            self.stack[-1] = left == right
+        elif data == 3:
+            self.stack[-1] = left != right
+        elif data == 4:
+            self.stack[-1] = left > right
+        elif data == 5:
+            self.stack[-1] = left >= right
+        elif data == 6:
+            self.stack[-1] = left in right
+        elif data == 7:
+            self.stack[-1] = left not in right
+        elif data == 8:
+            self.stack[-1] = left is right
+        elif data == 9:
+            self.stack[-1] = left is not right
+        elif data == 10:
+            # except 節の型に一致するか調べます。
+            for cls in (right if isinstance(right, tuple) else (right,)):
+                if not (isinstance(cls, type) and issubclass(cls, BaseException)):
+                    raise TypeError('catching classes that do not inherit from BaseException is not allowed')
+            self.stack[-1] = issubclass(left, right)
+        else:
+            raise VirtualMachineError('not found cmp code {}'.format(data))
+
+    def _op_jump_forward(self, data):
+        self.pc = data
+
+    def _op_pop_jump_if_true(self, data):
+        if self.stack.pop():
+            self.pc = data
+
+    def _op_pop_jump_if_false(self, data):
+        if not self.stack.pop():
+            self.pc = data
+
+    def _op_jump_if_true_or_pop(self, data):
+        if self.stack[-1]:
+            self.pc = data
+        else:
+            self.stack.pop()
+
+    def _op_jump_if_false_or_pop(self, data):
+        if not self.stack[-1]:
+            self.pc = data
+        else:
+            self.stack.pop()
+
+    def _op_jump_absolute(self, data):
+        self.pc = data
+
+    def _op_raise_varargs(self, data):
+        if data == 0:
+            # 処理中の例外を再送出します。呼び出し元の except 節で処理中のものも探します。
+            if self.handling:
+                raise self.handling[-1][0]
+            for frame in reversed(self.frames):
+                if frame.handling:
+                    raise frame.handling[-1][0]
+            raise RuntimeError('No active exception to reraise')
+        elif data == 1:
+            raise self.stack.pop()
+        elif data == 2:
+            tos = self.stack.pop()
+            raise self.stack.pop() from tos
         else:
-            raise VirtualMachineError('not found op `{}`'.format(code))
-        return code, data
+            raise VirtualMachineError('not found argc {}'.format(data))
+
+    def _op_call_function(self, data):
+        args = self._pop_items(data)
+        if type(self.stack[-1]) is Function:
+            self._call(self.stack.pop(), args, None)
+            return True
+        self.stack[-1] = self.stack[-1](*args)
+
+    def _op_make_function(self, data):
+        # TOS は関数の修飾名、 TOS1 はコードオブジェクトです。
+        # data のフラグに応じて closure, annotations, kwdefaults, defaults の順にポップします。
+        qualname = self.stack.pop()
+        code = self.stack.pop()
+        if not isinstance(code, CodeType):
+            raise VirtualMachineError('MAKE_FUNCTION needs a code object')
+        if code.co_flags & UNSUPPORTED_FLAGS:
+            raise VirtualMachineError('generator and coroutine `{}` are not supported'.format(qualname))
+        closure = self.stack.pop() if data & 0x08 else None
+        annotations = self.stack.pop() if data & 0x04 else None
+        kwdefaults = self.stack.pop() if data & 0x02 else None
+        defaults = self.stack.pop() if data & 0x01 else None
+        self.stack.append(Function(code, qualname, defaults, kwdefaults, closure, annotations))
+
+    def _op_load_closure(self, index):
+        # セル自体をプッシュします。 MAKE_FUNCTION の closure になります。
+        self.stack.append(self.cells[index])
+
+    def _op_load_deref(self, index):
+        try:
+            self.stack.append(self.cells[index].contents)
+        except AttributeError:
+            raise self._unbound_deref(index)
+
+    def _op_store_deref(self, index):
+        self.cells[index].contents = self.stack.pop()
+
+    def _op_delete_deref(self, index):
+        try:
+            del self.cells[index].contents
+        except AttributeError:
+            raise self._unbound_deref(index)
+
+    def _deref_name(self, index) -> str:
+        return (self.code.co_cellvars + self.code.co_freevars)[index]
+
+    def _unbound_deref(self, index) -> NameError:
+        name = self._deref_name(index)
+        if index < len(self.code.co_cellvars):
+            return UnboundLocalError("local variable '{}' referenced before assignment".format(name))
+        return NameError("free variable '{}' referenced before assignment in enclosing scope".format(name))
+
+    def _op_build_slice(self, data):
+        if data == 2:
+            tos = self.stack.pop()
+            self.stack[-1] = slice(self.stack[-1], tos)
+        elif data == 3:
+            tos = self.stack.pop()
+            tos1 = self.stack.pop()
+            self.stack[-1] = slice(self.stack[-1], tos1, tos)
+        else:
+            raise VirtualMachineError('slice argc is 2 or 3 not {}'.format(data))
+
+    def _op_call_function_kw(self, data):
+        kwd_list = self.stack.pop()
+        args = self._pop_items(data)
+        size = len(args) - len(kwd_list)
+        kwds = dict(zip(kwd_list, args[size:]))
+        if type(self.stack[-1]) is Function:
+            self._call(self.stack.pop(), args[:size], kwds)
+            return True
+        self.stack[-1] = self.stack[-1](*args[:size], **kwds)
+
+    def _op_call_function_ex(self, data):
+        if data & 0x01:
+            kwds = self.stack.pop()
+        else:
+            kwds = dict()
+        args = self.stack.pop()
+        if type(self.stack[-1]) is Function:
+            self._call(self.stack.pop(), tuple(args), kwds)
+            return True
+        self.stack[-1] = self.stack[-1](*args, **kwds)
 
 
 class VirtualMachineError(Exception):
     pass
 
 
+class OutOfGasError(VirtualMachineError):
+    pass
+
+
+class ResourceLimitError(VirtualMachineError):
+    pass
+
+
+def _build_dispatch_table() -> list:
+    """opcode byte -> handler, unimplemented opcodes share one handler"""
+    import rpvm.opcodes
+    table = [VirtualMachine._op_not_found] * 256
+    for name, code in vars(rpvm.opcodes).items():
+        if not name.isupper() or name == 'HAVE_ARGUMENT':
+            continue
+        table[code] = getattr(VirtualMachine, '_op_' + name.lower(), VirtualMachine._op_not_supported)
+    return table
+
+
+dispatch_table = _build_dispatch_table()
+
+# opcodes having a handler, verified code uses only them
+SUPPORTED_OPS = frozenset(
+    code for code, handler in enumerate(dispatch_table)
+    if handler not in (VirtualMachine._op_not_supported, VirtualMachine._op_not_found))
+
+
 def compile_and_print(source, max_steps=500):
     from RestrictedPython import safe_builtins, safe_globals
     import dis
@@ -525,7 +1406,8 @@ def compile_and_print(source, max_steps=500):
     while not vm.finish and steps < max_steps:
         op, data = vm.exec()
         steps += 1
-        print("{:5} {:20} {:3} stack={} block_stack={}".format(steps, opname[op], data, vm.stack, vm.block_stack))
+        stack = [vm.peek(i) for i in range(len(vm.stack))]
+        print("{:5} {:20} {:3} stack={} handling={}".format(steps, opnames[op], data, stack, vm.handling))
 
     print("\n==== vm result ====")
     print("finish", vm.finish)
@@ -569,5 +1451,18 @@ k.append(g)
 __all__ = [
     "VirtualMachine",
     "VirtualMachineError",
+    "OutOfGasError",
+    "ResourceLimitError",
+    "VerifyError",
+    "SnapshotError",
+    "FINISHED",
+    "OUT_OF_STEPS",
+    "OUT_OF_TIME",
+    "OUT_OF_GAS",
+    "ERROR",
+    "INTERPRETER",
+    "BLOCKS",
+    "dispatch_table",
+    "SUPPORTED_OPS",
     "compile_and_print",
 ]
@@ -0,0 +1,52 @@
+from rpvm.vm import *
+from rpvm.artifact import ArtifactStore, ArtifactError, source_key, encode, decode
+from rpvm.decode import decode as decode_code
+from rpvm import verify
+import os
+
+SOURCE = """
+total = 0
+for i in range(10):
+    total += i
+"""
+
+
+def run(code):
+    l = {'range': range}
+    vm = VirtualMachine(code, {}, l, l, verify=True)
+    assert vm.run(1000)[1] == FINISHED
+    return l['total']
+
+
+def test_store(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    code = store.load(SOURCE)
+    assert store.compiled == 1 and SOURCE in store
+    assert store.load(SOURCE) is code and store.hits == 1
+    assert run(code) == 45
+    assert os.path.exists(os.path.join(str(tmp_path), source_key(SOURCE)[:2]))
+
+    # another process opens the same directory, loaded without compile
+    other = ArtifactStore(str(tmp_path))
+    program = other.program(SOURCE)
+    assert other.compiled == 0 and other.hits == 1
+    assert program.code == code and program.max_stack == verify.verify(code, SUPPORTED_OPS).max_stack
+    assert program.args == decode_code(code).args
+    assert run(program.code) == 45
+
+    try:
+        store.load("import os\n")
+        assert False
+    except VerifyError:
+        assert "import os\n" not in store
+
+
+def test_broken():
+    data = encode(decode_code(compile(SOURCE, '<example>', 'exec')))
+    assert decode(data).ops == decode_code(compile(SOURCE, '<example>', 'exec')).ops
+    for broken in (data[:10], b'XXXX' + data[4:], data[:-5]):
+        try:
+            decode(broken)
+            assert False
+        except ArtifactError:
+            pass
@@ -0,0 +1,71 @@
+from rpvm.vm import *
+from rpvm.decode import decode
+from rpvm.blocks import blocks, split_blocks
+
+SOURCE = """
+a = 0
+b = []
+for i in range(30):
+    if i % 3 == 0:
+        continue
+    a += i * 2
+    b.append(a)
+    if 50 < a:
+        break
+c = a + len(b)
+"""
+
+
+def execute(source, max_steps=10 ** 6, **kwargs):
+    code = compile(source, '<example>', 'exec')
+    l = dict()
+    vm = VirtualMachine(code, {'len': len, 'range': range}, l, dict(), **kwargs)
+    return vm, l, vm.run(max_steps)
+
+
+def test_split_blocks():
+    program = decode(compile(SOURCE, '<example>', 'exec'))
+    spans = split_blocks(program)
+    assert spans[0][0] == 0
+    for (_, end), (start, _) in zip(spans, spans[1:]):
+        assert end <= start
+    assert any(block is not None for block in blocks(program))
+
+
+def test_same_as_interpreter():
+    for optimize in (False, True):
+        vm1, l1, r1 = execute(SOURCE, optimize=optimize)
+        vm2, l2, r2 = execute(SOURCE, optimize=optimize, engine=BLOCKS)
+        assert r1 == r2 and r1[1] == FINISHED
+        assert l1 == l2
+        assert vm1.gas_used == vm2.gas_used
+
+
+def test_budget_inside_block():
+    for max_steps in range(1, 60):
+        vm1, l1, r1 = execute(SOURCE, max_steps)
+        vm2, l2, r2 = execute(SOURCE, max_steps, engine=BLOCKS)
+        assert r1 == r2 and l1 == l2 and vm1.pc == vm2.pc
+    for gas_limit in range(1, 60):
+        vm1, l1, r1 = execute(SOURCE, gas_limit=gas_limit)
+        vm2, l2, r2 = execute(SOURCE, gas_limit=gas_limit, engine=BLOCKS)
+        assert r1 == r2 and l1 == l2 and vm1.gas_used == vm2.gas_used
+
+
+def test_fault_inside_block():
+    source = "a = 1\nb = 2\nc = a - 'x'\nd = 3\n"
+    vm1, l1, r1 = execute(source)
+    vm2, l2, r2 = execute(source, engine=BLOCKS)
+    assert r1 == r2 and r1[1] == ERROR
+    assert type(vm1.error) == type(vm2.error)
+    assert vm1.pc == vm2.pc and vm1.gas_used == vm2.gas_used
+    assert l1 == l2 == {'a': 1, 'b': 2}
+
+
+def test_unknown_engine():
+    try:
+        execute("a = 1\n", engine='jit')
+    except ValueError:
+        pass
+    else:
+        assert False
@@ -0,0 +1,59 @@
+from rpvm.vm import *
+from rpvm.namespace import share_builtins
+from .utils import source_execute
+
+
+def test_cache_hits():
+    source = """
+a = []
+for i in range(100):
+    a.append(len(a))
+"""
+    code = compile(source, '<example>', 'exec')
+    vm = VirtualMachine(code, {'len': len, 'range': range}, dict(), dict())
+    assert vm.run(10000)[1] == FINISHED
+    assert vm.cache_hits >= 198  # len and a.append
+    assert vm.cache_misses <= 4
+
+
+def test_shadow_buildins():
+    source = """
+a = len([1, 2])
+len = abs
+b = len(-3)
+"""
+    source_execute(source, {'abs': abs})
+
+
+def test_store_global():
+    # function code loads and stores globals
+    source = """
+def f():
+    global x
+    for i in range(3):
+        x = x + i
+        y = x
+    del x
+    return y
+"""
+    code = compile(source, '<example>', 'exec').co_consts[0]
+    g = {'x': 10, 'range': range}
+    vm = VirtualMachine(code, dict(), dict(), g)
+    assert vm.run(1000)[1] == FINISHED
+    assert vm.return_value == 13 and 'x' not in g
+
+
+
+def test_shared_buildins():
+    shared = share_builtins({'len': len, 'range': range})
+    code = compile("a = len(range(3))\nb = abs(-1)\n", '<example>', 'exec')
+    vm = VirtualMachine(code, shared, dict(), dict())
+    vm.buildins['abs'] = abs
+    vm.buildins['len'] = lambda x: 10  # overlay is looked up first
+    assert vm.run(100)[1] == FINISHED
+    assert vm.locals == {'a': 10, 'b': 1}
+    assert 'abs' not in shared
+    # reset drops additions but keeps shared
+    vm.reset(code, dict(), dict())
+    assert vm.buildins == {} and vm.shared_buildins is shared
+    assert vm.run(100)[1] == ERROR
@@ -0,0 +1,58 @@
+from rpvm.vm import *
+from rpvm.decode import decode
+from rpvm.comprehension import fast_loops, FastLoop
+from .utils import source_execute
+import pytest
+
+SOURCE = """
+xs = list(range(50))
+a = [x * 2 for x in xs]
+b = {x % 3 for x in xs if x > 4}
+c = {k: v for k, v in zip(xs, a) if k % 2 if v}
+d = [x for x in xs if not x < 10]
+e = [10 // (x - 30) for x in xs]
+"""
+
+
+def run(code, quantum, gas_limit=None, profile=False):
+    g = {'list': list, 'range': range, 'zip': zip}
+    vm = VirtualMachine(code, {}, g, g, gas_limit=gas_limit)
+    if profile:
+        vm.profile()  # instructions are executed one by one
+    total = 0
+    status = OUT_OF_STEPS
+    while status == OUT_OF_STEPS:
+        steps, status = vm.run(quantum)
+        total += steps
+    g.pop('e', None)
+    return total, status, vm.gas_used, type(vm.error), g
+
+
+def test_fast_loops():
+    code = compile(SOURCE, '<example>', 'exec')
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            loops = fast_loops(decode(const))
+            assert isinstance(loops[2], FastLoop), const.co_name
+
+
+@pytest.mark.parametrize('quantum', [1, 3, 7, 10 ** 6])
+@pytest.mark.parametrize('gas_limit', [None, 500, 1001])
+def test_same_steps_and_gas(quantum, gas_limit):
+    code = compile(SOURCE, '<example>', 'exec')
+    result = run(code, quantum, gas_limit)
+    assert result == run(code, quantum, gas_limit, profile=True)
+    if gas_limit is None:
+        total, status, gas, error, g = result
+        assert status == ERROR and error is ZeroDivisionError
+        assert g['c'] == {k: 2 * k for k in range(1, 50, 2)}
+
+
+def test_comprehension():
+    source_execute("""
+xs = [(1, 'a'), (2, 'b'), (3, 'c')]
+a = [n for n, s in xs if n != 2]
+b = {s: n * n for n, s in xs}
+c = [[m for m in range(n)] for n, s in xs]
+del xs
+""", {'range': range})
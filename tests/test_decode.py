@@ -0,0 +1,31 @@
+from rpvm.decode import decode
+from rpvm.frontend import NATIVE
+from rpvm.opcodes import *
+from .utils import source_execute
+
+
+def test_shared_program():
+    code = compile("a = 1\nb = a + 2\n", '<example>', 'exec')
+    same = compile("a = 1\nb = a + 2\n", '<example>', 'exec')
+    assert decode(code) is decode(same)
+    program = decode(code)
+    if NATIVE:
+        assert len(program) == len(code.co_code) // 2
+    assert program.ops[0] == LOAD_CONST and program.args[0] == 1
+    assert program.ops[1] == STORE_NAME and program.args[1] == 'a'
+
+
+def test_jump_target():
+    code = compile("for i in range(3):\n    pass\n", '<example>', 'exec')
+    program = decode(code)
+    for op, arg in zip(program.ops, program.args):
+        if op == FOR_ITER or op == JUMP_ABSOLUTE or op == SETUP_LOOP:
+            assert 0 <= arg <= len(program)
+
+
+def test_extended_arg():
+    # jump over more than 256 bytes
+    source = "a = 0\nfor i in range(3):\n" + "    a += i\n" * 100
+    code = compile(source, '<example>', 'exec')
+    assert EXTENDED_ARG in decode(code).ops
+    source_execute(source)
@@ -0,0 +1,230 @@
+from rpvm.vm import *
+from rpvm.handlers import handler_table
+from rpvm.opcodes import *
+import pytest
+
+SOURCE = """
+log = []
+
+def div(a, b):
+    try:
+        return a // b
+    finally:
+        log.append(b)
+
+def first(items):
+    for item in items:
+        try:
+            if item is None:
+                continue
+            if item < 0:
+                break
+            return div(10, item)
+        except ZeroDivisionError as e:
+            log.append(str(e))
+        finally:
+            log.append('next')
+    return -1
+
+r = [first([None, 0, 5]), first([-1, 2]), first([])]
+try:
+    div(1, 0)
+except (KeyError, ZeroDivisionError):
+    r.append('caught')
+try:
+    try:
+        [][1]
+    except IndexError:
+        raise
+except LookupError as e:
+    r.append(type(e).__name__)
+else:
+    r.append('else')
+with Manager(log, True) as m:
+    r.append(m.name)
+    div(2, 0)
+for i in range(4):
+    with Manager(log, False):
+        if i == 1:
+            continue
+        if i == 3:
+            break
+r.append(i)
+try:
+    raise ValueError('x')
+except ValueError:
+    try:
+        div(3, 0)
+    except ZeroDivisionError:
+        pass
+    r.append(sum([len(x) for x in ['ab', 'c']]))
+"""
+
+
+class Manager(object):
+    def __init__(self, log, suppress):
+        self.log = log
+        self.suppress = suppress
+        self.name = 'manager'
+
+    def __enter__(self):
+        self.log.append('enter')
+        return self
+
+    def __exit__(self, exc_type, value, tb):
+        self.log.append(exc_type and exc_type.__name__)
+        return self.suppress
+
+
+def new_globals():
+    return {
+        'range': range, 'str': str, 'type': type, 'sum': sum, 'len': len, 'Manager': Manager,
+        'KeyError': KeyError, 'IndexError': IndexError, 'LookupError': LookupError,
+        'ValueError': ValueError, 'ZeroDivisionError': ZeroDivisionError}
+
+
+def run(code, quantum, gas_limit=None, profile=False, **kwargs):
+    g = new_globals()
+    vm = VirtualMachine(code, {}, g, g, gas_limit=gas_limit, **kwargs)
+    if profile:
+        vm.profile()
+    total = 0
+    status = OUT_OF_STEPS
+    while status == OUT_OF_STEPS:
+        steps, status = vm.run(quantum)
+        total += steps
+    assert not vm.handling
+    return total, status, vm.gas_used, g.get('r'), g['log']
+
+
+def test_same_as_python():
+    code = compile(SOURCE, '<example>', 'exec')
+    g = new_globals()
+    exec(code, g)
+    for engine in (INTERPRETER, BLOCKS):
+        total, status, gas, r, log = run(code, 10 ** 5, engine=engine, optimize=True, verify=True)
+        assert status == FINISHED
+        assert (r, log) == (g['r'], g['log'])
+
+
+@pytest.mark.parametrize('quantum', [1, 3, 10 ** 5])
+@pytest.mark.parametrize('gas_limit', [None, 300])
+def test_same_steps_and_gas(quantum, gas_limit):
+    code = compile(SOURCE, '<example>', 'exec')
+    result = run(code, quantum, gas_limit, profile=True)
+    assert result == run(code, quantum, gas_limit)
+    assert result == run(code, quantum, gas_limit, engine=BLOCKS, optimize=True)
+
+
+def test_handler_table():
+    code = compile("try:\n    a = 1\nexcept KeyError:\n    a = 2\n", '<example>', 'exec')
+    vm = VirtualMachine(code, {}, {}, {})
+    table = handler_table(vm.program)
+    assert vm.program.ops[0] == SETUP_EXCEPT and table[0] == ()
+    assert table[1] == ((SETUP_EXCEPT, vm.program.args[0], 0),)
+    assert vm.run(100)[1] == FINISHED and not vm.stack
+
+
+def test_snapshot_in_handler():
+    code = compile(SOURCE, '<example>', 'exec')
+    total, status, gas, r, log = run(code, 10 ** 5)
+    # in finally of div(), in an except clause called from it, in a with suppressing
+    for steps in (30, 55, 150, 185):
+        g = new_globals()
+        vm = VirtualMachine(code, {}, g, g)
+        assert vm.run(steps) == (steps, OUT_OF_STEPS)
+        data = vm.snapshot()
+        vm = VirtualMachine.restore(data, code, new_globals())
+        vm.globals.update(new_globals())
+        assert vm.run(10 ** 5) == (total - steps, FINISHED)
+        assert vm.globals['r'] == r
+
+
+def test_not_catchable():
+    code = compile("try:\n    x = [1] * 100\nexcept Exception:\n    x = 0\n", '<example>', 'exec')
+    vm = VirtualMachine(code, {'Exception': Exception}, {}, {}, gas_limit=5)
+    assert vm.run(100)[1] == OUT_OF_GAS
+    code = compile("try:\n    def f():\n        yield 1\nexcept:\n    pass\n", '<example>', 'exec')
+    vm = VirtualMachine(code, {}, {}, {})
+    assert vm.run(100)[1] == ERROR
+    assert type(vm.error) is VirtualMachineError
+    # raised out of the contract code
+    code = compile("try:\n    1 / 0\nexcept KeyError:\n    pass\n", '<example>', 'exec')
+    vm = VirtualMachine(code, {'KeyError': KeyError}, {}, {})
+    assert vm.run(100)[1] == ERROR
+    assert isinstance(vm.error, ZeroDivisionError)
+
+
+def test_exec():
+    code = compile("try:\n    1 / 0\nexcept ZeroDivisionError:\n    a = 1\n", '<example>', 'exec')
+    l = dict()
+    vm = VirtualMachine(code, {'ZeroDivisionError': ZeroDivisionError}, l, {})
+    while not vm.finish:
+        vm.exec()
+    assert l == {'a': 1}
+
+
+def test_reraise_in_callee():
+    source = """
+def reraise():
+    raise
+
+def fail(x):
+    try:
+        y = x
+        del x
+        return x
+    except UnboundLocalError:
+        reraise()
+
+r = []
+try:
+    try:
+        {}['k']
+    except KeyError:
+        reraise()
+except KeyError as e:
+    r.append(type(e).__name__)
+try:
+    fail(1)
+except NameError as e:
+    r.append(type(e).__name__)
+"""
+    code = compile(source, '<example>', 'exec')
+    g = {'KeyError': KeyError, 'NameError': NameError, 'UnboundLocalError': UnboundLocalError, 'type': type}
+    vm = VirtualMachine(code, {}, g, g)
+    assert vm.run(1000)[1] == FINISHED, vm.error
+    assert g['r'] == ['KeyError', 'UnboundLocalError'] and not vm.handling and not vm.frames
+
+
+def test_name_errors():
+    source = """
+r = []
+def read():
+    return undefined
+for f in (lambda: missing, read):
+    try:
+        f()
+    except NameError as e:
+        r.append(str(e))
+try:
+    del nothing
+except NameError as e:
+    r.append(str(e))
+try:
+    x = missing + 1
+except NameError as e:
+    r.append(str(e))
+try:
+    if missing < 1:
+        pass
+except NameError as e:
+    r.append(str(e))
+"""
+    code = compile(source, '<example>', 'exec')
+    for optimize in (False, True):
+        g = {'NameError': NameError, 'str': str}
+        vm = VirtualMachine(code, {}, g, g, optimize=optimize)
+        assert vm.run(1000)[1] == FINISHED, vm.error
+        assert g['r'] == ["name '{}' is not defined".format(name)
+                          for name in ('missing', 'undefined', 'nothing', 'missing', 'missing')]
@@ -0,0 +1,156 @@
+from rpvm.vm import *
+from rpvm.decode import decode
+from rpvm.frontend import translate, NATIVE, HOST_VERSION, FrontendError
+from rpvm.opcodes import *
+from .utils import source_execute
+import dis
+
+# straight-line code, same IR on every host
+SOURCE = """
+a = [1, 2, 3]
+b = {4, 5}
+c = sorted(a, reverse=True)
+d = c.index(3)
+e = a is None
+f = 2 in a
+g = {'x': 1, 'y': d}
+g['x'] += 5
+if e is not None:
+    h = 1
+if e is None:
+    h = 2
+i, j = j, i = 1, 2
+k = a[1:2]
+del g['y']
+assert d == 0
+"""
+
+
+def test_stable_steps():
+    code = compile(SOURCE, '<example>', 'exec')
+    program = decode(code)
+    assert list(program.ops[:4]) == [LOAD_CONST, LOAD_CONST, LOAD_CONST, BUILD_LIST]
+    assert (COMPARE_OP, 8) in zip(program.ops, program.args)
+    assert CALL_FUNCTION_KW in program.ops and DUP_TOP_TWO in program.ops and ROT_THREE in program.ops
+    l = {'sorted': sorted, 'AssertionError': AssertionError}
+    vm = VirtualMachine(code, {}, l, l, verify=True)
+    # steps and gas counted on Python3.6
+    assert vm.run(1000) == (74, FINISHED)
+    assert vm.gas_used == 104
+    assert l['g'] == {'x': 6} and l['h'] == 1
+
+
+def test_native():
+    # on Python3.6 the front-end writes the host bytecode as is
+    code = compile(SOURCE + "for n in range(3):\n    if n: break\n", '<example>', 'exec')
+    ops, opargs, args, offsets = translate(code)
+    if NATIVE:
+        assert ops == code.co_code[0::2]
+        assert (opargs, args) == (decode(code).opargs, decode(code).args)
+    assert len(offsets) == len(ops)
+    assert set(offsets) <= set(instr.offset for instr in dis.get_instructions(code))
+
+
+def test_unpack():
+    # IR opcodes on Python3.9+, BUILD_*_UNPACK on Python3.6
+    source = """
+a = [1, 2]
+b = [*a, 3, *a]
+c = (*a, *b)
+d = {*a, 5}
+e = {'x': 1}
+f = {**e, 'y': 2}
+g = dict(**f, z=3)
+"""
+    # a long display is built by LIST_APPEND and SET_ADD on Python3.11
+    source += "h = [" + ", ".join("a[0] + {}".format(i) for i in range(40)) + "]\n"
+    source += "k = {" + ", ".join("a[1] * {}".format(i) for i in range(40)) + "}\n"
+    source_execute(source, {'dict': dict})
+
+
+
+def test_unpack_steps():
+    # displays with * and ** and starred arguments, same IR on every host
+    source = """
+a = [1, 2]
+b = [*a, 3, *a]
+c = (*a, *b)
+d = {*a, 5}
+e = {'x': 1}
+f = {**e, 'y': 2}
+g = dict(**f, z=3)
+m = [*a, *b]
+n = sorted(*[a], **{'reverse': True, **{}})
+"""
+    code = compile(source, '<example>', 'exec')
+    program = decode(code)
+    assert not set(program.ops) & {LIST_EXTEND, SET_UPDATE, DICT_UPDATE, DICT_MERGE, LIST_TO_TUPLE}
+    l = {'dict': dict, 'sorted': sorted}
+    vm = VirtualMachine(code, {}, l, l, verify=True)
+    # steps and gas counted on Python3.6
+    assert vm.run(1000) == (53, FINISHED)
+    assert vm.gas_used == 113
+    assert l['m'] == [1, 2, 1, 2, 3, 1, 2] and l['n'] == [2, 1]
+    # a long display is one BUILD_LIST on every host
+    code = compile("h = [" + ", ".join("a[0] + {}".format(i) for i in range(40)) + "]\n", '<example>', 'exec')
+    assert list(decode(code).ops).count(BUILD_LIST) == 1
+
+
+def test_handlers_host():
+    # try, except, finally and with have their blocks of Python3.6 on every host
+    code = compile("try:\n    a = 1\nexcept KeyError:\n    a = 2\n", '<example>', 'exec')
+    assert SETUP_EXCEPT in decode(code).ops
+    code = compile("with m:\n    pass\n", '<example>', 'exec')
+    ops = decode(code).ops
+    assert SETUP_WITH in ops and WITH_CLEANUP_START in ops
+
+
+# loops, conditions, try and with, same IR on every host
+CONTROL = """
+t = 0
+for i in range(6):
+    if i == 4:
+        break
+    t += i
+n = 0
+while n < 3 and t > 0:
+    n += 1
+for i in range(2):
+    t -= i
+else:
+    t += 1
+try:
+    t += 1
+    raise KeyError(t)
+except KeyError as e:
+    t += 2
+finally:
+    t += 3
+try:
+    n = t
+finally:
+    n += 1
+with m:
+    t += 4
+a = 1
+"""
+
+
+class Manager(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, tb):
+        return False
+
+
+def test_control_steps():
+    code = compile(CONTROL, '<example>', 'exec')
+    program = decode(code)
+    assert SETUP_LOOP in program.ops and SETUP_FINALLY in program.ops and BREAK_LOOP in program.ops
+    l = {'range': range, 'KeyError': KeyError, 'm': Manager()}
+    vm = VirtualMachine(code, {}, l, l, verify=True)
+    # steps and gas counted on Python3.6
+    assert vm.run(1000) == (193, FINISHED)
+    assert vm.gas_used == 226
+    assert (l['t'], l['n'], l['a']) == (16, 13, 1)
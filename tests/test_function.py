@@ -0,0 +1,101 @@
+from rpvm.vm import *
+from rpvm.limits import Limits
+from rpvm.frame import Function
+import pytest
+
+SOURCE = """
+def add(a, b=2, *rest, c=3, **kw):
+    return a + b + c + sum(rest) + len(kw)
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+def counter():
+    total = 0
+    def inc(x):
+        nonlocal total
+        total += x
+        return total
+    return inc
+
+inc = counter()
+inc(3)
+r = [add(1), add(1, 1, 1, 1, c=0, z=1), fib(10), inc(4), add(*(1, 2), **{'c': 5})]
+f = lambda x: x * 2
+r.append(f(21))
+"""
+
+
+BUILTINS = {'sum': sum, 'len': len}
+
+
+def new_vm(code, **kwargs):
+    g = dict(BUILTINS)
+    return VirtualMachine(code, {}, g, g, **kwargs), g
+
+
+@pytest.mark.parametrize('engine', [INTERPRETER, BLOCKS])
+def test_call(engine):
+    code = compile(SOURCE, '<example>', 'exec')
+    vm, g = new_vm(code, engine=engine, optimize=True, verify=True)
+    steps, status = vm.run(10 ** 5)
+    assert status == FINISHED, vm.error
+    assert g['r'] == [6, 5, 55, 7, 8, 42]
+    assert isinstance(g['fib'], Function)
+    # frames of fib() are reused, one per depth
+    assert not vm.frames and len(vm._free_frames) == 10
+    vm2, _ = new_vm(code)
+    assert vm2.run(10 ** 5) == (steps, FINISHED)
+    assert vm2.gas_used == vm.gas_used
+
+
+def test_snapshot_in_call():
+    code = compile(SOURCE, '<example>', 'exec')
+    vm, g = new_vm(code)
+    total, status = vm.run(10 ** 5)
+    vm, g = new_vm(code)
+    steps, _ = vm.run(500)
+    assert vm.frames
+    data = vm.snapshot()
+    vm = VirtualMachine.restore(data, code, BUILTINS)
+    assert len(vm.frames) == len(VirtualMachine.restore(data, code, BUILTINS).frames)
+    g = vm.globals
+    assert vm.run(10 ** 5) == (total - steps, FINISHED)
+    assert g['r'] == [6, 5, 55, 7, 8, 42]
+
+
+def test_snapshot_every_step():
+    # code objects of def and lambda are on the stack before MAKE_FUNCTION
+    code = compile(SOURCE, '<example>', 'exec')
+    vm, g = new_vm(code)
+    total, status = vm.run(10 ** 5)
+    vm, g = new_vm(code)
+    steps = 0
+    while not vm.finish:
+        steps += vm.run(1)[0]
+        vm = VirtualMachine.restore(vm.snapshot(), code, BUILTINS)
+    assert steps == total and vm.error is None
+    assert vm.globals['r'] == [6, 5, 55, 7, 8, 42]
+
+
+def test_recursion_limit():
+    code = compile("def f(n):\n    return f(n + 1)\nf(0)\n", '<example>', 'exec')
+    vm, g = new_vm(code, limits=Limits(max_depth=50))
+    assert vm.run(10 ** 5)[1] == ERROR
+    assert isinstance(vm.error, ResourceLimitError)
+    assert len(vm.frames) == 50
+
+
+def test_arguments():
+    code = compile("def f(a, *, b):\n    return a\nf(1)\n", '<example>', 'exec')
+    vm, g = new_vm(code)
+    assert vm.run(100)[1] == ERROR
+    assert isinstance(vm.error, TypeError) and not vm.frames
+    # builtins cannot call a function of the VM
+    code = compile("def f(a):\n    return a\nr = sorted([2, 1], key=f)\n", '<example>', 'exec')
+    vm, g = new_vm(code)
+    g['sorted'] = sorted
+    assert vm.run(100)[1] == ERROR
+    assert isinstance(vm.error, TypeError)
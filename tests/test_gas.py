@@ -0,0 +1,114 @@
+from rpvm.vm import *
+from rpvm.gas import GasSchedule
+from rpvm.limits import Limits
+from rpvm.opcodes import *
+
+
+def execute(source, **kwargs):
+    code = compile(source, '<example>', 'exec')
+    l = dict()
+    vm = VirtualMachine(code, {'len': len, 'range': range}, l, dict(), **kwargs)
+    return vm, l, vm.run(10 ** 6)
+
+
+def test_gas_used():
+    vm, l, (steps, status) = execute("a = 1\nb = a + 2\n")
+    assert status == FINISHED
+    assert vm.gas_used == steps  # all static cost is 1
+
+
+def test_dynamic_cost():
+    small, _, _ = execute("a = 3\nb = a ** 2\n")
+    big, _, _ = execute("a = 3\nb = a ** 10000\n")
+    assert big.gas_used - small.gas_used > 10000 // 64 - 2
+    seq, _, _ = execute("a = [0] * 1000\n")
+    assert seq.gas_used > 1000
+
+
+def test_out_of_gas():
+    vm, l, (steps, status) = execute("a = 3\nb = a ** 30000\n", gas_limit=100)
+    assert status == OUT_OF_GAS
+    assert isinstance(vm.error, OutOfGasError)
+    assert 'b' not in l  # stopped before BINARY_POWER
+    assert vm.gas_used <= 100
+    assert vm.run(10) == (0, OUT_OF_GAS)
+
+
+def test_exec_same_as_run():
+    source = "a = 0\nfor i in range(10):\n    a += len([i, i]) * 3\n"
+    vm1, _, _ = execute(source)
+    code = compile(source, '<example>', 'exec')
+    vm2 = VirtualMachine(code, {'len': len, 'range': range}, dict(), dict())
+    while not vm2.finish:
+        vm2.exec()
+    assert vm1.gas_used == vm2.gas_used
+
+
+def test_schedule():
+    schedule = GasSchedule(base={BINARY_ADD: 5}, call_costs={len: 0}, call_cost=100)
+    vm1, _, _ = execute("a = len([1]) + 1\n", schedule=schedule)
+    vm2, _, _ = execute("a = range(1)\n", schedule=schedule)
+    # 6 static ops, BUILD_LIST 1+1, CALL_FUNCTION 1+0+1, BINARY_ADD 5
+    assert vm1.gas_used == 6 + 2 + 2 + 5
+    # 5 static ops, CALL_FUNCTION 1+100+1
+    assert vm2.gas_used == 5 + 102
+
+
+def test_resource_limit():
+    for source in ("a = 3\nb = a ** 10000000\n", "a = 1\na <<= 10 ** 9\n", "a = 'ab' * 10 ** 8\n"):
+        vm, l, (steps, status) = execute(source)
+        assert status == ERROR and isinstance(vm.error, ResourceLimitError)
+        assert vm.gas_used < 100
+    limits = Limits(max_int_bits=1024, max_items=10)
+    vm, l, (steps, status) = execute("a = 3\na **= 2000\n", limits=limits)
+    assert isinstance(vm.error, ResourceLimitError)
+    vm, l, (steps, status) = execute("a = [0] * 11\n", limits=limits)
+    assert isinstance(vm.error, ResourceLimitError)
+    vm, l, (steps, status) = execute("a = [0]\nb = [*a, *a, *a, *a, *a, *a]\nc = [*b, *b]\n", limits=limits)
+    assert isinstance(vm.error, ResourceLimitError) and 'c' not in l and len(l['b']) == 6
+    for optimize in (False, True):
+        vm, l, (steps, status) = execute("a = [0]\nfor i in range(8):\n    a = a + a\n",
+                                         limits=limits, optimize=optimize)
+        assert isinstance(vm.error, ResourceLimitError) and len(l['a']) == 8
+    vm, l, (steps, status) = execute("a = 'ab'\nfor i in range(8):\n    a += a\n", limits=limits)
+    assert isinstance(vm.error, ResourceLimitError) and len(l['a']) == 8
+    vm, l, (steps, status) = execute("b = [[0] + [0] * i for i in range(20)]\n", limits=limits)
+    assert isinstance(vm.error, ResourceLimitError) and 'b' not in l
+
+
+def test_power_bits():
+    vm, l, (steps, status) = execute("a = 2 ** 40000\nb = 2\nb **= 65535\n")
+    assert status == FINISHED and l['a'] == 1 << 40000 and l['b'] == 1 << 65535
+    vm, l, (steps, status) = execute("b = 2\nb **= 65536\n")
+    assert isinstance(vm.error, ResourceLimitError)
+
+
+def test_builtin_pow():
+    def call(source):
+        code = compile(source, '<example>', 'exec')
+        l = dict()
+        vm = VirtualMachine(code, {'pow': pow}, l, dict())
+        vm.run(100)
+        return vm, l
+    vm, l = call("a = pow(7, 30)\nb = pow(7, 3000000)\n")
+    assert isinstance(vm.error, ResourceLimitError) and l['a'] == 7 ** 30 and 'b' not in l
+    vm, l = call("a = pow(*(7, 3000000))\n")
+    assert isinstance(vm.error, ResourceLimitError)
+    vm, l = call("a = pow(7, 3000000, 10)\n")
+    assert vm.error is None and l['a'] == pow(7, 3000000, 10)
+    small, _ = call("a = pow(2, 64)\n")
+    big, _ = call("a = pow(2, 64000)\n")
+    assert big.gas_used - small.gas_used >= 64000 // 64 - 1
+
+
+def test_format_width():
+    for source in ("a = '%0300000000d' % 1\n", "a = '%.300000000f' % 1.0\n",
+                   "a = b'%300000000s' % (b'x',)\n", "a = '%s%*d' % ('x', 300000000, 1)\n",
+                   "a = '%%%0300000000d'\na %= 1\n"):
+        vm, l, (steps, status) = execute(source)
+        assert isinstance(vm.error, ResourceLimitError), source
+        assert 'a' not in l or isinstance(l['a'], str) and len(l['a']) < 100
+    vm, l, (steps, status) = execute("a = '%5d|%-3s|%.2f|%%' % (1, 'x', 0.5)\n")
+    assert l['a'] == '    1|x  |0.50|%'
+    vm, l, (steps, status) = execute("a = 10\nb = a % 3\n")
+    assert l['b'] == 1
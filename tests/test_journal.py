@@ -0,0 +1,100 @@
+from rpvm.vm import *
+from rpvm.journal import Journal, JournaledDict, JournalError
+
+SOURCE = """
+a = 1
+d['x'] = 2
+del d['y']
+l[0] = 9
+l[1:] = []
+b = a + 1
+"""
+
+
+def namespaces():
+    journal = Journal()
+    g = JournaledDict({'d': {'y': 1}, 'l': [1, 2, 3]}, journal)
+    l = JournaledDict({'a': 0}, journal)
+    return journal, l, g
+
+
+def test_rollback():
+    journal, _, g = namespaces()
+    code = compile(SOURCE, '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), g, g)
+    assert vm.journal is journal
+    assert vm.run(100)[1] == FINISHED
+    assert g == {'a': 1, 'b': 2, 'd': {'x': 2}, 'l': [9]}
+    assert len(journal) == 6 + 2  # and contents of d and l when read
+    journal.rollback()
+    assert g == {'d': {'y': 1}, 'l': [1, 2, 3]}
+    assert len(journal) == 0
+
+
+def test_savepoint():
+    journal, l, g = namespaces()
+    l['a'] = 1
+    outer = journal.savepoint()
+    l['b'] = 2
+    inner = journal.savepoint()
+    g['d']['y'] = 3  # not journaled, modified without the VM
+    del l['a']
+    journal.rollback(inner)
+    assert l == {'a': 1, 'b': 2}
+    journal.release(outer)
+    journal.rollback()
+    assert l == {'a': 0}
+    try:
+        journal.rollback(inner)
+    except JournalError:
+        pass
+    else:
+        assert False
+
+
+def test_failed_contract():
+    journal, l, g = namespaces()
+    code = compile("a = 5\nd['z'] = 1\nc = a + 'x'\n", '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), g, g)
+    assert vm.run(100)[1] == ERROR
+    assert g['a'] == 5 and g['d'] == {'y': 1, 'z': 1}
+    journal.rollback()
+    assert g == {'d': {'y': 1}, 'l': [1, 2, 3]}
+    # commit keeps changes
+    l['a'] = 7
+    journal.commit()
+    journal.rollback()
+    assert l == {'a': 7}
+
+
+def test_mutable_values():
+    source = "x += [3]\ny.append(4)\nz = y\nz.append(5)\nw['k'].add(1)\n"
+    journal = Journal()
+    g = JournaledDict({'x': [1, 2], 'y': [], 'w': {'k': set()}}, journal)
+    vm = VirtualMachine(compile(source, '<example>', 'exec'), dict(), g, g)
+    assert vm.run(100)[1] == FINISHED
+    assert g['x'] == [1, 2, 3] and g['y'] == [4, 5] and g['w'] == {'k': {1}}
+    journal.rollback()
+    assert g == {'x': [1, 2], 'y': [], 'w': {'k': set()}}
+    # rollback to a savepoint keeps the earlier change
+    g['y'].append(1)
+    savepoint = journal.savepoint()
+    g['y'].append(2)
+    journal.rollback(savepoint)
+    assert g['y'] == [1]
+
+
+def test_cached_global():
+    # LOAD_GLOBAL of `add` hits its cache after the commit
+    source = "def add(n):\n    items.append(n)\nfor i in range(6):\n    add(i)\n"
+    journal = Journal()
+    g = JournaledDict({'items': []}, journal)
+    vm = VirtualMachine(compile(source, '<example>', 'exec'), {'range': range}, dict(), g)
+    items = g['items']
+    while len(items) < 2:
+        vm.run(1)
+    committed = list(items)
+    journal.commit()
+    assert vm.run(1000)[1] == FINISHED and items == list(range(6))
+    journal.rollback()
+    assert items == committed
@@ -0,0 +1,34 @@
+from rpvm.vm import *
+
+
+SOURCE = """
+def f(a, b):
+    c = a + b
+    d = [c] * 2
+    del a
+    for i in range(b):
+        c += i
+    return c + g
+"""
+
+
+def function_code(source):
+    return compile(source, '<example>', 'exec').co_consts[0]
+
+
+def test_fast_locals():
+    code = function_code(SOURCE)
+    l = {'a': 1, 'b': 3}
+    vm = VirtualMachine(code, dict(), l, {'g': 100, 'range': range})
+    assert vm.run(1000) == (vm.steps, FINISHED)
+    assert vm.return_value == 1 + 3 + 0 + 1 + 2 + 100
+    assert vm.fastlocals[code.co_varnames.index('c')] == 7
+    assert vm.locals is l
+    assert l == {'b': 3, 'c': 7, 'd': [4, 4], 'i': 2}
+
+
+def test_unbound_local():
+    code = function_code("def f(a):\n    return b\n    b = 1\n")
+    vm = VirtualMachine(code, dict(), {'a': 1}, dict())
+    steps, status = vm.run(100)
+    assert status == ERROR and isinstance(vm.error, UnboundLocalError)
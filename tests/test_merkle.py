@@ -0,0 +1,99 @@
+from rpvm.vm import *
+from rpvm.merkle import MerkleDict, MerkleTree, state_root, EMPTY_ROOT
+from rpvm.storage import dumps
+import subprocess
+import random
+import sys
+import os
+
+
+def test_tree_canonical():
+    keys = ['k{}'.format(i) for i in range(300)]
+    tree = MerkleTree()
+    for key in keys:
+        tree.set(key, key.encode())
+    roots = {tree.root()}
+    # same entries in another order, with deleted ones
+    random.seed(1)
+    random.shuffle(keys)
+    other = MerkleTree()
+    for key in keys + ['x{}'.format(i) for i in range(50)]:
+        other.set(key, key.encode())
+    for i in range(50):
+        other.delete('x{}'.format(i))
+    roots.add(other.root())
+    assert len(roots) == 1 and len(other) == 300
+    for key in keys:
+        other.delete(key)
+    assert other.root() == EMPTY_ROOT and len(other) == 0
+
+
+def test_incremental():
+    g = MerkleDict({'k{}'.format(i): i for i in range(500)})
+    g['items'] = [1, 2]
+    assert g.root() == state_root(g)
+    code = compile("a = k1 + k2\nitems.append(a)\ndel k3\n", '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), g, g)
+    assert vm.run(100)[1] == FINISHED
+    root = g.root()
+    assert root == state_root(g)
+    assert g['items'] == [1, 2, 3] and 'k3' not in g
+    # nothing changed
+    assert g.root() == root
+    g['k3'] = 3
+    del g['a']
+    g['items'].pop()
+    expected = {'k{}'.format(i): i for i in range(500)}
+    expected['items'] = [1, 2]
+    assert g.root() == state_root(expected)
+
+
+def test_hashed_once(monkeypatch):
+    g = MerkleDict({'k{}'.format(i): i for i in range(100)})
+    g['items'] = [0]
+    g.root()
+    count = [0]
+
+    def counted(value):
+        count[0] += 1
+        return dumps(value)
+    monkeypatch.setattr('rpvm.merkle.dumps', counted)
+    code = compile("items.append(0)\nk2 = 3\n", '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), g, g)
+    assert vm.run(100)[1] == FINISHED
+    assert g.root() == state_root(g)
+    assert count[0] == 2 + 101  # items and k2, then state_root()
+    count[0] = 0
+    g.root()
+    assert count[0] == 1  # only the mutable value is encoded again
+
+
+def test_aliasing():
+    g = MerkleDict()
+    code = compile("a = []\nb = a\nb.append(1)\nc = {'x': a}\n", '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), g, g)
+    assert vm.run(100)[1] == FINISHED
+    assert g.root() == state_root(g)
+    g['c']['x'].append(2)
+    assert g['a'] == [1, 2] and g.root() == state_root(g)
+
+
+def test_sliced_run():
+    # LOAD_GLOBAL of the function hits its cache without reading the namespace again
+    source = "global items\nitems = []\ndef add(n):\n    for i in range(n):\n        items.append(i)\nadd(20)\n"
+    g = MerkleDict()
+    vm = VirtualMachine(compile(source, '<example>', 'exec'), {'range': range}, dict(), g)
+    while not vm.finish:
+        vm.run(7)
+        assert g.root() == state_root(g)
+    assert g['items'] == list(range(20))
+
+
+def test_same_root_on_hash_seeds():
+    script = ("from rpvm.merkle import state_root\n"
+              "print(state_root({'s': {'a', 'b', 'c', 'd'}, 'f': frozenset('xyz'), 'd': {'y': 1, 'x': 2}}).hex())")
+    roots = set()
+    for seed in ('0', '1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=os.pathsep.join(sys.path))
+        roots.add(subprocess.check_output([sys.executable, '-c', script], env=env))
+    assert len(roots) == 1
@@ -0,0 +1,93 @@
+from rpvm.vm import *
+from rpvm.decode import decode
+from rpvm.optimizer import optimize
+from rpvm.opcodes import *
+from rpvm.frontend import NATIVE
+from types import CodeType
+import pytest
+
+SOURCE = """
+a = 0
+b = 0
+while a < 50:
+    a += 1
+    b = b + 3
+    c = (1, 2, a)
+"""
+
+
+def execute(source, max_steps=10 ** 6, **kwargs):
+    code = compile(source, '<example>', 'exec')
+    l = dict()
+    vm = VirtualMachine(code, {'len': len}, l, dict(), **kwargs)
+    return vm, l, vm.run(max_steps)
+
+
+def tuple_code():
+    """`a = (1, 2, 3)` without folded by CPython"""
+    if not NATIVE:
+        pytest.skip('hand-written Python3.6 bytecode')
+    co = compile("a = 0\n", '<example>', 'exec')
+    co_code = bytes([
+        LOAD_CONST, 1, LOAD_CONST, 2, LOAD_CONST, 3, BUILD_TUPLE, 3,
+        STORE_NAME, 0, LOAD_CONST, 0, RETURN_VALUE, 0])
+    return CodeType(
+        co.co_argcount, co.co_kwonlyargcount, co.co_nlocals, 3, co.co_flags,
+        co_code, (None, 1, 2, 3), ('a',), co.co_varnames, co.co_filename,
+        co.co_name, co.co_firstlineno, co.co_lnotab, co.co_freevars, co.co_cellvars)
+
+
+def test_superinstructions():
+    program = optimize(decode(compile(SOURCE, '<example>', 'exec')))
+    assert NAME_CONST_BINARY_STORE in program.ops
+    assert NAME_CONST_COMPARE_JUMP in program.ops
+    assert len(program) == len(program.base_ops)
+    program = optimize(decode(tuple_code()))
+    assert program.ops[0] == CONST_TUPLE
+    assert program.args[0] == (1, 2, 3)
+    assert program.widths[0] == 4
+
+
+def test_const_tuple():
+    for max_steps in (2, 4, 100):
+        results = list()
+        for flag in (False, True):
+            l = dict()
+            vm = VirtualMachine(tuple_code(), dict(), l, dict(), optimize=flag)
+            results.append((vm.run(max_steps), l, vm.gas_used, vm.pc))
+        assert results[0] == results[1]
+    assert results[0][1] == {'a': (1, 2, 3)}
+
+
+def test_same_result():
+    vm1, l1, r1 = execute(SOURCE)
+    vm2, l2, r2 = execute(SOURCE, optimize=True)
+    assert r1 == r2
+    assert r1[1] == FINISHED
+    assert l1 == l2
+    assert vm1.gas_used == vm2.gas_used
+
+
+def test_budget_inside_superinstruction():
+    _, _, (total, _) = execute(SOURCE)
+    for max_steps in range(1, 40):
+        vm1, l1, r1 = execute(SOURCE, max_steps)
+        vm2, l2, r2 = execute(SOURCE, max_steps, optimize=True)
+        assert r1 == r2 and l1 == l2
+        assert vm1.pc == vm2.pc
+    for gas_limit in range(1, 40):
+        vm1, l1, r1 = execute(SOURCE, gas_limit=gas_limit)
+        vm2, l2, r2 = execute(SOURCE, gas_limit=gas_limit, optimize=True)
+        assert r1 == r2 and l1 == l2
+        assert vm1.gas_used == vm2.gas_used
+
+
+def test_fault_inside_superinstruction():
+    for source in ("a = 1\nb = a - 'x'\n", "b = x + 1\n", "a = 1\nif a < 'x':\n    b = 1\n"):
+        vm1, l1, r1 = execute(source)
+        vm2, l2, r2 = execute(source, optimize=True)
+        assert r1 == r2
+        assert r1[1] == ERROR
+        assert type(vm1.error) == type(vm2.error)
+        assert vm1.pc == vm2.pc
+        assert vm1.gas_used == vm2.gas_used
@@ -0,0 +1,64 @@
+from rpvm.vm import *
+from rpvm.parallel import ParallelExecutor, Task, waves
+
+DEPOSIT = compile("""
+balance = balance + amount
+count += 1
+""", '<example>', 'exec')
+
+CLOSE = compile("del balance\n", '<example>', 'exec')
+RESET = compile("del x\n", '<example>', 'exec')
+
+
+def test_waves():
+    tasks = [Task(DEPOSIT, keys=['a']), Task(DEPOSIT, keys=['b']), Task(DEPOSIT, keys=['a']),
+             Task(DEPOSIT), Task(DEPOSIT, keys=['c'])]
+    assert waves(tasks) == [[0, 1], [2], [3], [4]]
+
+
+def test_executor():
+    state = {'balance': 0, 'count': 0}
+    tasks = [Task(DEPOSIT, {'amount': i}, keys=['balance', 'count']) for i in range(10)]
+    tasks.append(Task(DEPOSIT, {'amount': 'x'}, keys=['balance', 'count']))  # fails
+    tasks.append(Task(DEPOSIT, {'amount': 1}, keys=['balance', 'count'], max_steps=3))
+    with ParallelExecutor(state, {}, processes=2) as executor:
+        results = list(executor.run(tasks))
+        assert [r.index for r in results] == list(range(12))
+        assert all(r.status == FINISHED and r.steps == 10 for r in results[:10])
+        assert results[10].status == ERROR and 'TypeError' in results[10].error
+        assert results[11].status == OUT_OF_STEPS and results[11].steps == 3
+        assert state == {'balance': 45, 'count': 10}
+        # disjoint keys, independent states
+        state.update({'x': 0, 'y': 0})
+        results = list(executor.run([Task(CLOSE, keys=['balance']), Task(RESET, keys=['x'])]))
+        assert [r.status for r in results] == [FINISHED, FINISHED]
+        assert state == {'count': 10, 'y': 0}
+
+
+def test_code_sent_once():
+    def blocking(*args, **kwargs):
+        raise AssertionError('serial fallback')
+    state = {'balance': 0, 'count': 0}
+    with ParallelExecutor(state, {}, processes=2) as executor:
+        executor._pool.apply = blocking
+        tasks = [Task(DEPOSIT, {'amount': 1}, keys=['balance', 'count']) for _ in range(6)]
+        # disjoint tasks run at once on both workers
+        tasks += [Task(DEPOSIT, {'amount': 1, 'balance': 0, 'count': 0}, keys=[]) for _ in range(8)]
+        results = list(executor.run(tasks))
+        assert all(r.status == FINISHED for r in results)
+        assert all(r.written == {} for r in results[6:])
+        assert list(executor._sent) == [executor._marshal(DEPOSIT)[0]]
+        assert state == {'balance': 6, 'count': 6}
+
+
+def test_write_back_changed():
+    state = {'balance': 0, 'count': 0, 'x': [1]}
+    with ParallelExecutor(state, {}, processes=2) as executor:
+        results = list(executor.run([Task(DEPOSIT, {'amount': 2}), Task(RESET)]))
+        assert results[0].written == {'balance': 2, 'count': 1}
+        assert results[1].written == {} and results[1].deleted == ['x']
+        assert state == {'balance': 2, 'count': 1}
+        # an input modified in place is written, not given as is
+        results = list(executor.run([Task(compile("x.append(count)\n", '<example>', 'exec'), {'x': [0]})]))
+        assert results[0].written == {'x': [0, 1]}
+        assert state == {'balance': 2, 'count': 1, 'x': [0, 1]}
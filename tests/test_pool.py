@@ -0,0 +1,72 @@
+from rpvm.vm import *
+from rpvm.pool import VMPool
+from threading import Thread
+
+SOURCE = """
+a = x * 2
+b = [a, a + 1]
+c = len(b)
+"""
+
+
+def test_reset():
+    code = compile(SOURCE, '<example>', 'exec')
+    l = {'x': 1}
+    vm = VirtualMachine(code, {'len': len}, l, dict(), gas_limit=100)
+    assert vm.run(100)[1] == FINISHED
+    stack = vm.stack
+    l = {'x': 5}
+    vm.reset(code, l, dict())
+    assert (vm.pc, vm.steps, vm.gas_used, vm.finish) == (0, 0, 0, False)
+    assert vm.run(100)[1] == FINISHED
+    assert l == {'x': 5, 'a': 10, 'b': [10, 11], 'c': 2}
+    assert vm.stack is stack
+    assert not hasattr(vm, '__dict__')
+
+
+def test_pool():
+    pool = VMPool(max_size=2, gas_limit=1000)
+    code = compile(SOURCE, '<example>', 'exec')
+    with pool.borrow(code, {'len': len}, {'x': 1}, dict()) as vm1:
+        vm1.run(100)
+    vm2 = pool.acquire(code, {'len': len}, {'x': 2}, dict(), gas_limit=5)
+    assert vm1 is vm2 and vm2.gas_limit == 5
+    assert vm2.run(100)[1] == OUT_OF_GAS
+    pool.release(vm2)
+    assert (pool.created, pool.reused, len(pool)) == (1, 1, 1)
+
+
+def test_pool_threads():
+    pool = VMPool()
+    code = compile(SOURCE, '<example>', 'exec')
+    errors = list()
+
+    def work(n):
+        for i in range(200):
+            l = {'x': n * 1000 + i}
+            with pool.borrow(code, {'len': len}, l, dict()) as vm:
+                vm.run(100)
+                if l['a'] != (n * 1000 + i) * 2:
+                    errors.append(l)
+
+    threads = [Thread(target=work, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert pool.created + pool.reused == 800
+    assert pool.created <= 4
+
+
+def test_pool_function_globals():
+    # a function reads X by LOAD_GLOBAL, its inline cache is kept by the VM
+    code = compile("def read():\n    return X\nr = read()\n", '<example>', 'exec')
+    pool = VMPool(max_size=1)
+    results = list()
+    for name in ('alice', 'bob'):
+        g = {'X': name}
+        with pool.borrow(code, {}, g, g) as vm:
+            assert vm.run(100)[1] == FINISHED
+            results.append(g['r'])
+    assert results == ['alice', 'bob'] and pool.reused == 1
@@ -0,0 +1,44 @@
+from rpvm.vm import *
+from rpvm.profiler import line_table
+import dis
+
+SOURCE = """
+total = 0
+for i in range(50):
+    total = total + 2
+"""
+
+
+def test_profile():
+    code = compile(SOURCE, '<example>', 'exec')
+    for optimize in (False, True):
+        l = {'range': range}
+        vm = VirtualMachine(code, {}, l, l, optimize=optimize, engine=BLOCKS)
+        profiler = vm.profile()
+        assert vm.run(10000) == (vm.steps, FINISHED)
+        assert l['total'] == 100
+        stats = dict((name, count) for name, count, _ in profiler.opcode_stats())
+        assert stats['FOR_ITER'] == 51
+        if optimize:
+            # counted at the first instruction
+            assert stats['NAME_CONST_BINARY_STORE'] == 50 and 'BINARY_ADD' not in stats
+        # offsets of the host bytecode
+        offsets = {instr.opname: instr.offset for instr in reversed(list(dis.get_instructions(code)))}
+        hot = profiler.hot_offsets()
+        assert hot[0][1:5] == (offsets['FOR_ITER'], 3, 'FOR_ITER', 51)
+        assert (4, 'NAME_CONST_BINARY_STORE' if optimize else 'LOAD_NAME', 50) in [item[2:5] for item in hot]
+        assert 'usec' in profiler.report()
+        profiler.detach()
+        assert vm._dispatch is dispatch_table
+
+
+def test_timing():
+    code = compile(SOURCE, '<example>', 'exec')
+    l = {'range': range}
+    vm = VirtualMachine(code, {}, l, l)
+    profiler = vm.profile(timing=True)
+    while not vm.finish:
+        vm.exec()
+    assert sum(count for _, count, _ in profiler.opcode_stats()) == vm.steps
+    assert all(0.0 < seconds for _, _, seconds in profiler.opcode_stats())
+    assert line_table(code)[vm.program.offset(0) // 2] == 2
@@ -0,0 +1,50 @@
+from rpvm.vm import *
+from time import monotonic
+
+
+SOURCE = """
+a = 0
+for i in range(1000):
+    a += i
+"""
+
+
+def test_quantum():
+    code = compile(SOURCE, '<example>', 'exec')
+    l = dict()
+    vm = VirtualMachine(code, {'range': range}, l, dict())
+    steps, status = vm.run(100)
+    assert (steps, status) == (100, OUT_OF_STEPS)
+    total = steps
+    while status == OUT_OF_STEPS:
+        steps, status = vm.run(100)
+        total += steps
+    assert status == FINISHED
+    assert total == vm.steps
+    assert l['a'] == sum(range(1000))
+    assert vm.run(100) == (0, FINISHED)
+
+
+def test_same_steps_as_exec():
+    code = compile(SOURCE, '<example>', 'exec')
+    vm1 = VirtualMachine(code, {'range': range}, dict(), dict())
+    while not vm1.finish:
+        vm1.exec()
+    vm2 = VirtualMachine(code, {'range': range}, dict(), dict())
+    assert vm2.run(10 ** 6) == (vm1.steps, FINISHED)
+
+
+def test_deadline():
+    code = compile(SOURCE, '<example>', 'exec')
+    vm = VirtualMachine(code, {'range': range}, dict(), dict())
+    assert vm.run(10 ** 6, deadline=monotonic() - 1) == (0, OUT_OF_TIME)
+    assert vm.run(10 ** 6, deadline=monotonic() + 60)[1] == FINISHED
+
+
+def test_error():
+    code = compile("a = 1 // 0\n", '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), dict(), dict())
+    steps, status = vm.run(100)
+    assert status == ERROR and steps == 3
+    assert isinstance(vm.error, ZeroDivisionError)
+    assert vm.run(100) == (0, ERROR)
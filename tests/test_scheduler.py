@@ -0,0 +1,50 @@
+from rpvm.vm import *
+from rpvm.scheduler import Scheduler
+import asyncio
+
+LOOP = compile("""
+total = 0
+for i in range(n):
+    total += i
+""", '<example>', 'exec')
+
+
+def make_vm(n, gas_limit=None):
+    namespace = {'range': range, 'n': n}
+    return VirtualMachine(LOOP, {}, namespace, namespace, gas_limit=gas_limit)
+
+
+def test_round_robin():
+    scheduler = Scheduler(quantum=10)
+    retired = list()
+    jobs = [scheduler.add(make_vm(n), priority=p, callback=retired.append)
+            for n, p in ((30, 1), (30, 3), (2, 1))]
+    # one slice each in order, the high priority job runs 3 times longer
+    assert [scheduler.run_once() for _ in range(3)] == jobs
+    assert [job.steps for job in jobs] == [10, 30, 10]
+    scheduler.run()
+    assert len(scheduler) == 0 and scheduler.retired == 3
+    assert retired[0] is jobs[2]
+    for job in jobs:
+        assert job.status == FINISHED
+        assert job.vm.locals['total'] == sum(range(job.vm.locals['n']))
+    assert scheduler.tenant(None).steps == sum(job.steps for job in jobs)
+
+
+def test_quota_and_gas_slice():
+    scheduler = Scheduler(quantum=1000, quantum_gas=20)
+    job = scheduler.add(make_vm(20), tenant='alice')
+    other = scheduler.add(make_vm(20, gas_limit=30), tenant='bob')
+    scheduler.set_quota('alice', max_steps=50)
+    assert scheduler.run_once() is job and job.vm.gas_used <= 20 and not job.done
+    assert asyncio.get_event_loop().run_until_complete(scheduler.run_until_idle()) > 0
+    # bob's VM used up its own gas limit, alice waits for quota
+    assert other.status == OUT_OF_GAS and other.done
+    assert job.steps == 50 and not job.done and len(scheduler) == 1
+    assert scheduler.run_once() is None
+    scheduler.refill('alice')
+    scheduler.run()
+    assert job.steps == 100 and not job.done
+    scheduler.set_quota('alice')
+    scheduler.run()
+    assert job.status == FINISHED and job.vm.locals['total'] == 190
@@ -0,0 +1,102 @@
+from rpvm.vm import *
+from rpvm.frame import Function
+from rpvm.snapshot import merge, fingerprint, HEADER, MAGIC, SNAPSHOT_VERSION, FULL
+import pickle
+import zlib
+import os
+
+SOURCE = """
+total = 0
+items = []
+for i in range(40):
+    total += i
+    items.append(total)
+    if i == 30:
+        del big
+result = (total, len(items))
+"""
+
+
+def execute(**kwargs):
+    code = compile(SOURCE, '<example>', 'exec')
+    g = {'big': list(range(2000))}
+    vm = VirtualMachine(code, {'range': range, 'len': len}, g, g, **kwargs)
+    return code, vm
+
+
+def test_resume():
+    code, vm1 = execute()
+    assert vm1.run(10 ** 5) == (vm1.steps, FINISHED)
+    code, vm2 = execute(gas_limit=10 ** 5)
+    assert vm2.run(101)[1] == OUT_OF_STEPS  # stops inside the for loop
+    vm3 = VirtualMachine.restore(vm2.snapshot(), code, {'range': range, 'len': len})
+    assert vm3.pc == vm2.pc and vm3.steps == 101 and vm3.gas_limit == 10 ** 5
+    assert vm3.run(10 ** 5)[1] == FINISHED
+    assert vm3.steps == vm1.steps and vm3.gas_used == vm1.gas_used
+    assert vm3.locals == vm1.locals
+
+
+def test_delta():
+    code, vm1 = execute()
+    vm1.run(50)
+    full = vm1.snapshot()
+    vm1.run(50)
+    delta = vm1.snapshot(delta=True)
+    assert len(delta) < len(full) // 4  # `big` is not sent again
+    vm2 = VirtualMachine.restore(delta, code, {'range': range, 'len': len}, previous=full)
+    assert vm2.locals == vm1.locals and vm2.pc == vm1.pc
+    # chain of deltas, `big` is deleted
+    merged = merge(full, delta, code)
+    vm1.run(10 ** 5)
+    vm3 = VirtualMachine.restore(vm1.snapshot(delta=True), code, dict(), previous=merged)
+    assert 'big' not in vm3.globals
+    assert vm3.locals == vm1.locals and vm3.finish
+
+
+def test_broken():
+    code, vm = execute()
+    vm.run(10)
+    data = vm.snapshot()
+    other = compile("a = 1\n", '<example>', 'exec')
+    for args in ((b'XXXX' + data[4:], code), (data, other), (data[:-5], code)):
+        try:
+            VirtualMachine.restore(args[0], args[1], dict())
+        except SnapshotError:
+            pass
+        else:
+            assert False
+    try:
+        VirtualMachine.restore(vm.snapshot(delta=True), code, dict())
+    except SnapshotError:
+        pass
+    else:
+        assert False
+
+
+class Shell(object):
+    def __reduce__(self):
+        return os.getcwd, ()
+
+
+def test_forged():
+    code, vm = execute()
+    vm.run(10)
+    other = compile("def f():\n    return 1\n", '<example>', 'exec')
+    state = pickle.loads(zlib.decompress(vm.snapshot()[HEADER.size:]))
+    header = HEADER.pack(MAGIC, SNAPSHOT_VERSION, FULL, fingerprint(code), bytes(8), bytes(8))
+    # a host function, and a function with code which is not in the contract
+    for value in (Shell(), Function(other.co_consts[0], 'f')):
+        state['globals']['x'] = value
+        data = header + zlib.compress(pickle.dumps(state))
+        try:
+            VirtualMachine.restore(data, code, {'range': range, 'len': len})
+        except SnapshotError as e:
+            assert 'not allowed' in str(e)
+        else:
+            assert False
+    # functions of the contract are restored with their code
+    code = compile("def f():\n    return 1\ng = f\n", '<example>', 'exec')
+    vm = VirtualMachine(code, {}, {}, {})
+    vm.run(4)
+    vm = VirtualMachine.restore(vm.snapshot(), code, {})
+    assert vm.run(10)[1] == FINISHED and vm.locals['g'].code is code.co_consts[0]
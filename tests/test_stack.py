@@ -0,0 +1,34 @@
+from rpvm.vm import VirtualMachine
+from .utils import source_execute
+
+
+def test_call_and_unpack():
+    source = """
+a = max(3, 9, 4)
+b = divmod(17, 5)
+c, d = b
+e = sorted([3, 1, 2], reverse=True)
+f = {'x': 1, 'y': 2}
+f['z'] = c
+del f['x']
+g = a if c > d else d
+h = (1 > 2) or (3 < 4) and 5
+i = [1, 2, 3, 4, 5][1:4]
+"""
+    source_execute(source, {'max': max, 'divmod': divmod, 'sorted': sorted})
+
+
+def test_deep_stack():
+    # 400 operands are pushed before BUILD_LIST
+    source = "a = [" + ", ".join("b + {}".format(i) for i in range(400)) + "]\n"
+    source = "b = 1\n" + source
+    source_execute(source)
+
+
+def test_peek():
+    code = compile("a = (1, 2)\n", '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), dict(), dict())
+    vm.exec()
+    assert vm.peek() == (1, 2)
+    vm.stack.append(3)
+    assert vm.peek(0) == 3 and vm.peek(1) == (1, 2)
@@ -0,0 +1,110 @@
+from rpvm.vm import *
+from rpvm.storage import Storage, StorageError, dumps, loads
+
+SOURCE = """
+counter = counter + 1
+history.append(counter)
+del old
+new = [counter] * 2
+"""
+
+
+def setup(path=':memory:'):
+    storage = Storage(path)
+    g = storage.namespace('contract1')
+    g.update({'counter': 1, 'history': [], 'old': 0})
+    for i in range(1000):
+        g['unused{}'.format(i)] = i
+    g.commit()
+    return storage
+
+
+def execute(storage):
+    g = storage.namespace('contract1')
+    code = compile(SOURCE, '<example>', 'exec')
+    vm = VirtualMachine(code, dict(), g, g)
+    assert vm.run(100)[1] == FINISHED
+    return g
+
+
+def test_lazy_load(tmp_path):
+    path = str(tmp_path / 'storage.db')
+    storage = setup(path)
+    storage.reads = storage.writes = 0
+    g = execute(storage)
+    assert storage.reads <= 5  # only touched keys, not 1000 unused ones
+    assert storage.writes == 0  # nothing before commit
+    g.commit()
+    assert storage.writes == 4  # counter, history modified in place, old, new
+    storage.close()
+    # reopen
+    g = Storage(path).namespace('contract1')
+    assert g['counter'] == 2 and g['history'] == [2] and g['new'] == [2, 2]
+    assert 'old' not in g
+    assert len(g) == 1003
+
+
+def test_rollback():
+    storage = setup()
+    g = execute(storage)
+    g.rollback()
+    g = storage.namespace('contract1')
+    assert g['counter'] == 1 and 'old' in g and 'new' not in g
+
+
+def test_write_back_bound():
+    storage = Storage()
+    g = storage.namespace('c', max_dirty=10)
+    for i in range(25):
+        g['k{}'.format(i)] = i
+    assert storage.writes == 22  # flushed twice in the transaction
+    g.rollback()
+    assert 'k0' not in storage.namespace('c')
+    try:
+        g['x'] = object()
+        g.commit()
+    except StorageError:
+        pass
+    else:
+        assert False
+
+
+def test_canonical_encoding():
+    values = [None, True, 0, -129, 2 ** 100, 1.5, 2j, 'aあ', b'b', bytearray(b'c'),
+              (1, [2, {3: {4}}]), frozenset({(1, 2), 'x'}), {'b': [], 1: None}]
+    for value in values:
+        data = dumps(value)
+        assert loads(data) == value and type(loads(data)) is type(value)
+    # same items in another order are same bytes
+    assert dumps({'k{}'.format(i) for i in range(50)}) == dumps({'k{}'.format(i) for i in reversed(range(50))})
+    assert dumps({'a': 1, 'b': 2}) == dumps({'b': 2, 'a': 1})
+    items = [1]
+    items.append(items)
+    for value in (items, object()):
+        try:
+            dumps(value)
+        except StorageError:
+            pass
+        else:
+            assert False
+
+
+def test_shared_transaction():
+    storage = setup()
+    a = storage.namespace('contract1')
+    b = storage.namespace('contract2')
+    b['x'] = 1
+    b.flush()
+    a['counter'] = 5
+    assert b['x'] == 1 and a['counter'] == 5
+    # a rollback drops rows flushed by the other namespace, they must not stay cached
+    a.rollback()
+    assert 'x' not in b and a['counter'] == 1
+    # committing one namespace writes buffered keys of the other
+    b['y'] = [2]
+    a['counter'] = 3
+    a.commit()
+    b.rollback()
+    assert b['y'] == [2] and a['counter'] == 3
+    other = storage.namespace('contract2')
+    assert other['y'] == [2] and 'x' not in other
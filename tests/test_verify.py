@@ -0,0 +1,79 @@
+from rpvm.vm import *
+from rpvm.verify import verify
+from rpvm.opcodes import *
+from rpvm.frontend import NATIVE
+from types import CodeType
+import pytest
+
+SOURCE = """
+a = [1, 2, 3]
+b = {'x': a[0], 'y': (a[1], a[2])}
+for i in range(3):
+    if i == 1:
+        continue
+    if i == 2 and b:
+        break
+    a.append(i * 2)
+c = a[-1] if a else None
+"""
+
+
+def make_code(co_code, consts=(None,), names=('a',)):
+    if not NATIVE:
+        pytest.skip('hand-written Python3.6 bytecode')
+    co = compile("a = 0\n", '<example>', 'exec')
+    return CodeType(
+        co.co_argcount, co.co_kwonlyargcount, co.co_nlocals, 8, co.co_flags,
+        bytes(co_code), consts, names, co.co_varnames, co.co_filename,
+        co.co_name, co.co_firstlineno, co.co_lnotab, co.co_freevars, co.co_cellvars)
+
+
+def check_error(co_code, **kwargs):
+    try:
+        verify(make_code(co_code, **kwargs), SUPPORTED_OPS)
+    except VerifyError as e:
+        return str(e)
+    else:
+        assert False, "not rejected"
+
+
+def test_max_stack():
+    code = compile(SOURCE, '<example>', 'exec')
+    program = verify(code, SUPPORTED_OPS)
+    assert 0 < program.max_stack <= code.co_stacksize
+    vm = VirtualMachine(code, {'range': range}, dict(), dict(), verify=True)
+    assert vm.program.max_stack == program.max_stack
+    assert vm.run(1000)[1] == FINISHED
+
+
+def test_reject():
+    # unsupported op
+    assert 'not supported' in check_error([LOAD_BUILD_CLASS, 0, RETURN_VALUE, 0])
+    # index
+    assert 'const index' in check_error([LOAD_CONST, 5, RETURN_VALUE, 0])
+    assert 'name index' in check_error([LOAD_NAME, 3, RETURN_VALUE, 0])
+    # jump target
+    assert 'jump target' in check_error([JUMP_ABSOLUTE, 40, LOAD_CONST, 0, RETURN_VALUE, 0])
+    # stack
+    assert 'underflow' in check_error([POP_TOP, 0, LOAD_CONST, 0, RETURN_VALUE, 0])
+    assert 'underflow' in check_error([LOAD_CONST, 0, BINARY_ADD, 0, LOAD_CONST, 0, RETURN_VALUE, 0])
+    assert 'underflow' in check_error([LOAD_CONST, 0, CALL_FUNCTION, 1, LOAD_CONST, 0, RETURN_VALUE, 0])
+    assert 'underflow' in check_error([LOAD_CONST, 0, ROT_THREE, 0, RETURN_VALUE, 0])
+    assert 'fall off' in check_error([LOAD_CONST, 0, STORE_NAME, 0])
+    # loop pushing one item each time
+    assert 'stack depth' in check_error([LOAD_CONST, 0, JUMP_ABSOLUTE, 0])
+    # blocks
+    assert 'outside a loop' in check_error([BREAK_LOOP, 0, LOAD_CONST, 0, RETURN_VALUE, 0])
+    assert 'without a block' in check_error([POP_BLOCK, 0, LOAD_CONST, 0, RETURN_VALUE, 0])
+
+
+def test_not_verified_by_default():
+    code = make_code([POP_TOP, 0, LOAD_CONST, 0, RETURN_VALUE, 0])
+    try:
+        VirtualMachine(code, dict(), dict(), dict(), verify=True)
+    except VerifyError:
+        pass
+    else:
+        assert False
+    vm = VirtualMachine(code, dict(), dict(), dict())
+    assert vm.run(10)[1] == ERROR
@@ -1,22 +1,29 @@
-from rpvm.vm import VirtualMachine
+from rpvm.vm import VirtualMachine, ERROR, INTERPRETER, BLOCKS
+from rpvm.namespace import share_builtins
 from RestrictedPython import safe_builtins
 
+SHARED_BUILTINS = share_builtins(safe_builtins)
+
 
 def source_execute(source, add_buildins=None, max_steps=5000):
-    """compile source, execute by VM, eval and compare result"""
+    """compile source, execute by VM of both engines, eval and compare result"""
     # compile
     code = compile(source=source, filename='<example>', mode='exec')
     # vm
     b = safe_builtins.copy()
     if add_buildins:
         b.update(add_buildins)
-    l1 = dict()
-    g1 = dict()
-    vm = VirtualMachine(code, b, l1, g1)
-    steps = 0
-    while not vm.finish and steps < max_steps:
-        vm.exec()
-        steps += 1
+    results = list()
+    for engine in (INTERPRETER, BLOCKS):
+        l1 = dict()
+        g1 = dict()
+        vm = VirtualMachine(code, SHARED_BUILTINS, l1, g1, engine=engine)
+        vm.buildins.update(add_buildins or dict())
+        steps, status = vm.run(max_steps)
+        if status == ERROR:
+            raise vm.error
+        results.append((steps, status, vm.gas_used, l1, g1, vm.return_value))
+    assert results[0] == results[1], "{} X {}".format(*results)
     # eval
     l2 = dict()
     g2 = {'__builtins__': b}